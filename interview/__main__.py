@@ -1,10 +1,265 @@
+import argparse
+import asyncio
 import json
+import os
+import signal
 import sys
-from . import weather
+import time
+from typing import Any, Iterable, Iterator, List, Optional, Union
+from . import (
+    binary, checkpoint, merge, replay, server, sharded, streams, tenants, weather,
+)
+from .quantiles import QuantileStationStore
+from .spill import SpillingStationStore
+from .state import StationStore
+from .window import WindowedStationStore
 
-def generate_input():
-    for line in sys.stdin:
-        yield json.loads(line)
 
-for output in weather.process_events(generate_input()):
-    print(json.dumps(output))
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m interview')
+    parser.add_argument(
+        '--chunk-size', type=int, default=streams.DEFAULT_CHUNK_SIZE,
+        help='bytes to read from stdin or a connection at a time',
+    )
+    parser.add_argument(
+        '--input', metavar='PATH',
+        help='replay JSON lines from a memory-mapped file instead of stdin, '
+             'reporting the byte offset reached to stderr',
+    )
+    parser.add_argument(
+        '--start-offset', type=int, default=0,
+        help='with --input, start at this byte offset, as reported by an earlier run',
+    )
+    parser.add_argument(
+        '--source', action='append', metavar='SOURCE',
+        help='read from this file, FIFO, tcp:HOST:PORT or unix:PATH socket instead of '
+             'stdin; repeat to merge several sources, each ordered by timestamp',
+    )
+    parser.add_argument(
+        '--listen', metavar='ADDRESS',
+        help='serve producers on HOST:PORT or unix:PATH instead of reading stdin, '
+             'replying on the connection that sent each control message',
+    )
+    parser.add_argument(
+        '--input-format', choices=('auto', 'json', 'binary'), default='auto',
+        help='JSON lines or the binary format of interview.binary; auto detects it',
+    )
+    parser.add_argument(
+        '--flush-interval-ms', type=float, default=0,
+        help='flush output at most this often; 0 flushes after every output',
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='aggregate samples in this many processes, partitioned by station; '
+             'with --input, replay the segments between resets in parallel',
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=weather.DEFAULT_BATCH_SIZE,
+        help='number of consecutive samples to aggregate at a time',
+    )
+    parser.add_argument(
+        '--metrics', action='store_true',
+        help='record event counts and timings, reported by the stats command',
+    )
+    parser.add_argument(
+        '--stats-interval-s', type=float, default=0,
+        help='also dump metrics to stderr this often (implies --metrics)',
+    )
+    parser.add_argument(
+        '--checkpoint', metavar='PATH',
+        help='periodically save the aggregator state to PATH',
+    )
+    parser.add_argument(
+        '--checkpoint-every', type=int, default=1_000_000,
+        help='events between checkpoints',
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='restore from --checkpoint if it exists and skip the input events it covers',
+    )
+    parser.add_argument(
+        '--window-ms', type=int,
+        help='also keep high/low over this sliding window, for window_snapshot',
+    )
+    parser.add_argument(
+        '--percentile-compression', type=int, metavar='N',
+        help='also keep a t-digest of at most about N centroids per station, for percentiles',
+    )
+    parser.add_argument(
+        '--max-streams', type=int, metavar='N',
+        help='keep separate state for each "stream" key of the messages, '
+             'allowing at most N streams',
+    )
+    parser.add_argument(
+        '--idle-events', type=int, default=tenants.DEFAULT_IDLE_EVENTS, metavar='N',
+        help='with --max-streams, compact the state of streams without messages '
+             'in the last N events',
+    )
+    parser.add_argument(
+        '--max-resident-stations', type=int, metavar='N',
+        help='keep at most about N stations in memory, spilling the least recently '
+             'updated ones to disk',
+    )
+    parser.add_argument(
+        '--spill-dir', metavar='PATH',
+        help='with --max-resident-stations, the directory for spilled stations',
+    )
+    args = parser.parse_args(argv)
+    args.metrics = args.metrics or args.stats_interval_s > 0
+    if args.workers > 1 and args.checkpoint is not None:
+        parser.error('--workers and --checkpoint cannot be combined')
+    if args.window_ms is not None and (args.workers > 1 or args.checkpoint):
+        parser.error('--window-ms cannot be combined with --workers or --checkpoint')
+    if args.percentile_compression is not None and (
+            args.workers > 1 or args.checkpoint or args.window_ms is not None):
+        parser.error('--percentile-compression cannot be combined with --workers, '
+                     '--checkpoint or --window-ms')
+    if args.resume and args.checkpoint is None:
+        parser.error('--resume requires --checkpoint')
+    if args.input is not None and (args.checkpoint or args.workers > 1 and args.metrics):
+        parser.error('--input cannot be combined with --checkpoint, nor with --workers '
+                     'and --metrics together')
+    if args.input is not None and args.input_format == 'binary':
+        parser.error('--input reads JSON lines only')
+    if args.listen is not None and (args.input is not None or args.metrics
+                                    or args.checkpoint or args.workers > 1):
+        parser.error('--listen cannot be combined with --input, --metrics, --checkpoint '
+                     'or --workers')
+    if args.source and (args.input is not None or args.listen is not None or args.checkpoint):
+        parser.error('--source cannot be combined with --input, --listen or --checkpoint')
+    if args.max_streams is not None and any([
+            args.input is not None, args.checkpoint, args.workers > 1,
+            args.window_ms is not None, args.percentile_compression is not None]):
+        parser.error('--max-streams cannot be combined with --input, --checkpoint, '
+                     '--workers, --window-ms or --percentile-compression')
+    if args.max_resident_stations is not None and any([
+            args.checkpoint, args.workers > 1, args.window_ms is not None,
+            args.percentile_compression is not None, args.max_streams is not None]):
+        parser.error('--max-resident-stations cannot be combined with --checkpoint, '
+                     '--workers, --window-ms, --percentile-compression or --max-streams')
+    if args.spill_dir is not None and args.max_resident_stations is None:
+        parser.error('--spill-dir requires --max-resident-stations')
+    if args.start_offset and args.input is None:
+        parser.error('--start-offset requires --input')
+    return args
+
+
+def read_input(args: argparse.Namespace, skip: int = 0) -> Iterator[Any]:
+    if args.source:
+        return merge.read_sources(args.source, args.chunk_size, args.input_format)
+    return binary.read_input(sys.stdin.buffer, args.chunk_size, skip, args.input_format)
+
+
+def write_outputs(
+    outputs: Iterable[dict[str, Any]],
+    writer: streams.OutputWriter,
+    metrics: Optional[weather.Metrics],
+) -> None:
+    if metrics is None:
+        for output in outputs:
+            writer.write(output)
+        return
+    for output in outputs:
+        start = time.perf_counter_ns()
+        writer.write(output)
+        metrics.record('serialize', time.perf_counter_ns() - start)
+
+
+def write_checkpointed(
+    args: argparse.Namespace, writer: streams.OutputWriter, metrics: Optional[weather.Metrics]
+) -> None:
+    if args.resume and os.path.exists(args.checkpoint):
+        aggregator = checkpoint.load(args.checkpoint)
+    else:
+        aggregator = weather.Aggregator()
+    aggregator.metrics = metrics
+    events = read_input(args, aggregator.position)
+    with checkpoint.Checkpointer(args.checkpoint) as checkpointer:
+        write_outputs(checkpoint.process_with_checkpoints(
+            aggregator, events, checkpointer, args.checkpoint_every, args.batch_size
+        ), writer, metrics)
+
+
+def report_offset(path: str, offset: int) -> None:
+    """Write where a replay stopped, and where it can be resumed exactly, to stderr."""
+    reset_offset = replay.last_reset_boundary(path, offset)
+    print(json.dumps({'type': 'offset', 'offset': offset, 'resetOffset': reset_offset}),
+          file=sys.stderr, flush=True)
+
+
+def write_parallel_replay(args: argparse.Namespace, writer: streams.OutputWriter) -> None:
+    parallel = replay.ParallelReplay(args.input, args.workers, args.start_offset)
+    try:
+        for lines in parallel.outputs(args.chunk_size, args.batch_size):
+            writer.write_line(lines)
+    finally:
+        report_offset(args.input, parallel.offset)
+
+
+def make_aggregator(
+    args: argparse.Namespace, metrics: Optional[weather.Metrics] = None
+) -> Union[weather.Aggregator, tenants.StreamAggregators]:
+    if args.max_streams is not None:
+        return tenants.StreamAggregators(args.max_streams, args.idle_events, metrics)
+    if args.window_ms is not None:
+        stations: StationStore = WindowedStationStore(args.window_ms)
+    elif args.percentile_compression is not None:
+        stations = QuantileStationStore(args.percentile_compression)
+    elif args.max_resident_stations is not None:
+        stations = SpillingStationStore(args.max_resident_stations, args.spill_dir)
+    else:
+        stations = StationStore()
+    return weather.Aggregator(stations, metrics=metrics)
+
+
+def write_replay(
+    args: argparse.Namespace, writer: streams.OutputWriter, metrics: Optional[weather.Metrics]
+) -> None:
+    aggregator = make_aggregator(args, metrics)
+    with streams.MappedFile(args.input, args.start_offset, args.chunk_size) as source:
+        try:
+            write_outputs(aggregator.process(source.events(), args.batch_size), writer, metrics)
+        finally:
+            # Reported even when the replay fails or is interrupted, so that it
+            # can be resumed with --start-offset.
+            report_offset(args.input, source.offset_after(aggregator.position))
+
+
+def run_server(args: argparse.Namespace) -> None:
+    producers = server.Server(make_aggregator(args), args.chunk_size, args.batch_size)
+    # Stop on SIGTERM as on Ctrl-C, closing the listener and its socket file.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(server.serve(args.listen, producers))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.listen is not None:
+        run_server(args)
+        return
+    metrics = weather.Metrics(sys.stderr, args.stats_interval_s) if args.metrics else None
+    with streams.OutputWriter(sys.stdout.buffer, args.flush_interval_ms) as writer:
+        if args.checkpoint:
+            write_checkpointed(args, writer, metrics)
+            return
+        if args.input is not None and args.workers > 1:
+            write_parallel_replay(args, writer)
+            return
+        if args.input is not None:
+            write_replay(args, writer, metrics)
+            return
+        events = read_input(args)
+        if args.workers > 1:
+            outputs = sharded.process_events_sharded(
+                events, args.workers, args.batch_size, metrics
+            )
+        else:
+            outputs = make_aggregator(args, metrics).process(events, args.batch_size)
+        write_outputs(outputs, writer, metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from multiprocessing.connection import Connection
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+from . import binary, streams, threaded, weather
+
+# Metrics where a larger value is a regression; everything else is "higher is better".
+LOWER_IS_BETTER = (
+    'p50_snapshot_ms', 'p99_snapshot_ms', 'max_snapshot_ms', 'peak_rss_mb',
+    'json_bytes_per_event', 'binary_bytes_per_event',
+)
+
+
+@dataclass
+class StreamConfig:
+    """Shape of a synthetic sample/control stream."""
+    stations: int = 1000
+    length: int = 200_000
+    snapshot_every: int = 1000
+    reset_every: int = 0
+    name_length: int = 16
+    seed: int = 0
+
+
+SCENARIOS: Dict[str, StreamConfig] = {
+    'few_stations': StreamConfig(stations=10),
+    'many_stations': StreamConfig(stations=50_000, snapshot_every=20_000),
+    'frequent_snapshots': StreamConfig(stations=200, snapshot_every=50),
+    'resets': StreamConfig(stations=5000, snapshot_every=2000, reset_every=10_000),
+    'long_names': StreamConfig(name_length=128),
+}
+
+
+def generate_stream(config: StreamConfig) -> Iterator[dict[str, Any]]:
+    """Yield a reproducible stream of samples with periodic snapshots and resets."""
+    rng = random.Random(config.seed)
+    alphabet = string.ascii_letters + string.digits + ' '
+    names = [
+        f"{i}:" + ''.join(rng.choices(alphabet, k=max(config.name_length - len(str(i)) - 1, 0)))
+        for i in range(config.stations)
+    ]
+    timestamp = 1672531200000
+    for i in range(1, config.length + 1):
+        timestamp += rng.randint(0, 1000)
+        yield {
+            'type': 'sample',
+            'stationName': names[rng.randrange(config.stations)],
+            'timestamp': timestamp,
+            'temperature': round(rng.uniform(-20.0, 105.0), 1),
+        }
+        if config.snapshot_every and i % config.snapshot_every == 0:
+            yield {'type': 'control', 'command': 'snapshot'}
+        if config.reset_every and i % config.reset_every == 0:
+            yield {'type': 'control', 'command': 'reset'}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def rss_mb(usage: Any) -> float:
+    """Peak resident set size from a ``struct_rusage``, in MiB."""
+    return usage.ru_maxrss / ((1 << 20) if sys.platform == 'darwin' else 1024)
+
+
+def _measure_process_events(config: StreamConfig, conn: Connection) -> None:
+    events = list(generate_stream(config))
+    control_started = 0.0
+    latencies: List[float] = []
+
+    def timed() -> Iterator[dict[str, Any]]:
+        nonlocal control_started
+        for event in events:
+            if event['type'] == 'control':
+                control_started = time.perf_counter()
+            yield event
+
+    start = time.perf_counter()
+    for output in weather.process_events(timed()):
+        if output['type'] == 'snapshot':
+            latencies.append((time.perf_counter() - control_started) * 1000)
+    elapsed = time.perf_counter() - start
+    result: Dict[str, float] = {
+        'events_per_sec': len(events) / elapsed,
+        'peak_rss_mb': rss_mb(resource.getrusage(resource.RUSAGE_SELF)),
+    }
+    if latencies:
+        result.update({
+            'p50_snapshot_ms': percentile(latencies, 0.5),
+            'p99_snapshot_ms': percentile(latencies, 0.99),
+            'max_snapshot_ms': max(latencies),
+        })
+    conn.send(result)
+
+
+def measure_process_events(config: StreamConfig) -> Dict[str, float]:
+    """Throughput, snapshot latency and peak RSS of process_events, in a fresh process."""
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_measure_process_events, args=(config, child))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def measure_cli(config: StreamConfig, args: Optional[List[str]] = None) -> Dict[str, float]:
+    """Throughput and peak RSS of ``python -m interview`` reading the stream from stdin."""
+    with tempfile.TemporaryFile() as source:
+        count = 0
+        for event in generate_stream(config):
+            source.write(json.dumps(event).encode() + b'\n')
+            count += 1
+        source.seek(0)
+        start = time.perf_counter()
+        with subprocess.Popen(
+            [sys.executable, '-m', 'interview', *(args or [])],
+            stdin=source, stdout=subprocess.DEVNULL,
+        ) as process:
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.perf_counter() - start
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    return {'events_per_sec': count / elapsed, 'peak_rss_mb': rss_mb(usage)}
+
+
+def measure_decode(config: StreamConfig) -> Dict[str, float]:
+    """Decode throughput of the same stream as JSON lines and in the binary format."""
+    events = list(generate_stream(config))
+    json_data = b''.join(json.dumps(event).encode() + b'\n' for event in events)
+    binary_data = io.BytesIO()
+    with binary.BinaryWriter(binary_data) as writer:
+        for event in events:
+            writer.write(event)
+    inputs: Dict[str, Tuple[Callable[[BinaryIO], Iterator[Any]], bytes]] = {
+        'json': (streams.read_events, json_data),
+        'binary': (binary.read_events, binary_data.getvalue()),
+    }
+    result: Dict[str, float] = {}
+    for name, (read, data) in inputs.items():
+        start = time.perf_counter()
+        for _ in read(io.BytesIO(data)):
+            pass
+        result[f'{name}_events_per_sec'] = len(events) / (time.perf_counter() - start)
+        result[f'{name}_bytes_per_event'] = len(data) / len(events)
+    return result
+
+
+def _ingest_every(
+    aggregator: threaded.ConcurrentAggregator, batches: List[List[Any]], first: int, step: int
+) -> None:
+    for batch in batches[first::step]:
+        aggregator.ingest(batch)
+
+
+def measure_threaded(
+    config: StreamConfig, thread_counts: Tuple[int, ...] = (1, 4)
+) -> Dict[str, float]:
+    """Ingest throughput of ConcurrentAggregator with the samples split over threads.
+
+    The threads only scale on a free-threaded CPython; with the GIL the
+    figures show the cost of the locking instead.
+    """
+    samples = [event for event in generate_stream(config) if event['type'] == 'sample']
+    batches = [samples[start:start + weather.DEFAULT_BATCH_SIZE]
+               for start in range(0, len(samples), weather.DEFAULT_BATCH_SIZE)]
+    result: Dict[str, float] = {}
+    for count in thread_counts:
+        aggregator = threaded.ConcurrentAggregator()
+        threads = [
+            threading.Thread(target=_ingest_every, args=(aggregator, batches, first, count))
+            for first in range(count)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result[f'threads_{count}_events_per_sec'] = len(samples) / (time.perf_counter() - start)
+    return result
+
+
+def run(scenarios: Dict[str, StreamConfig]) -> Dict[str, Any]:
+    """Run every scenario through process_events, the CLI, both input decoders and threads."""
+    results: Dict[str, Any] = {}
+    for name, config in scenarios.items():
+        results[name] = {
+            'config': asdict(config),
+            'process_events': measure_process_events(config),
+            'cli': measure_cli(config),
+            'decode': measure_decode(config),
+            'threaded': measure_threaded(config),
+        }
+    return results
+
+
+def regressions(
+    baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """Describe every metric that is worse than the baseline by more than tolerance."""
+    found = []
+    for scenario, paths in current.items():
+        for path, metrics in paths.items():
+            if path == 'config':
+                continue
+            reference = baseline.get(scenario, {}).get(path, {})
+            for metric, value in metrics.items():
+                if metric not in reference:
+                    continue
+                expected = reference[metric]
+                if metric in LOWER_IS_BETTER:
+                    worse = value > expected * (1 + tolerance)
+                else:
+                    worse = value < expected * (1 - tolerance)
+                if worse:
+                    found.append(
+                        f"{scenario}/{path}/{metric}: {value:.4g} vs baseline {expected:.4g}"
+                    )
+    return found
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m interview.benchmark')
+    parser.add_argument('--baseline', default='benchmark_baseline.json',
+                        help='JSON file with baseline results')
+    parser.add_argument('--save', action='store_true',
+                        help='write the results to the baseline file instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='allowed relative regression before failing')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='run only these scenarios')
+    args = parser.parse_args(argv)
+
+    scenarios = {name: SCENARIOS[name] for name in args.scenario or SCENARIOS}
+    results = run(scenarios)
+    print(json.dumps(results, indent=2))
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        return 0
+    try:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}; run with --save to record one.", file=sys.stderr)
+        return 1
+    found = regressions(baseline, results, args.tolerance)
+    for line in found:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+from . import benchmark, weather
+
+def test_generate_stream_knobs():
+    config = benchmark.StreamConfig(
+        stations=5, length=100, snapshot_every=10, reset_every=50, name_length=12
+    )
+    events = list(benchmark.generate_stream(config))
+    samples = [event for event in events if event["type"] == "sample"]
+    commands = [event["command"] for event in events if event["type"] == "control"]
+    assert len(samples) == 100
+    assert commands.count("snapshot") == 10
+    assert commands.count("reset") == 2
+    assert len({sample["stationName"] for sample in samples}) <= 5
+    assert all(len(sample["stationName"]) == 12 for sample in samples)
+    timestamps = [sample["timestamp"] for sample in samples]
+    assert timestamps == sorted(timestamps)
+
+def test_generate_stream_is_reproducible():
+    config = benchmark.StreamConfig(length=50)
+    assert list(benchmark.generate_stream(config)) == list(benchmark.generate_stream(config))
+
+def test_generated_stream_is_valid_input():
+    config = benchmark.StreamConfig(stations=3, length=20, snapshot_every=5, reset_every=10)
+    outputs = list(weather.process_events(benchmark.generate_stream(config)))
+    assert [output["type"] for output in outputs].count("reset") == 2
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert benchmark.percentile(values, 0.5) == 51.0
+    assert benchmark.percentile(values, 0.99) == 100.0
+
+def test_regressions_respect_direction_and_tolerance():
+    baseline = {"s": {"cli": {"events_per_sec": 1000.0, "peak_rss_mb": 100.0}}}
+    within = {"s": {"config": {}, "cli": {"events_per_sec": 900.0, "peak_rss_mb": 110.0}}}
+    assert not benchmark.regressions(baseline, within, 0.15)
+    slower = {"s": {"cli": {"events_per_sec": 800.0, "peak_rss_mb": 90.0}}}
+    assert benchmark.regressions(baseline, slower, 0.15) == [
+        "s/cli/events_per_sec: 800 vs baseline 1000"
+    ]
+    bigger = {"s": {"cli": {"events_per_sec": 2000.0, "peak_rss_mb": 120.0}}}
+    assert benchmark.regressions(baseline, bigger, 0.15) == [
+        "s/cli/peak_rss_mb: 120 vs baseline 100"
+    ]
@@ -0,0 +1,230 @@
+"""Compact binary framing for input events.
+
+A stream starts with ``MAGIC`` and is followed by records, each a one-byte
+tag and a little-endian length or count:
+
+* ``N`` u32 length, then names, each a u32 length and UTF-8 bytes: defines
+  the next station ids (0, 1, ...) in order
+* ``S`` u32 count, then count fixed 20-byte samples of u32 station id,
+  i64 timestamp and f64 temperature
+* ``J`` u32 length, JSON document: any other event, passed through as is
+
+Runs of samples are decoded with ``struct.iter_unpack`` over a memoryview,
+with no per-field string parsing.
+"""
+import argparse
+import itertools
+import json
+import struct
+import sys
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional
+from . import streams
+
+MAGIC = b'WXBIN1\n'
+SAMPLE = struct.Struct('<Iqd')
+HEADER = struct.Struct('<cI')
+LENGTH = struct.Struct('<I')
+DEFAULT_BLOCK_SIZE = 4096
+
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+
+class _Reader:
+    """Hands out exact-size byte ranges from a stream of chunks."""
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._data = b''
+        self._pos = 0
+
+    def take(self, size: int) -> bytes:
+        """Return the next size bytes, or fewer only at the end of the stream."""
+        end = self._pos + size
+        while len(self._data) < end:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._data = self._data[self._pos:] + chunk
+            end -= self._pos
+            self._pos = 0
+        data = self._data[self._pos:end]
+        self._pos = min(end, len(self._data))
+        return data
+
+    def take_exactly(self, size: int) -> bytes:
+        """Return the next size bytes, failing on a truncated stream."""
+        data = self.take(size)
+        if len(data) < size:
+            raise ValueError("Please verify input. Truncated binary record.")
+        return data
+
+
+def _decode_names(payload: bytes) -> Iterator[str]:
+    pos = 0
+    while pos < len(payload):
+        if pos + LENGTH.size > len(payload):
+            raise ValueError("Please verify input. Truncated binary record.")
+        (size,) = LENGTH.unpack_from(payload, pos)
+        pos += LENGTH.size + size
+        if pos > len(payload):
+            raise ValueError("Please verify input. Truncated binary record.")
+        yield payload[pos - size:pos].decode()
+
+
+def _samples(block: memoryview, names: List[str]) -> List[dict[str, Any]]:
+    """Decode a block of packed samples; an undefined station id raises IndexError."""
+    return [
+        {
+            'type': 'sample',
+            'stationName': names[station],
+            'timestamp': timestamp,
+            'temperature': temperature,
+        }
+        for station, timestamp, temperature in SAMPLE.iter_unpack(block)
+    ]
+
+
+def decode(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Lazily decode events from a binary stream, given as chunks of bytes."""
+    reader = _Reader(chunks)
+    if reader.take(len(MAGIC)) != MAGIC:
+        raise ValueError("Please verify input. Binary input must start with the magic header.")
+    names: List[str] = []
+    while True:
+        header = reader.take(HEADER.size)
+        if not header:
+            return
+        if len(header) < HEADER.size:
+            raise ValueError("Please verify input. Truncated binary record.")
+        tag, size = HEADER.unpack(header)
+        if tag == b'S':
+            block = memoryview(reader.take_exactly(size * SAMPLE.size))
+            try:
+                events = _samples(block, names)
+            except IndexError:
+                # Deliver the samples before the first undefined station id.
+                cut = 0
+                for station, _, _ in SAMPLE.iter_unpack(block):
+                    if station >= len(names):
+                        break
+                    cut += 1
+                yield from _samples(block[:cut * SAMPLE.size], names)
+                raise ValueError("Please verify input. Undefined binary station id.") from None
+            yield from events
+        elif tag == b'N':
+            names.extend(_decode_names(reader.take_exactly(size)))
+        elif tag == b'J':
+            yield json.loads(reader.take_exactly(size))
+        else:
+            raise ValueError(f"Please verify input. Unknown binary record tag: {tag!r}")
+
+
+def read_events(stream: BinaryIO, chunk_size: int = streams.DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    """Lazily decode events from a binary stream."""
+    return decode(streams.read_chunks(stream, chunk_size))
+
+
+def read_input(
+    stream: BinaryIO,
+    chunk_size: int = streams.DEFAULT_CHUNK_SIZE,
+    skip: int = 0,
+    input_format: str = 'auto',
+) -> Iterator[Any]:
+    """Lazily decode events in either input format, skipping the first skip events.
+
+    With ``input_format`` 'auto' the format is detected from the magic header;
+    'json' and 'binary' force one. JSON lines are skipped undecoded.
+    """
+    if input_format == 'json':
+        return streams.read_events(stream, chunk_size, skip)
+    head = stream.read(len(MAGIC)) if input_format == 'auto' else b''
+    chunks = itertools.chain([head], streams.read_chunks(stream, chunk_size))
+    if input_format == 'auto' and head != MAGIC:
+        return streams.decode_chunks(chunks, skip)
+    return itertools.islice(decode(chunks), skip, None)
+
+
+class BinaryWriter:
+    """Encodes events into the binary format."""
+
+    def __init__(self, stream: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> None:
+        self._stream = stream
+        self._block_size = block_size
+        self._ids: Dict[str, int] = {}
+        self._names: List[bytes] = []
+        self._samples: List[bytes] = []
+        stream.write(MAGIC)
+
+    def _sample_record(self, event: Any) -> Optional[bytes]:
+        """Pack a well-formed sample, or return None for anything else."""
+        if not isinstance(event, dict) or event.get('type') != 'sample':
+            return None
+        station: Any = event.get('stationName')
+        timestamp: Any = event.get('timestamp')
+        temperature: Any = event.get('temperature')
+        # Exact types, as in weather.ingest_samples: bool timestamps stay JSON.
+        if ((type(station), type(timestamp)) != (str, int)
+                or type(temperature) not in (int, float)
+                or not _INT64_MIN <= timestamp <= _INT64_MAX):
+            return None
+        try:
+            packed_temperature = float(temperature)
+        except OverflowError:
+            return None
+        station_id = self._ids.get(station)
+        if station_id is None:
+            # New names are written just ahead of the samples that use them.
+            name = station.encode()
+            self._names.append(LENGTH.pack(len(name)) + name)
+            station_id = self._ids[station] = len(self._ids)
+        return SAMPLE.pack(station_id, timestamp, packed_temperature)
+
+    def _flush_samples(self) -> None:
+        if self._names:
+            names = b''.join(self._names)
+            self._stream.write(HEADER.pack(b'N', len(names)) + names)
+            self._names = []
+        if self._samples:
+            self._stream.write(HEADER.pack(b'S', len(self._samples)) + b''.join(self._samples))
+            self._samples = []
+
+    def write(self, event: Any) -> None:
+        """Append one event."""
+        record = self._sample_record(event)
+        if record is None:
+            self._flush_samples()
+            document = json.dumps(event).encode()
+            self._stream.write(HEADER.pack(b'J', len(document)) + document)
+            return
+        self._samples.append(record)
+        if len(self._samples) >= self._block_size:
+            self._flush_samples()
+
+    def close(self) -> None:
+        """Write any buffered samples."""
+        self._flush_samples()
+        self._stream.flush()
+
+    def __enter__(self) -> 'BinaryWriter':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog='python -m interview.binary',
+        description='Convert JSON lines on stdin to the binary input format on stdout.',
+    )
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help='maximum samples per sample record')
+    args = parser.parse_args(argv)
+    with BinaryWriter(sys.stdout.buffer, args.block_size) as writer:
+        for event in streams.read_events(sys.stdin.buffer):
+            writer.write(event)
+
+
+if __name__ == '__main__':
+    main()
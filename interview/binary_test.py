@@ -0,0 +1,80 @@
+import io
+import json
+import pytest
+from . import binary, weather
+
+EVENTS = [
+    {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.5},
+    {"type": "sample", "stationName": "🚁 B\n", "timestamp": -2, "temperature": -5},
+    {"type": "control", "command": "snapshot"},
+    {"type": "sample", "stationName": "A", "timestamp": 9223372036854775808, "temperature": 20.0},
+    {"type": "sample", "stationName": "C", "timestamp": "3", "temperature": 1.0},
+    {"type": "sample", "stationName": "C", "timestamp": True, "temperature": 1.0},
+    {"type": "control", "command": "reset"},
+    {"type": "sample", "stationName": "C", "timestamp": 10, "temperature": 1.0},
+]
+
+def encode(events, block_size=binary.DEFAULT_BLOCK_SIZE):
+    stream = io.BytesIO()
+    with binary.BinaryWriter(stream, block_size) as writer:
+        for event in events:
+            writer.write(event)
+    return stream.getvalue()
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize("block_size", [1, 2, 4096])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_round_trip(block_size, chunk_size):
+    decoded = list(binary.decode(chunked(encode(EVENTS, block_size), chunk_size)))
+    assert decoded == EVENTS
+    assert isinstance(decoded[1]["temperature"], float)
+
+def test_samples_are_fixed_size_records():
+    samples = [
+        {"type": "sample", "stationName": "A", "timestamp": i, "temperature": 1.0}
+        for i in range(100)
+    ]
+    names = binary.HEADER.size + binary.LENGTH.size + 1
+    assert len(encode(samples)) == (
+        len(binary.MAGIC) + names + binary.HEADER.size + 100 * binary.SAMPLE.size
+    )
+
+def test_outputs_match_json_input():
+    decoded = binary.read_events(io.BytesIO(encode(EVENTS[:4])))
+    assert list(weather.process_events(decoded)) == list(weather.process_events(EVENTS[:4]))
+
+def test_rejects_missing_magic():
+    with pytest.raises(ValueError, match="magic header"):
+        list(binary.decode([b'{"type": "control"}\n']))
+
+@pytest.mark.parametrize("cut", [1, 3, 10])
+def test_rejects_truncated_records(cut):
+    data = encode(EVENTS[:2])
+    with pytest.raises(ValueError, match="Truncated binary record"):
+        list(binary.decode([data[:-cut]]))
+
+def test_undefined_station_id_fails_after_the_samples_before_it():
+    data = encode(EVENTS[:2])
+    # Point the last sample of the record at a station that was never defined.
+    data = data[:len(data) - binary.SAMPLE.size] + binary.SAMPLE.pack(7, 3, 1.0)
+    decoded = []
+    with pytest.raises(ValueError, match="Undefined binary station id"):
+        for event in binary.decode([data]):
+            decoded.append(event)
+    assert decoded == EVENTS[:1]
+
+@pytest.mark.parametrize("input_format", ["auto", "json", "binary"])
+@pytest.mark.parametrize("skip", [0, 3])
+def test_read_input(input_format, skip):
+    if input_format == "binary":
+        data = encode(EVENTS)
+    else:
+        data = b"".join(json.dumps(event).encode() + b"\n" for event in EVENTS)
+    events = binary.read_input(io.BytesIO(data), 5, skip, input_format)
+    assert list(events) == EVENTS[skip:]
+
+def test_read_input_detects_binary():
+    events = binary.read_input(io.BytesIO(encode(EVENTS)), 5)
+    assert list(events) == EVENTS
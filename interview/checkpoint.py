@@ -0,0 +1,137 @@
+import json
+import os
+import sys
+import threading
+from array import array
+from itertools import islice
+from typing import Any, Generator, Iterable, List, Optional, Tuple
+from . import weather
+from .state import StationStore
+
+# Bump the version whenever the file layout changes.
+MAGIC = b'WXCKPT1\n'
+
+# (position, latest timestamp, names, highs, lows, dirty slots)
+State = Tuple[int, Optional[int], List[str], array, array, array]
+
+
+def capture(aggregator: weather.Aggregator) -> State:
+    """Copy the aggregator state; cheap enough to do between two events."""
+    names, highs, lows = aggregator.stations.columns()
+    dirty = array('q', aggregator.stations.dirty_slots())
+    return aggregator.position, aggregator.latest_timestamp, names, highs, lows, dirty
+
+
+def write(path: str, state: State) -> None:
+    """Atomically replace path with a checkpoint of state.
+
+    The file is the magic line, a JSON header line, the highs and lows columns
+    as raw doubles, the slots changed since the last snapshot as raw 64-bit
+    integers and finally the station names as a JSON array.
+    """
+    position, latest_timestamp, names, highs, lows, dirty = state
+    header = {
+        'position': position,
+        'asOf': latest_timestamp,
+        'stations': len(names),
+        'dirty': len(dirty),
+        'byteorder': sys.byteorder,
+    }
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as checkpoint_file:
+        checkpoint_file.write(MAGIC)
+        checkpoint_file.write(json.dumps(header).encode() + b'\n')
+        highs.tofile(checkpoint_file)
+        lows.tofile(checkpoint_file)
+        dirty.tofile(checkpoint_file)
+        checkpoint_file.write(json.dumps(names, ensure_ascii=False).encode())
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temp_path, path)
+
+
+def load(path: str) -> weather.Aggregator:
+    """Rebuild the aggregator saved in a checkpoint file."""
+    with open(path, 'rb') as checkpoint_file:
+        if checkpoint_file.readline() != MAGIC:
+            raise ValueError(f"{path} is not a checkpoint file")
+        header = json.loads(checkpoint_file.readline())
+        count = header['stations']
+        highs = array('d')
+        lows = array('d')
+        highs.fromfile(checkpoint_file, count)
+        lows.fromfile(checkpoint_file, count)
+        dirty: array = array('q')
+        dirty.fromfile(checkpoint_file, header['dirty'])
+        names = json.loads(checkpoint_file.read())
+    if header['byteorder'] != sys.byteorder:
+        for column in (highs, lows, dirty):
+            column.byteswap()
+    stations = StationStore.from_columns(names, highs, lows, dirty)
+    return weather.Aggregator(stations, header['asOf'], header['position'])
+
+
+class Checkpointer:
+    """Writes checkpoints to one path from a background thread.
+
+    Only the state capture happens on the caller's thread. A new checkpoint
+    waits for the previous write to finish, and errors from a write are
+    raised by the next ``save`` or ``close``.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def _write(self, state: State) -> None:
+        try:
+            write(self.path, state)
+        except BaseException as e:  # pylint: disable=broad-exception-caught
+            self._error = e
+
+    def wait(self) -> None:
+        """Wait for the pending write and raise its error, if any."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def save(self, aggregator: weather.Aggregator) -> None:
+        """Start writing a checkpoint of the aggregator's current state."""
+        state = capture(aggregator)
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(state,), daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Wait for the last write."""
+        self.wait()
+
+    def __enter__(self) -> 'Checkpointer':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def process_with_checkpoints(
+    aggregator: weather.Aggregator,
+    events: Iterable[Any],
+    checkpointer: Checkpointer,
+    every: int,
+    batch_size: int = weather.DEFAULT_BATCH_SIZE,
+) -> Generator[dict[str, Any], None, None]:
+    """Process events with the aggregator, saving a checkpoint every ``every`` events.
+
+    A final checkpoint is saved when the input ends.
+    """
+    events = iter(events)
+    while True:
+        start = aggregator.position
+        yield from aggregator.process(islice(events, every), batch_size)
+        checkpointer.save(aggregator)
+        if aggregator.position - start < every:
+            return
@@ -0,0 +1,76 @@
+import itertools
+import pytest
+from . import checkpoint, weather
+
+EVENTS = [
+    {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+    {"type": "sample", "stationName": "🚁 B\n", "timestamp": 2, "temperature": -5.5},
+    {"type": "control", "command": "snapshot"},
+    {"type": "sample", "stationName": "A", "timestamp": 9223372036854775808, "temperature": 20},
+    {"type": "control", "command": "snapshot"},
+    {"type": "control", "command": "reset"},
+    {"type": "sample", "stationName": "C", "timestamp": 10, "temperature": 1.0},
+    {"type": "control", "command": "snapshot"},
+]
+
+def test_round_trip(tmp_path):
+    aggregator = weather.Aggregator()
+    list(aggregator.process(EVENTS[:4]))
+    path = str(tmp_path / "state")
+    checkpoint.write(path, checkpoint.capture(aggregator))
+    restored = checkpoint.load(path)
+    assert restored.position == 4
+    assert restored.latest_timestamp == 9223372036854775808
+    assert restored.stations.snapshot() == aggregator.stations.snapshot()
+
+def test_round_trip_keeps_pending_delta(tmp_path):
+    aggregator = weather.Aggregator()
+    list(aggregator.process(EVENTS[:4]))
+    path = str(tmp_path / "state")
+    checkpoint.write(path, checkpoint.capture(aggregator))
+    delta = {"type": "control", "command": "snapshot_delta"}
+    assert checkpoint.load(path).handle(delta) == aggregator.handle(delta) == {
+        "type": "snapshot_delta", "asOf": 9223372036854775808,
+        "stations": {"A": {"high": 20.0, "low": 10.0}},
+    }
+
+def test_round_trip_without_data(tmp_path):
+    path = str(tmp_path / "state")
+    checkpoint.write(path, checkpoint.capture(weather.Aggregator()))
+    restored = checkpoint.load(path)
+    assert restored.latest_timestamp is None
+    assert len(restored.stations) == 0
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "state"
+    path.write_bytes(b"not a checkpoint\n")
+    with pytest.raises(ValueError, match="is not a checkpoint file"):
+        checkpoint.load(str(path))
+
+@pytest.mark.parametrize("every", [1, 3, 100])
+def test_resume_matches_uninterrupted_run(tmp_path, every):
+    expected = list(weather.process_events(EVENTS))
+    path = str(tmp_path / "state")
+    for stop in range(len(EVENTS) + 1):
+        with checkpoint.Checkpointer(path) as checkpointer:
+            first = list(checkpoint.process_with_checkpoints(
+                weather.Aggregator(), EVENTS[:stop], checkpointer, every
+            ))
+        restored = checkpoint.load(path)
+        assert restored.position == stop
+        rest = list(itertools.islice(EVENTS, restored.position, None))
+        with checkpoint.Checkpointer(path) as checkpointer:
+            second = list(checkpoint.process_with_checkpoints(restored, rest, checkpointer, every))
+        assert first + second == expected
+
+def test_checkpoints_are_periodic(tmp_path):
+    path = str(tmp_path / "state")
+    events = iter(EVENTS)
+    with checkpoint.Checkpointer(path) as checkpointer:
+        outputs = checkpoint.process_with_checkpoints(
+            weather.Aggregator(), events, checkpointer, 3
+        )
+        next(outputs)  # snapshot at event 3, before the first checkpoint
+        next(outputs)  # snapshot at event 5
+        checkpointer.wait()
+        assert checkpoint.load(path).position == 3
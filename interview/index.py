@@ -0,0 +1,92 @@
+import bisect
+import heapq
+import itertools
+from array import array
+from typing import Iterator, List, Sequence, Tuple
+
+# (sort key, slot); the key is -high in the high heap and low in the low heap
+HeapEntry = Tuple[float, int]
+
+
+class StationIndex:
+    """Indexes over a StationStore's columns for top-K and name-prefix queries.
+
+    Two heaps hold ``(-high, slot)`` and ``(low, slot)`` entries. Highs only
+    rise and lows only fall, so a changed station simply gets a fresh entry
+    and the superseded ones are dropped when they surface; the heaps are
+    rebuilt once stale entries outnumber live ones. Names are kept in a
+    sorted list, so a prefix is a bisect plus a scan of its matches.
+
+    The store marks changed slots; ``sync`` folds them and any new stations
+    in before a query.
+    """
+
+    __slots__ = ('size', 'changed', 'is_changed', 'highs', 'lows', 'names')
+
+    def __init__(self) -> None:
+        self.size = 0
+        self.changed: List[int] = []
+        self.is_changed = bytearray()
+        self.highs: List[HeapEntry] = []
+        self.lows: List[HeapEntry] = []
+        self.names: List[Tuple[str, int]] = []
+
+    def mark(self, slot: int) -> None:
+        """Record that a known station's high or low changed."""
+        if slot < self.size and not self.is_changed[slot]:
+            self.is_changed[slot] = 1
+            self.changed.append(slot)
+
+    def sync(self, names: Sequence[str], highs: array, lows: array) -> None:
+        """Catch up with changes and new stations in the store's columns."""
+        size = len(names)
+        if len(self.highs) > 2 * size + 64:
+            self.highs = [(-high, slot) for slot, high in enumerate(highs)]
+            self.lows = [(low, slot) for slot, low in enumerate(lows)]
+            heapq.heapify(self.highs)
+            heapq.heapify(self.lows)
+        else:
+            for slot in itertools.chain(self.changed, range(self.size, size)):
+                heapq.heappush(self.highs, (-highs[slot], slot))
+                heapq.heappush(self.lows, (lows[slot], slot))
+        for slot in self.changed:
+            self.is_changed[slot] = 0
+        self.changed = []
+        if size > self.size:
+            self.names.extend(zip(names[self.size:], range(self.size, size)))
+            # Timsort merges the sorted list and the new run in linear time.
+            self.names.sort()
+            self.is_changed.extend(bytes(size - self.size))
+            self.size = size
+
+    @staticmethod
+    def _top(heap: List[HeapEntry], column: array, sign: float, count: int) -> List[int]:
+        """Pop the first count live slots of a heap, then push them back."""
+        found: List[HeapEntry] = []
+        seen = set()
+        while heap and len(found) < count:
+            entry = heapq.heappop(heap)
+            key, slot = entry
+            if key == sign * column[slot] and slot not in seen:
+                seen.add(slot)
+                found.append(entry)
+        for entry in found:
+            heapq.heappush(heap, entry)
+        return [slot for _, slot in found]
+
+    def top_highs(self, highs: array, count: int) -> List[int]:
+        """Slots of the count highest highs, highest first; ties in first-seen order."""
+        return self._top(self.highs, highs, -1.0, count)
+
+    def top_lows(self, lows: array, count: int) -> List[int]:
+        """Slots of the count lowest lows, lowest first; ties in first-seen order."""
+        return self._top(self.lows, lows, 1.0, count)
+
+    def with_prefix(self, prefix: str) -> Iterator[int]:
+        """Slots of the stations whose names start with prefix, in name order."""
+        names = self.names
+        for i in range(bisect.bisect_left(names, (prefix,)), len(names)):
+            name, slot = names[i]
+            if not name.startswith(prefix):
+                return
+            yield slot
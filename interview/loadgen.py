@@ -0,0 +1,118 @@
+"""Load generator for the socket server of ``python -m interview --listen``.
+
+Each producer connection sends its own synthetic sample stream and then a
+snapshot. The replies come back only after every sample sent before them has
+been applied, so the time until the last reply arrives gives the sustained
+rate at which the server aggregated all of the producers' messages.
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from . import benchmark, server
+
+SNAPSHOT = b'{"type": "control", "command": "snapshot"}\n'
+# Bytes written to a connection between waits for the server to catch up.
+BLOCK_SIZE = 1 << 16
+# Longest reply line accepted; a snapshot of many stations is one long line.
+REPLY_LIMIT = 1 << 26
+
+
+async def connect(address: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Open a connection to a HOST:PORT or unix:PATH address."""
+    if address.startswith(server.UNIX_PREFIX):
+        return await asyncio.open_unix_connection(
+            address[len(server.UNIX_PREFIX):], limit=REPLY_LIMIT
+        )
+    return await asyncio.open_connection(*server.parse_address(address), limit=REPLY_LIMIT)
+
+
+def producer_data(producer: int, messages: int, stations: int) -> bytes:
+    """The encoded samples of one producer, which has its own stations."""
+    config = benchmark.StreamConfig(
+        stations=stations, length=messages, snapshot_every=0, seed=producer
+    )
+    return b''.join(json.dumps(event).encode() + b'\n'
+                    for event in benchmark.generate_stream(config))
+
+
+async def produce(address: str, data: bytes) -> Dict[str, Any]:
+    """Send data and a snapshot over one connection and return the snapshot."""
+    reader, writer = await connect(address)
+    try:
+        for start in range(0, len(data), BLOCK_SIZE):
+            writer.write(data[start:start + BLOCK_SIZE])
+            await writer.drain()
+        writer.write(SNAPSHOT)
+        await writer.drain()
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
+
+
+async def run_load(
+    address: str, producers: int, messages: int, stations: int = 1000
+) -> Dict[str, Any]:
+    """Send messages samples from each of producers concurrent connections."""
+    data = [producer_data(producer, messages, stations) for producer in range(producers)]
+    start = time.perf_counter()
+    replies = await asyncio.gather(*(produce(address, block) for block in data))
+    elapsed = time.perf_counter() - start
+    if any(reply.get('type') != 'snapshot' for reply in replies):
+        raise RuntimeError(f"Unexpected reply from the server: {replies}")
+    total = producers * (messages + 1)
+    return {
+        'producers': producers,
+        'messages': total,
+        'seconds': elapsed,
+        'messagesPerSec': total / elapsed,
+    }
+
+
+def start_server(args: List[str]) -> Tuple['subprocess.Popen[str]', str]:
+    """Start ``python -m interview --listen`` on a free local port and return its address."""
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, '-m', 'interview', '--listen', '127.0.0.1:0', *args],
+        stderr=subprocess.PIPE, text=True,
+    )
+    assert process.stderr is not None
+    line = process.stderr.readline()
+    if not line:
+        process.wait()
+        raise RuntimeError('The server exited before listening.')
+    return process, json.loads(line)['address']
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m interview.loadgen')
+    parser.add_argument('--address',
+                        help='HOST:PORT or unix:PATH of a running server; '
+                             'by default one is started on a local port')
+    parser.add_argument('--producers', type=int, default=8,
+                        help='number of concurrent producer connections')
+    parser.add_argument('--messages', type=int, default=100_000,
+                        help='samples sent by each producer')
+    parser.add_argument('--stations', type=int, default=1000,
+                        help='stations of each producer')
+    parser.add_argument('server_args', nargs='*',
+                        help='extra arguments for the started server, after --')
+    args = parser.parse_args(argv)
+
+    process = None
+    address = args.address
+    if address is None:
+        process, address = start_server(args.server_args)
+    try:
+        result = asyncio.run(run_load(address, args.producers, args.messages, args.stations))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Lazy k-way merge of several input sources, each ordered by timestamp.
+
+Every event gets a sort key, and ``heapq.merge`` holds the next event of
+each source, so memory stays proportional to the number of sources.
+
+A sample is keyed by ``(timestamp, 0)``. Any other event is keyed by
+``(timestamp of the preceding sample in its source, 1)``, so it stays at its
+arrival position in its own source. Across sources, it comes after every
+sample with a timestamp up to that one, and before every later sample. A
+snapshot thus covers exactly the samples at or before its ``asOf``, as it
+would on a single ordered stream. Equal keys are taken in source order.
+"""
+import contextlib
+import heapq
+import math
+import socket
+from operator import itemgetter
+from typing import Any, BinaryIO, Iterable, Iterator, List, Sequence, Tuple
+from . import binary, server, streams
+
+# (timestamp of the event or of the sample before it, 0 for samples and 1 otherwise)
+Key = Tuple[float, int]
+
+TCP_PREFIX = 'tcp:'
+
+
+def _keyed(events: Iterable[Any]) -> Iterator[Tuple[Key, Any]]:
+    previous = -math.inf
+    for event in events:
+        if isinstance(event, dict) and event.get('type') == 'sample':
+            timestamp = event.get('timestamp')
+            # Invalid timestamps are left for the aggregator to report, in place.
+            if isinstance(timestamp, int) and not isinstance(timestamp, bool):
+                previous = timestamp
+                yield (timestamp, 0), event
+                continue
+        yield (previous, 1), event
+
+
+def merge_events(sources: Sequence[Iterable[Any]]) -> Iterator[Any]:
+    """Merge event sources that are each ordered by timestamp into one ordered stream."""
+    if len(sources) == 1:
+        return iter(sources[0])
+    merged = heapq.merge(*map(_keyed, sources), key=itemgetter(0))
+    return map(itemgetter(1), merged)
+
+
+def open_source(spec: str) -> BinaryIO:
+    """Open a file or FIFO path, or connect to a ``tcp:HOST:PORT`` or ``unix:PATH`` socket."""
+    if spec.startswith(TCP_PREFIX):
+        sock = socket.create_connection(server.parse_address(spec[len(TCP_PREFIX):]))
+    elif spec.startswith(server.UNIX_PREFIX):
+        sock = socket.socket(socket.AF_UNIX)
+        sock.connect(spec[len(server.UNIX_PREFIX):])
+    else:
+        return open(spec, 'rb')  # pylint: disable=consider-using-with
+    # The file keeps the connection open until it is closed itself.
+    with sock:
+        return sock.makefile('rb')
+
+
+def read_sources(
+    specs: List[str],
+    chunk_size: int = streams.DEFAULT_CHUNK_SIZE,
+    input_format: str = 'auto',
+) -> Iterator[Any]:
+    """Lazily read and merge the events of several sources, closing them when done."""
+    with contextlib.ExitStack() as stack:
+        inputs = []
+        for spec in specs:
+            stream = stack.enter_context(open_source(spec))
+            inputs.append(binary.read_input(stream, chunk_size, 0, input_format))
+        yield from merge_events(inputs)
@@ -0,0 +1,117 @@
+import itertools
+import json
+import os
+import random
+import socket
+import threading
+from typing import Any, Iterator, List
+from . import merge, weather
+
+SNAPSHOT = {"type": "control", "command": "snapshot"}
+
+
+def encode(events: List[Any]) -> bytes:
+    return b''.join(json.dumps(event).encode() + b'\n' for event in events)
+
+
+def samples(name: str, *timestamps: int) -> List[Any]:
+    return [{"type": "sample", "stationName": name, "timestamp": timestamp, "temperature": 10.0}
+            for timestamp in timestamps]
+
+
+def test_merges_by_timestamp():
+    merged = list(merge.merge_events([samples("A", 1, 4, 6), samples("B", 2, 3, 7)]))
+    assert [event["timestamp"] for event in merged] == [1, 2, 3, 4, 6, 7]
+
+
+def test_control_follows_every_sample_up_to_its_position():
+    a1, a5, a9 = samples("A", 1, 5, 9)
+    b5, b6 = samples("B", 5, 6)
+    merged = list(merge.merge_events([[a1, a5, SNAPSHOT, a9], [b5, b6]]))
+    assert merged == [a1, a5, b5, SNAPSHOT, b6, a9]
+    assert list(weather.process_events(merged)) == [{
+        "type": "snapshot", "asOf": 5,
+        "stations": {"A": {"high": 10.0, "low": 10.0}, "B": {"high": 10.0, "low": 10.0}},
+    }]
+
+
+def test_control_before_any_sample_comes_first():
+    [a1], [b2] = samples("A", 1), samples("B", 2)
+    assert list(merge.merge_events([[a1], [SNAPSHOT, b2]])) == [SNAPSHOT, a1, b2]
+
+
+def test_invalid_events_keep_their_position():
+    a1, a3 = samples("A", 1, 3)
+    [b2] = samples("B", 2)
+    unknown, bad = {"type": "unknown"}, {"type": "sample", "timestamp": "x"}
+    merged = list(merge.merge_events([[a1, unknown, a3], [b2, bad]]))
+    assert merged == [a1, unknown, b2, bad, a3]
+
+
+def test_matches_a_stable_sort_of_all_sources():
+    rng = random.Random(1)
+    sources: List[List[Any]] = []
+    keyed = []
+    for index in range(5):
+        timestamp = 0
+        events: List[Any] = []
+        for _ in range(200):
+            if rng.random() < 0.1:
+                events.append({"type": "control", "command": "snapshot", "from": index})
+                keyed.append(((timestamp, 1, index, len(events)), events[-1]))
+                continue
+            timestamp += rng.randint(1, 3)
+            events.append({"type": "sample", "stationName": f"S{index}",
+                           "timestamp": timestamp, "temperature": rng.uniform(0, 100)})
+            keyed.append(((timestamp, 0, index, len(events)), events[-1]))
+        sources.append(events)
+    expected = [event for _, event in sorted(keyed, key=lambda item: item[0])]
+    assert list(merge.merge_events(sources)) == expected
+
+
+def test_reads_lazily_one_event_ahead_per_source():
+    consumed = [0, 0, 0]
+
+    def source(index: int) -> Iterator[Any]:
+        for timestamp in itertools.count(index, 3):
+            consumed[index] += 1
+            yield from samples(f"S{index}", timestamp)
+
+    merged = merge.merge_events([source(0), source(1), source(2)])
+    taken = list(itertools.islice(merged, 1000))
+    assert [event["timestamp"] for event in taken] == list(range(1000))
+    assert sum(consumed) <= 1000 + 3
+
+
+def test_single_source_passes_through():
+    events = samples("A", 2, 1)
+    assert list(merge.merge_events([events])) == events
+
+
+def test_read_sources_from_file_fifo_and_socket(tmp_path):
+    path = tmp_path / 'feed.jsonl'
+    path.write_bytes(encode(samples("A", 1, 4) + [SNAPSHOT]))
+    fifo = tmp_path / 'feed.fifo'
+    os.mkfifo(fifo)
+    listener = socket.create_server(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+
+    def write_fifo() -> None:
+        with open(fifo, 'wb') as stream:
+            stream.write(encode(samples("B", 2, 5)))
+
+    def write_socket() -> None:
+        connection, _ = listener.accept()
+        with connection:
+            connection.sendall(encode(samples("C", 3, 4)))
+
+    writers = [threading.Thread(target=write_fifo), threading.Thread(target=write_socket)]
+    for writer in writers:
+        writer.start()
+    with listener:
+        events = list(merge.read_sources([str(path), str(fifo), f'tcp:127.0.0.1:{port}']))
+    for writer in writers:
+        writer.join()
+    assert [(event.get("stationName"), event.get("timestamp")) for event in events] == [
+        ("A", 1), ("B", 2), ("C", 3), ("A", 4), ("C", 4), (None, None), ("B", 5),
+    ]
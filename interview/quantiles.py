@@ -0,0 +1,150 @@
+import math
+from array import array
+from typing import Dict, Iterable, List, Tuple
+from .state import StationStore
+
+# Reported quantiles and their output keys.
+QUANTILES: Tuple[Tuple[str, float], ...] = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+DEFAULT_COMPRESSION = 100
+
+
+class TDigest:
+    """Mergeable quantile sketch in fixed memory (a merging t-digest).
+
+    Samples are buffered and periodically merged into weighted centroids,
+    sized by the arcsine scale function so that centroids near the tails
+    stay small. ``compression`` bounds the number of centroids and the
+    buffer, trading memory for accuracy: rank error is roughly
+    ``1 / compression`` in the middle and much smaller at the tails.
+    """
+
+    __slots__ = ('compression', 'means', 'weights', 'buffer', 'low', 'high')
+
+    def __init__(self, compression: int = DEFAULT_COMPRESSION) -> None:
+        self.compression = compression
+        self.means = array('d')
+        self.weights = array('d')
+        self.buffer = array('d')
+        self.low = math.inf
+        self.high = -math.inf
+
+    def add(self, value: float) -> None:
+        """Add one sample."""
+        self.buffer.append(value)
+        if len(self.buffer) >= self.compression:
+            self._compress()
+
+    def merge(self, other: 'TDigest') -> None:
+        """Fold another digest into this one."""
+        self.low = min(self.low, other.low)
+        self.high = max(self.high, other.high)
+        self._compress([
+            *zip(other.means, other.weights), *((value, 1.0) for value in other.buffer)
+        ])
+
+    def count(self) -> float:
+        """Number of samples added."""
+        return sum(self.weights) + len(self.buffer)
+
+    def _compress(self, extra: Iterable[Tuple[float, float]] = ()) -> None:
+        points = sorted([
+            *zip(self.means, self.weights), *extra, *((value, 1.0) for value in self.buffer)
+        ])
+        self.buffer = array('d')
+        if not points:
+            return
+        self.low = min(self.low, points[0][0])
+        self.high = max(self.high, points[-1][0])
+        total = sum(weight for _, weight in points)
+        scale = self.compression / (2 * math.pi)
+        means, weights = array('d'), array('d')
+        mean, weight = points[0]
+        done = 0.0
+        limit = self._limit(0.0, scale, total)
+        for point_mean, point_weight in points[1:]:
+            if done + weight + point_weight <= limit:
+                weight += point_weight
+                mean += (point_mean - mean) * point_weight / weight
+                continue
+            means.append(mean)
+            weights.append(weight)
+            done += weight
+            limit = self._limit(done / total, scale, total)
+            mean, weight = point_mean, point_weight
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    @staticmethod
+    def _limit(q: float, scale: float, total: float) -> float:
+        """Largest cumulative weight a centroid starting at quantile q may reach."""
+        k = scale * math.asin(2 * q - 1) + 1
+        if k >= scale * math.pi / 2:
+            return total
+        return total * (math.sin(k / scale) + 1) / 2
+
+    def quantile(self, q: float) -> float:
+        """Estimate the value at quantile q, interpolating between centroid centers."""
+        if self.buffer:
+            self._compress()
+        means, weights = self.means, self.weights
+        if len(means) == 1:
+            return means[0]
+        total = sum(weights)
+        target = q * total
+        if target < weights[0] / 2:
+            return self.low + (means[0] - self.low) * target / (weights[0] / 2)
+        if target > total - weights[-1] / 2:
+            tail = (total - target) / (weights[-1] / 2)
+            return self.high + (means[-1] - self.high) * tail
+        center = weights[0] / 2
+        for i in range(1, len(means)):
+            next_center = center + (weights[i - 1] + weights[i]) / 2
+            if target <= next_center:
+                fraction = (target - center) / (next_center - center)
+                return means[i - 1] + (means[i] - means[i - 1]) * fraction
+            center = next_center
+        return means[-1]
+
+
+class QuantileStationStore(StationStore):
+    """A StationStore that also keeps a t-digest of temperatures per station.
+
+    Memory per station is bounded by ``compression`` no matter how many
+    samples arrive.
+    """
+
+    def __init__(self, compression: int = DEFAULT_COMPRESSION) -> None:
+        super().__init__()
+        self.compression = compression
+        self._digests: Dict[str, TDigest] = {}
+
+    def add_sample(self, station: str, timestamp: int, temperature: float) -> None:
+        """Fold a sample into the high/low and the station's digest."""
+        self.update(station, temperature)
+        self._add_to_digest(station, temperature)
+
+    def add_samples(
+        self, stations: List[str], timestamps: List[int], temperatures: List[float]
+    ) -> None:
+        self.update_many(stations, temperatures)
+        add = self._add_to_digest
+        for station, temperature in zip(stations, temperatures):
+            add(station, temperature)
+
+    def _add_to_digest(self, station: str, temperature: float) -> None:
+        digest = self._digests.get(station)
+        if digest is None:
+            digest = self._digests[station] = TDigest(self.compression)
+        digest.add(float(temperature))
+
+    def clear(self) -> None:
+        super().clear()
+        self._digests = {}
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        """Estimated p50/p90/p99 temperature per station, in first-seen order."""
+        return {
+            name: {key: digest.quantile(q) for key, q in QUANTILES}
+            for name, digest in self._digests.items()
+        }
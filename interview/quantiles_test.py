@@ -0,0 +1,81 @@
+import bisect
+import random
+import pytest
+from . import weather
+from .quantiles import QuantileStationStore, TDigest
+
+def rank_error(values, digest, q):
+    ordered = sorted(values)
+    return abs(bisect.bisect_left(ordered, digest.quantile(q)) / len(ordered) - q)
+
+@pytest.mark.parametrize("order", ["random", "increasing", "decreasing"])
+def test_digest_accuracy(order):
+    rng = random.Random(0)
+    values = [rng.gauss(50.0, 15.0) for _ in range(50_000)]
+    if order != "random":
+        values.sort(reverse=order == "decreasing")
+    digest = TDigest(100)
+    for value in values:
+        digest.add(value)
+    for q in (0.01, 0.5, 0.9, 0.99):
+        assert rank_error(values, digest, q) < 0.005
+
+def test_digest_memory_is_fixed():
+    digest = TDigest(50)
+    for i in range(200_000):
+        digest.add(float(i % 977))
+    assert len(digest.means) <= 50
+    assert len(digest.buffer) < 50
+    assert digest.count() == 200_000
+
+def test_digest_small_counts_are_exact():
+    digest = TDigest()
+    for value in (3.0, 1.0, 2.0):
+        digest.add(value)
+    assert [digest.quantile(q) for q in (0.0, 0.5, 1.0)] == [1.0, 2.0, 3.0]
+
+def test_digest_merge():
+    rng = random.Random(1)
+    values = [rng.uniform(-20.0, 100.0) for _ in range(20_000)]
+    left, right = TDigest(), TDigest()
+    for value in values[:5000]:
+        left.add(value)
+    for value in values[5000:]:
+        right.add(value)
+    left.merge(right)
+    assert left.count() == len(values)
+    for q in (0.5, 0.9, 0.99):
+        assert rank_error(values, left, q) < 0.005
+
+def test_store_percentiles_and_reset():
+    store = QuantileStationStore()
+    for temperature in range(1, 102):
+        store.add_sample("A", temperature, temperature)
+    store.add_samples(["B"], [200], [7.0])
+    percentiles = store.percentiles()
+    assert list(percentiles) == ["A", "B"]
+    assert percentiles["A"]["p50"] == pytest.approx(51.0, abs=1.0)
+    assert percentiles["A"]["p99"] == pytest.approx(100.0, abs=1.0)
+    assert percentiles["B"] == {"p50": 7.0, "p90": 7.0, "p99": 7.0}
+    store.clear()
+    assert not store.percentiles()
+
+EVENTS = [
+    {"type": "control", "command": "percentiles"},
+    {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10},
+    {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": 20.0},
+    {"type": "control", "command": "percentiles"},
+]
+
+@pytest.mark.parametrize("batch_size", [1, 4096])
+def test_percentiles_command(batch_size):
+    aggregator = weather.Aggregator(QuantileStationStore())
+    (output,) = aggregator.process(EVENTS, batch_size)
+    assert output["type"] == "percentiles"
+    assert output["asOf"] == 2
+    assert set(output["stations"]["A"]) == {"p50", "p90", "p99"}
+    assert 10.0 <= output["stations"]["A"]["p50"] <= 20.0
+
+def test_percentiles_requires_sketches():
+    with pytest.raises(ValueError, match="Please verify input. percentiles requires"):
+        list(weather.process_events(EVENTS))
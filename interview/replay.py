@@ -0,0 +1,130 @@
+"""Parallel replay of a recorded JSON lines file.
+
+A ``reset`` drops all aggregator state, so the runs of lines that end with a
+reset are independent: each can be replayed by a fresh aggregator in its own
+process, and concatenating their outputs in file order gives exactly the
+output of a serial run.
+"""
+import functools
+import json
+import mmap
+import multiprocessing
+from typing import Iterator, List, Optional, Tuple, Union
+from . import streams, weather
+from .sharded import error_message
+
+# (start offset, end offset) of a run of lines
+Segment = Tuple[int, int]
+# (encoded outputs, error message, offset just past the last applied event)
+Reply = Tuple[bytes, Optional[str], int]
+
+DEFAULT_MIN_SEGMENT_BYTES = 1 << 22
+
+
+def _is_reset(line: bytes) -> bool:
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return False
+    return (isinstance(event, dict) and event.get('type') == 'control'
+            and event.get('command') == 'reset')
+
+
+def reset_boundaries(data: Union[bytes, mmap.mmap], start: int = 0) -> Iterator[int]:
+    """Yield the offset just past every reset line after start."""
+    # Only lines mentioning "reset" are decoded; the rest are skipped by find.
+    pos = data.find(b'"reset"', start)
+    while pos >= 0:
+        line_start = data.rfind(b'\n', start, pos) + 1 or start
+        line_end = data.find(b'\n', pos) + 1 or len(data)
+        if _is_reset(data[line_start:line_end]):
+            yield line_end
+        pos = data.find(b'"reset"', line_end)
+
+
+def last_reset_boundary(path: str, offset: int) -> int:
+    """Offset just past the last reset line that ends at or before offset, or 0.
+
+    No state is carried across that point, so a replay resumed from it gives
+    the same outputs as a replay of the whole file.
+    """
+    with open(path, 'rb') as file:
+        if file.seek(0, 2) == 0:
+            return 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = data.rfind(b'"reset"', 0, offset)
+            while pos >= 0:
+                line_start = data.rfind(b'\n', 0, pos) + 1
+                line_end = data.find(b'\n', pos) + 1 or len(data)
+                if _is_reset(data[line_start:line_end]):
+                    return line_end
+                pos = data.rfind(b'"reset"', 0, line_start)
+    return 0
+
+
+def split(
+    path: str, start_offset: int = 0, min_segment_bytes: int = DEFAULT_MIN_SEGMENT_BYTES
+) -> List[Segment]:
+    """Cut a file into segments that end at resets and are at least min_segment_bytes long."""
+    segments = []
+    with open(path, 'rb') as file:
+        size = file.seek(0, 2)
+        if start_offset >= size:
+            return []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = start_offset
+            for end in reset_boundaries(data, start_offset):
+                if end - start >= min_segment_bytes:
+                    segments.append((start, end))
+                    start = end
+    if start < size:
+        segments.append((start, size))
+    return segments
+
+
+def replay_segment(path: str, chunk_size: int, batch_size: int, segment: Segment) -> Reply:
+    """Replay one segment with a fresh aggregator and return its encoded outputs."""
+    start, end = segment
+    aggregator = weather.Aggregator()
+    outputs = []
+    with streams.MappedFile(path, start, chunk_size, end) as source:
+        try:
+            for output in aggregator.process(source.events(), batch_size):
+                outputs.append(streams.encode_line(output))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return b''.join(outputs), error_message(e), source.offset_after(aggregator.position)
+    return b''.join(outputs), None, end
+
+
+class ParallelReplay:
+    """Replays a file in a pool of processes, one segment between resets at a time.
+
+    ``offset`` is the byte offset just past the last event whose outputs have
+    been returned, for resuming an interrupted or failed replay.
+    """
+
+    def __init__(self, path: str, workers: int, start_offset: int = 0) -> None:
+        self.path = path
+        self.workers = workers
+        self.offset = start_offset
+
+    def outputs(
+        self,
+        chunk_size: int = streams.DEFAULT_CHUNK_SIZE,
+        batch_size: int = weather.DEFAULT_BATCH_SIZE,
+        min_segment_bytes: int = DEFAULT_MIN_SEGMENT_BYTES,
+    ) -> Iterator[bytes]:
+        """Yield the encoded outputs of each segment, in file order.
+
+        An error is raised after the outputs that a serial run would have
+        produced before it.
+        """
+        segments = split(self.path, self.offset, min_segment_bytes)
+        replay = functools.partial(replay_segment, self.path, chunk_size, batch_size)
+        with multiprocessing.Pool(self.workers) as pool:
+            for outputs, error, offset in pool.imap(replay, segments):
+                if outputs:
+                    yield outputs
+                self.offset = offset
+                if error is not None:
+                    raise ValueError(error)
@@ -0,0 +1,70 @@
+import io
+import pytest
+from . import replay, streams, weather
+
+EVENTS = [
+    {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+    {"type": "control", "command": "snapshot"},
+    {"type": "control", "command": "reset"},
+    {"type": "control", "command": "reset"},
+    {"type": "sample", "stationName": "reset", "timestamp": 2, "temperature": -5.5},
+    {"type": "control", "command": "snapshot_delta"},
+    {"type": "control", "command": "reset"},
+    {"type": "sample", "stationName": "C", "timestamp": 3, "temperature": 1},
+    {"type": "control", "command": "snapshot"},
+]
+
+def write(tmp_path, events, extra=b""):
+    path = tmp_path / "events.jsonl"
+    path.write_bytes(b"".join(streams.encode_line(event) for event in events) + extra)
+    return str(path)
+
+def read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+def serial(events):
+    stream = io.BytesIO()
+    with streams.OutputWriter(stream) as writer:
+        for output in weather.process_events(events):
+            writer.write(output)
+    return stream.getvalue()
+
+def test_split_ends_segments_at_resets(tmp_path):
+    path = write(tmp_path, EVENTS)
+    data = read(path)
+    segments = replay.split(path, min_segment_bytes=0)
+    assert [data[start:end].count(b"\n") for start, end in segments] == [3, 1, 3, 2]
+    assert segments[0][0] == 0 and segments[-1][1] == len(data)
+    assert all(a[1] == b[0] for a, b in zip(segments, segments[1:]))
+    assert replay.split(path) == [(0, len(data))]
+
+@pytest.mark.parametrize("min_segment_bytes", [0, 100, 1 << 20])
+def test_parallel_replay_matches_serial_run(tmp_path, min_segment_bytes):
+    path = write(tmp_path, EVENTS * 5)
+    parallel = replay.ParallelReplay(path, 2)
+    outputs = parallel.outputs(min_segment_bytes=min_segment_bytes)
+    assert b"".join(outputs) == serial(EVENTS * 5)
+    assert parallel.offset == len(read(path))
+
+def test_parallel_replay_stops_at_first_error(tmp_path):
+    bad = {"type": "sample", "stationName": "B", "timestamp": 4}
+    path = write(tmp_path, EVENTS + [bad] + EVENTS)
+    parallel = replay.ParallelReplay(path, 2)
+    outputs = []
+    with pytest.raises(ValueError, match="Please verify input"):
+        for lines in parallel.outputs(min_segment_bytes=0):
+            outputs.append(lines)
+    assert b"".join(outputs) == serial(EVENTS)
+    assert read(path)[parallel.offset:].startswith(streams.encode_line(bad))
+
+def test_last_reset_boundary(tmp_path):
+    path = write(tmp_path, EVENTS)
+    starts = [0]
+    for line in read(path).splitlines(keepends=True):
+        starts.append(starts[-1] + len(line))
+    # Lines 2, 3 and 6 are resets; line 4 is a sample of a station named "reset".
+    boundaries = [0, 0, 0, 3, 4, 4, 4, 7, 7, 7]
+    for line, boundary in enumerate(boundaries):
+        assert replay.last_reset_boundary(path, starts[line]) == starts[boundary]
+        assert serial(EVENTS).endswith(serial(EVENTS[boundary:]))
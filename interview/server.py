@@ -0,0 +1,132 @@
+"""Socket server that aggregates the events of many producer connections.
+
+Every connection streams JSON lines into one shared aggregator. Outputs are
+sent back on the connection whose control message asked for them. The event
+loop applies each chunk read from a connection in one synchronous step, so
+the events of a chunk are never interleaved with those of another
+connection.
+"""
+import asyncio
+import json
+import os
+import sys
+from typing import Any, List, Optional, Tuple, Union
+from . import streams, tenants, weather
+from .sharded import error_message
+
+# Bytes to read from a connection at a time.
+DEFAULT_READ_SIZE = 1 << 16
+UNIX_PREFIX = 'unix:'
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """Split a HOST:PORT address."""
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(
+            f"Please verify input. Address must be HOST:PORT or unix:PATH, got {address!r}."
+        )
+    return host.strip('[]'), int(port)
+
+
+class Server:
+    """Accepts producer connections on a TCP or Unix domain socket.
+
+    A line that cannot be decoded or applied, blank lines included, is
+    answered with an ``error`` output after the outputs of the events before
+    it, and that connection is then closed; the events it sent before the
+    bad line stay applied and other connections carry on.
+    """
+
+    def __init__(
+        self,
+        aggregator: Optional[Union[weather.Aggregator, tenants.StreamAggregators]] = None,
+        read_size: int = DEFAULT_READ_SIZE,
+        batch_size: int = weather.DEFAULT_BATCH_SIZE,
+    ) -> None:
+        self.aggregator = weather.Aggregator() if aggregator is None else aggregator
+        self.read_size = read_size
+        self.batch_size = batch_size
+        self._encoder = streams.SnapshotEncoder()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._path: Optional[str] = None
+
+    async def start(self, address: str) -> str:
+        """Listen on address and return the bound address, with the actual port."""
+        if address.startswith(UNIX_PREFIX):
+            self._path = address[len(UNIX_PREFIX):]
+            self._server = await asyncio.start_unix_server(self._serve, self._path)
+            return address
+        host, port = parse_address(address)
+        self._server = await asyncio.start_server(self._serve, host, port)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"{host}:{port}"
+
+    async def serve_forever(self) -> None:
+        """Accept connections until cancelled."""
+        assert self._server is not None
+        await self._server.serve_forever()
+
+    async def close(self) -> None:
+        """Stop listening and remove the socket file of a Unix domain socket."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._path is not None and os.path.exists(self._path):
+            os.unlink(self._path)
+
+    def apply(self, body: bytes, writer: asyncio.StreamWriter) -> None:
+        """Decode and apply a block of complete lines, buffering the replies in writer.
+
+        If a line is not valid JSON, the events before it are applied and
+        answered before the error is raised.
+        """
+        events: List[Any] = []
+        error: Optional[ValueError] = None
+        try:
+            events.extend(streams.decode_lines(body))
+        except ValueError as e:
+            error = ValueError(f"Please verify input. Invalid JSON line: {e}")
+        for output in self.aggregator.process(events, self.batch_size):
+            writer.writelines(self._encoder.encode(output))
+        if error is not None:
+            raise error
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        pending = b''
+        try:
+            while True:
+                chunk = await reader.read(self.read_size)
+                if not chunk:
+                    body, pending = pending, b''
+                else:
+                    cut = chunk.rfind(b'\n')
+                    if cut < 0:
+                        pending += chunk
+                        continue
+                    body, pending = pending + chunk[:cut], chunk[cut + 1:]
+                if chunk or body:
+                    try:
+                        self.apply(body, writer)
+                    except Exception as e:  # pylint: disable=broad-exception-caught
+                        error = {'type': 'error', 'message': error_message(e)}
+                        writer.write(streams.encode_line(error))
+                        break
+                    # Holds back a producer that does not read its replies.
+                    await writer.drain()
+                if not chunk:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(address: str, server: Server) -> None:
+    """Run server on address until cancelled, announcing the bound address on stderr."""
+    bound = await server.start(address)
+    print(json.dumps({'type': 'listening', 'address': bound}), file=sys.stderr, flush=True)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
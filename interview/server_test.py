@@ -0,0 +1,161 @@
+import asyncio
+import json
+from typing import Any, Awaitable, Callable, List
+import pytest
+from . import loadgen, server
+
+
+def encode(*events: Any) -> bytes:
+    return b''.join(json.dumps(event).encode() + b'\n' for event in events)
+
+
+async def read_outputs(reader: asyncio.StreamReader) -> List[Any]:
+    return [json.loads(line) for line in (await reader.read()).splitlines()]
+
+
+def with_server(address: str, test: Callable[[str], Awaitable[None]]) -> None:
+    async def run() -> None:
+        listener = server.Server()
+        bound = await listener.start(address)
+        try:
+            await test(bound)
+        finally:
+            await listener.close()
+    asyncio.run(run())
+
+
+def test_parse_address():
+    assert server.parse_address('127.0.0.1:9000') == ('127.0.0.1', 9000)
+    assert server.parse_address('[::1]:0') == ('::1', 0)
+    with pytest.raises(ValueError, match="Please verify input. Address must be HOST:PORT"):
+        server.parse_address('localhost')
+
+
+def test_replies_go_to_the_sender():
+    async def test(address: str) -> None:
+        reader_a, writer_a = await loadgen.connect(address)
+        reader_b, writer_b = await loadgen.connect(address)
+        writer_a.write(encode(
+            {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+            {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": 20.0},
+        ))
+        await writer_a.drain()
+        writer_b.write(encode(
+            {"type": "sample", "stationName": "B", "timestamp": 3, "temperature": 5.0},
+        ))
+        writer_b.write_eof()
+        # B's connection sends no control messages and gets no replies.
+        assert not await reader_b.read()
+        writer_a.write(encode({"type": "control", "command": "snapshot"},
+                              {"type": "control", "command": "reset"}))
+        writer_a.write_eof()
+        assert await read_outputs(reader_a) == [
+            {"type": "snapshot", "asOf": 3,
+             "stations": {"A": {"high": 20.0, "low": 10.0}, "B": {"high": 5.0, "low": 5.0}}},
+            {"type": "reset", "asOf": 3},
+        ]
+        writer_a.close()
+        writer_b.close()
+
+    with_server('127.0.0.1:0', test)
+
+
+def test_lines_split_across_reads():
+    async def test(address: str) -> None:
+        reader, writer = await loadgen.connect(address)
+        data = encode(
+            {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+            {"type": "control", "command": "snapshot"},
+        )
+        for i in range(len(data)):
+            writer.write(data[i:i + 1])
+            await writer.drain()
+        writer.write_eof()
+        assert await read_outputs(reader) == [
+            {"type": "snapshot", "asOf": 1, "stations": {"A": {"high": 10.0, "low": 10.0}}},
+        ]
+        writer.close()
+
+    with_server('127.0.0.1:0', test)
+
+
+def test_error_closes_only_the_offending_connection():
+    async def test(address: str) -> None:
+        reader_a, writer_a = await loadgen.connect(address)
+        writer_a.write(encode(
+            {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+            {"type": "unknown"},
+            {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": 50.0},
+        ))
+        assert await read_outputs(reader_a) == [
+            {"type": "error", "message": "Please verify input. Unknown message type: unknown"},
+        ]
+        writer_a.close()
+        reader_b, writer_b = await loadgen.connect(address)
+        writer_b.write(encode({"type": "control", "command": "snapshot"}))
+        writer_b.write_eof()
+        assert await read_outputs(reader_b) == [
+            {"type": "snapshot", "asOf": 1, "stations": {"A": {"high": 10.0, "low": 10.0}}},
+        ]
+        writer_b.close()
+
+    with_server('127.0.0.1:0', test)
+
+
+def test_events_before_a_malformed_line_are_applied_and_answered():
+    async def test(address: str) -> None:
+        reader_a, writer_a = await loadgen.connect(address)
+        writer_a.write(encode(
+            {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+            {"type": "control", "command": "snapshot"},
+        ) + b'not json\n' + encode(
+            {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": 50.0},
+        ))
+        assert await read_outputs(reader_a) == [
+            {"type": "snapshot", "asOf": 1, "stations": {"A": {"high": 10.0, "low": 10.0}}},
+            {"type": "error", "message": "Please verify input. Invalid JSON line: "
+                                         "Expecting value: line 1 column 1 (char 0)"},
+        ]
+        writer_a.close()
+        reader_b, writer_b = await loadgen.connect(address)
+        writer_b.write(encode(
+            {"type": "sample", "stationName": "B", "timestamp": 3, "temperature": 0.0},
+        ) + b'\n')
+        assert await read_outputs(reader_b) == [
+            {"type": "error", "message": "Please verify input. Invalid JSON line: "
+                                         "Expecting value: line 1 column 1 (char 0)"},
+        ]
+        writer_b.close()
+        reader_c, writer_c = await loadgen.connect(address)
+        writer_c.write(encode({"type": "control", "command": "snapshot"}))
+        writer_c.write_eof()
+        assert await read_outputs(reader_c) == [
+            {"type": "snapshot", "asOf": 3,
+             "stations": {"A": {"high": 10.0, "low": 10.0}, "B": {"high": 0.0, "low": 0.0}}},
+        ]
+        writer_c.close()
+
+    with_server('127.0.0.1:0', test)
+
+
+def test_unix_socket(tmp_path):
+    path = tmp_path / 'weather.sock'
+
+    async def test(address: str) -> None:
+        assert address == f'unix:{path}'
+        result = await loadgen.run_load(address, producers=3, messages=200, stations=10)
+        assert result['messages'] == 3 * 201
+        assert result['messagesPerSec'] > 0
+
+    with_server(f'unix:{path}', test)
+    assert not path.exists()
+
+
+def test_load_generator_snapshots_cover_every_producer():
+    async def test(address: str) -> None:
+        data = [loadgen.producer_data(producer, 100, 5) for producer in range(4)]
+        replies = await asyncio.gather(*(loadgen.produce(address, block) for block in data))
+        # The last reply to arrive was sent after every producer's samples.
+        assert max(len(reply['stations']) for reply in replies) == 20
+
+    with_server('127.0.0.1:0', test)
@@ -0,0 +1,282 @@
+import heapq
+from array import array
+import multiprocessing
+import time
+from multiprocessing.connection import Connection
+from typing import Any, Dict, Generator, Iterable, List, Optional, Tuple
+from . import weather
+from .state import StationStore
+
+# (stream index of the failing event, error message)
+Error = Tuple[int, str]
+# (first-seen stream index, station name, {'high', 'low'} row)
+Entry = Tuple[int, str, Dict[str, float]]
+# (first error, latest timestamp, station entries, station count)
+Reply = Tuple[Optional[Error], Optional[int], List[Entry], int]
+# (stream indexes, station names, timestamps, temperatures) of routed samples
+Columns = Tuple[List[int], List[Any], List[Any], List[Any]]
+
+_BARRIER_COMMANDS = ('snapshot', 'snapshot_delta', 'reset', 'stats')
+
+
+def error_message(error: Exception) -> str:
+    """Return the message process_events would raise for an error."""
+    if isinstance(error, ValueError):
+        return str(error)
+    return f"Please verify input. Unexpected error: {str(error)}"
+
+
+class _Shard:
+    """Partial state of one worker."""
+
+    def __init__(self) -> None:
+        self.stations = StationStore()
+        self.first_seen: Dict[str, int] = {}
+        self.latest_timestamp: Optional[int] = None
+        self.error: Optional[Error] = None
+
+    def ingest(
+        self, indexes: List[int], names: List[Any], stamps: List[Any], temps: List[Any]
+    ) -> None:
+        """Apply a batch of samples given as columns, with their stream indexes."""
+        if self.error is not None:
+            return
+        stations = self.stations
+        count = len(stations)
+        applied = len(names)
+        try:
+            self.latest_timestamp = weather.ingest_sample_columns(
+                names, stamps, temps, stations, self.latest_timestamp
+            )
+        except ValueError as e:
+            applied = _first_invalid(names, stamps, temps)
+            self.error = (indexes[applied], str(e))
+        if len(stations) > count:
+            first_seen = self.first_seen
+            for index, name in zip(indexes[:applied], names[:applied]):
+                if name not in first_seen:
+                    first_seen[name] = index
+
+    def barrier(self, command: str) -> Reply:
+        """Report partial state for a control command."""
+        if command == 'snapshot':
+            rows = self.stations.snapshot()
+        elif command == 'query':
+            # All rows, without counting as a snapshot for later deltas.
+            rows = self.stations.query()
+        elif command == 'snapshot_delta':
+            rows = self.stations.delta()
+        else:
+            rows = {}
+        first_seen = self.first_seen
+        entries = [(first_seen[name], name, row) for name, row in rows.items()]
+        reply = self.error, self.latest_timestamp, entries, len(self.stations)
+        if command == 'reset':
+            self.stations.clear()
+            self.first_seen = {}
+            self.latest_timestamp = None
+        return reply
+
+
+def _first_invalid(names: List[Any], stamps: List[Any], temps: List[Any]) -> int:
+    """Position of the first sample that does not validate."""
+    for position, (station, stamp, temp) in enumerate(zip(names, stamps, temps)):
+        try:
+            weather.validate_sample_event(
+                {'stationName': station, 'timestamp': stamp, 'temperature': temp}
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            return position
+    return len(names)
+
+
+def _worker(conn: Connection) -> None:
+    shard = _Shard()
+    while True:
+        message = conn.recv()
+        if message[0] == 'samples':
+            shard.ingest(*message[1:])
+        elif message[0] == 'barrier':
+            conn.send(shard.barrier(message[1]))
+        else:
+            return
+
+
+class _Pool:
+    """Worker processes and the per-worker batches waiting to be sent."""
+
+    def __init__(self, workers: int, batch_size: int) -> None:
+        self.batch_size = batch_size
+        self.batches: List[Columns] = [([], [], [], []) for _ in range(workers)]
+        self.conns: List[Connection] = []
+        self.processes: List[multiprocessing.Process] = []
+        for _ in range(workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, args=(child,), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def route(self, index: int, station: Any, timestamp: Any, temperature: Any) -> None:
+        """Queue a sample for the worker that owns its station."""
+        shard = hash(station) % len(self.conns) if isinstance(station, str) else 0
+        batch = indexes, stations, timestamps, temperatures = self.batches[shard]
+        indexes.append(index)
+        stations.append(station)
+        timestamps.append(timestamp)
+        temperatures.append(temperature)
+        if len(indexes) >= self.batch_size:
+            self.conns[shard].send(('samples',) + batch)
+            self.batches[shard] = ([], [], [], [])
+
+    def barrier(self, command: str) -> List[Reply]:
+        """Flush all batches and collect every worker's partial state."""
+        for shard, conn in enumerate(self.conns):
+            if self.batches[shard][0]:
+                conn.send(('samples',) + self.batches[shard])
+                self.batches[shard] = ([], [], [], [])
+            conn.send(('barrier', command))
+        return [conn.recv() for conn in self.conns]
+
+    def close(self) -> None:
+        """Stop the workers."""
+        for conn in self.conns:
+            try:
+                conn.send(('stop',))
+            except OSError:
+                pass
+            conn.close()
+        for process in self.processes:
+            process.join()
+
+
+def _merge(replies: List[Reply]) -> Tuple[Optional[int], Dict[str, Dict[str, float]], int]:
+    """Merge worker replies into (asOf, stations, station count).
+
+    Raises the error of the earliest failing event, if any worker saw one.
+    """
+    errors = [error for error, _, _, _ in replies if error is not None]
+    if errors:
+        raise ValueError(min(errors)[1])
+    timestamps = [ts for _, ts, _, _ in replies if ts is not None]
+    stations = {
+        name: row for _, name, row in heapq.merge(*(entries for _, _, entries, _ in replies))
+    }
+    count = sum(count for _, _, _, count in replies)
+    return (max(timestamps) if timestamps else None), stations, count
+
+
+def _store(stations: Dict[str, Dict[str, float]]) -> StationStore:
+    """Load merged snapshot rows into a store, in first-seen order, to query them."""
+    rows = stations.values()
+    return StationStore.from_columns(
+        list(stations),
+        array('d', [row['high'] for row in rows]),
+        array('d', [row['low'] for row in rows]),
+    )
+
+
+def _validate_control(event: Any) -> str:
+    """Validate a non-sample event and return its control command."""
+    if not isinstance(event, dict) or 'type' not in event:
+        raise ValueError(
+            "Please verify input. Event must be a dictionary with 'type' field."
+        )
+    event_type = event.get('type')
+    if event_type != 'control':
+        raise ValueError(f"Please verify input. Unknown message type: {event_type}")
+    command = weather.validate_control_event(event)
+    if command not in _BARRIER_COMMANDS:
+        raise ValueError(f"Please verify input. Unknown control command: {command}")
+    return command
+
+
+def _answer(
+    pool: _Pool, command: str, event: dict[str, Any]
+) -> Tuple[Optional[dict[str, Any]], int]:
+    """Merge the workers' states for a control command: (output, station count)."""
+    latest_timestamp, stations, count = _merge(pool.barrier(command))
+    if command == 'stats':
+        return {'type': 'stats', 'asOf': latest_timestamp, 'stations': count}, count
+    if latest_timestamp is None:
+        return None, count
+    if command == 'query':
+        return weather.generate_query_output(_store(stations), latest_timestamp, event), count
+    if command == 'reset':
+        return weather.generate_reset_output(latest_timestamp), count
+    return {'type': command, 'asOf': latest_timestamp, 'stations': stations}, count
+
+
+def _answer_measured(
+    pool: _Pool, command: str, event: dict[str, Any], metrics: weather.Metrics, samples: int
+) -> Optional[dict[str, Any]]:
+    """Like ``_answer``, timing the command and counting the samples routed before it."""
+    start = time.perf_counter_ns()
+    output, count = _answer(pool, command, event)
+    end = time.perf_counter_ns()
+    metrics.count_samples(samples)
+    metrics.observe(event, end - start)
+    metrics.tick(end, count)
+    if output is not None and output['type'] == 'stats':
+        output.update(metrics.report())
+    return output
+
+
+def process_events_sharded(
+    events: Iterable[dict[str, Any]],
+    workers: int,
+    batch_size: int = weather.DEFAULT_BATCH_SIZE,
+    metrics: Optional[weather.Metrics] = None,
+) -> Generator[dict[str, Any], None, None]:
+    """Like ``weather.process_events``, with samples aggregated by ``workers`` processes.
+
+    Samples are routed in batches of station, timestamp and temperature
+    columns to the worker that owns their station (``hash(stationName) %
+    workers``), which applies each batch with ``ingest_sample_columns``.
+    Control messages are barriers at which the workers' partial states are
+    merged; stations keep their global first-seen order because workers
+    record the stream index at which they first saw each one. Errors are
+    raised for the earliest failing event.
+
+    With ``metrics``, control messages are timed and samples counted as in
+    ``weather.Aggregator``; the samples themselves are applied, untimed, by
+    the workers.
+    """
+    if workers <= 1:
+        yield from weather.Aggregator(metrics=metrics).process(events, batch_size)
+        return
+    pool = _Pool(workers, batch_size)
+    routed = 0
+    try:
+        for index, event in enumerate(events):
+            if isinstance(event, dict) and event.get('type') == 'sample':
+                try:
+                    pool.route(
+                        index, event['stationName'], event['timestamp'], event['temperature']
+                    )
+                except KeyError:
+                    # A sample routed earlier may have failed first; if not,
+                    # this one fails for its missing field.
+                    _merge(pool.barrier('sync'))
+                    weather.validate_sample_event(event)
+                continue
+            try:
+                command = _validate_control(event)
+            except ValueError:
+                # A sample routed earlier may have failed first.
+                _merge(pool.barrier('sync'))
+                raise
+            if command == 'snapshot' and not weather.SNAPSHOT_QUERY_FIELDS.isdisjoint(event):
+                command = 'query'
+            if metrics is None:
+                output, _ = _answer(pool, command, event)
+            else:
+                # Every event since the previous control message was a sample.
+                output = _answer_measured(pool, command, event, metrics, index - routed)
+                routed = index + 1
+            if output is not None:
+                yield output
+        _merge(pool.barrier('sync'))
+    finally:
+        pool.close()
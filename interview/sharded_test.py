@@ -0,0 +1,113 @@
+import random
+import pytest
+from . import sharded, weather
+
+def random_stream(length, stations, seed=0):
+    rng = random.Random(seed)
+    commands = ["snapshot", "snapshot_delta", "reset", "stats"]
+    for i in range(length):
+        if rng.random() < 0.005:
+            yield {"type": "control", "command": "snapshot", "topLow": 3, "prefix": "Station 1"}
+        elif rng.random() < 0.02:
+            yield {"type": "control", "command": rng.choice(commands)}
+        else:
+            yield {
+                "type": "sample",
+                "stationName": f"Station {rng.randrange(stations)}",
+                "timestamp": i,
+                "temperature": round(rng.uniform(-20.0, 100.0), 1),
+            }
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_matches_single_process(workers):
+    expected = list(weather.process_events(random_stream(5000, 50)))
+    result = list(sharded.process_events_sharded(random_stream(5000, 50), workers, batch_size=7))
+    assert result == expected
+    assert [list(output["stations"]) for output in result if "snapshot" in output["type"]] == [
+        list(output["stations"]) for output in expected if "snapshot" in output["type"]
+    ]
+
+def test_single_worker_uses_process_events():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "control", "command": "snapshot"},
+    ]
+    assert list(sharded.process_events_sharded(events, 1)) == list(weather.process_events(events))
+
+def test_control_without_data_is_ignored():
+    events = [
+        {"type": "control", "command": "snapshot"},
+        {"type": "control", "command": "reset"},
+    ]
+    assert not list(sharded.process_events_sharded(events, 2))
+
+def test_stats_without_data_is_answered():
+    events = [{"type": "control", "command": "stats"}]
+    assert list(sharded.process_events_sharded(events, 2)) == [
+        {"type": "stats", "asOf": None, "stations": 0},
+    ]
+
+def test_outputs_before_error_are_delivered():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "control", "command": "snapshot"},
+        {"type": "sample", "stationName": "A", "timestamp": "2", "temperature": 10.0},
+        {"type": "control", "command": "snapshot"},
+    ]
+    outputs = sharded.process_events_sharded(events, 2)
+    assert next(outputs)["type"] == "snapshot"
+    with pytest.raises(ValueError, match="Please verify input. timestamp must be an integer."):
+        next(outputs)
+
+@pytest.mark.parametrize("event, message", [
+    ({"type": "unknown"}, "Please verify input. Unknown message type: unknown"),
+    ({"type": "control"}, "Please verify input. Control message must contain 'command' field."),
+    ({"type": "control", "command": "x"}, "Please verify input. Unknown control command: x"),
+    ({"type": "sample", "stationName": 1, "timestamp": 1, "temperature": 1.0},
+     "Please verify input. stationName must be a string."),
+])
+def test_error_messages_match_single_process(event, message):
+    with pytest.raises(ValueError, match=message):
+        list(sharded.process_events_sharded([event], 2))
+
+def test_earliest_error_wins():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1},
+        {"type": "unknown"},
+    ]
+    with pytest.raises(ValueError, match="Sample must contain"):
+        list(sharded.process_events_sharded(events, 2))
+
+@pytest.mark.parametrize("bad_event, message", [
+    ({"type": "sample", "stationName": "B", "timestamp": "3", "temperature": 1.0},
+     "timestamp must be an integer"),
+    ({"type": "sample", "stationName": "B", "timestamp": 3, "temperature": 10**400},
+     "Unexpected error"),
+    ({"type": "sample", "stationName": "B", "timestamp": 3}, "Sample must contain"),
+])
+def test_bad_sample_in_a_batch_fails_as_in_single_process(bad_event, message):
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "sample", "stationName": "B", "timestamp": True, "temperature": 5},
+        {"type": "control", "command": "snapshot"},
+        {"type": "sample", "stationName": "C", "timestamp": 3, "temperature": 1.0},
+        bad_event,
+        {"type": "control", "command": "unknown"},
+    ]
+    for outputs in (weather.process_events(events),
+                    sharded.process_events_sharded(events, 3, batch_size=2)):
+        assert next(outputs) == {"type": "snapshot", "asOf": 1, "stations": {
+            "A": {"high": 10.0, "low": 10.0}, "B": {"high": 5.0, "low": 5.0},
+        }}
+        with pytest.raises(ValueError, match=message):
+            next(outputs)
+
+def test_stats_include_metrics():
+    events = list(random_stream(500, 20)) + [{"type": "control", "command": "stats"}]
+    metrics = weather.Metrics()
+    stats = list(sharded.process_events_sharded(events, 2, batch_size=7, metrics=metrics))[-1]
+    assert stats["events"]["sample"] + stats["events"]["control"] == len(events)
+    assert stats["commands"]["stats"] == sum(
+        event.get("command") == "stats" for event in events
+    )
+    assert stats["timings"]["stats"]["count"] == stats["commands"]["stats"]
@@ -0,0 +1,444 @@
+"""Spilling of idle stations to disk under a resident station budget.
+
+Every station gets a sequence number, in first-seen order, and keeps it
+while it is spilled. Spilled stations live in run files of records sorted
+by that number. A file starts with a hash table of record offsets and is
+followed by the records, each a u32 name length, the UTF-8 name, the i64
+sequence number, the f64 high and low and the i64 snapshot epoch in which
+the station last changed (-1 if it did not change since a snapshot).
+Every spill writes a new run, and runs of similar size are merged, so each
+record is rewritten a logarithmic number of times. A run keeps only a
+Bloom filter of about ``BLOOM_BITS`` bits per record in memory, so most
+stations that were never spilled are not looked up on disk at all.
+
+When a station is in several runs, the newest record is the live one.
+Records of stations that were reloaded since are stale.
+"""
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import weakref
+from array import array
+from itertools import islice
+from typing import (
+    BinaryIO, Dict, ItemsView, Iterable, Iterator, List, Mapping, Optional, Sequence, Set,
+    Tuple
+)
+from .state import Row, StationSelection, StationStore
+
+LENGTH = struct.Struct('<I')
+VALUES = struct.Struct('<qddq')
+# A hash table slot: the offset of a record, or 0 if the slot is empty.
+SLOT = struct.Struct('<Q')
+BLOOM_BITS = 10
+# Bytes of records written to a run file at a time.
+WRITE_SIZE = 1 << 16
+# The epoch of a record that did not change since the last snapshot.
+CLEAN = -1
+
+# (sequence number, name, high, low, epoch of the last change or CLEAN)
+Record = Tuple[int, str, float, float, int]
+
+
+def _bloom_positions(name: str, bits: int) -> Tuple[int, int, int]:
+    """Three bit positions of a name, by double hashing."""
+    value = hash(name) & 0xFFFFFFFFFFFFFFFF
+    first, step = value & 0xFFFFFFFF, (value >> 32) | 1
+    return first % bits, (first + step) % bits, (first + 2 * step) % bits
+
+
+def _bloom_add(bloom: bytearray, name: str) -> None:
+    for position in _bloom_positions(name, len(bloom) * 8):
+        bloom[position >> 3] |= 1 << (position & 7)
+
+
+def _encode(record: Record) -> bytes:
+    sequence, name, high, low, changed = record
+    encoded = name.encode()
+    return LENGTH.pack(len(encoded)) + encoded + VALUES.pack(sequence, high, low, changed)
+
+
+def _write_records(
+    file: BinaryIO, records: Iterable[Record], bloom: bytearray, table: mmap.mmap
+) -> int:
+    """Write records after the hash table, filling in the table and the Bloom filter.
+
+    Returns the record count.
+    """
+    mask = len(table) // SLOT.size - 1
+    offset = len(table)
+    count = size = 0
+    pending: List[bytes] = []
+    for record in records:
+        name = record[1]
+        _bloom_add(bloom, name)
+        slot = hash(name) & mask
+        while SLOT.unpack_from(table, slot * SLOT.size)[0]:
+            slot = (slot + 1) & mask
+        SLOT.pack_into(table, slot * SLOT.size, offset)
+        pending.append(_encode(record))
+        offset += len(pending[-1])
+        size += len(pending[-1])
+        count += 1
+        if size >= WRITE_SIZE:
+            file.write(b''.join(pending))
+            pending, size = [], 0
+    file.write(b''.join(pending))
+    return count
+
+
+class SpillRun:
+    """An immutable file of station records sorted by sequence number."""
+
+    def __init__(self, path: str, table: int, bloom: bytearray, count: int) -> None:
+        # Bytes of hash table before the first record.
+        self._table = table
+        self._mask = table // SLOT.size - 1
+        self._bloom = bloom
+        self.count = count
+        with open(path, 'rb') as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Deletes the file once the run is dropped, unless it was closed before.
+        self._release = weakref.finalize(self, SpillRun._remove, self._data, path)
+
+    @staticmethod
+    def _remove(data: mmap.mmap, path: str) -> None:
+        data.close()
+        os.unlink(path)
+
+    @classmethod
+    def write(
+        cls, directory: Optional[str], records: Iterable[Record], capacity: int
+    ) -> Optional['SpillRun']:
+        """Write records, sorted by sequence number and at most capacity of them.
+
+        Returns None if there are no records.
+        """
+        # At least twice as many slots as records keeps probe sequences short.
+        table = (1 << max(2 * capacity - 1, 1).bit_length()) * SLOT.size
+        bloom = bytearray((max(capacity, 1) * BLOOM_BITS + 7) // 8)
+        fd, path = tempfile.mkstemp(prefix='stations-', suffix='.spill', dir=directory)
+        with os.fdopen(fd, 'w+b') as file:
+            file.truncate(table)
+            file.seek(table)
+            with mmap.mmap(file.fileno(), table) as index:
+                count = _write_records(file, records, bloom, index)
+        if not count:
+            os.unlink(path)
+            return None
+        return cls(path, table, bloom, count)
+
+    def _record_at(self, offset: int) -> Tuple[Record, int]:
+        """The record at offset and the offset of the next one."""
+        data = self._data
+        (length,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        name = data[offset:offset + length].decode()
+        sequence, high, low, changed = VALUES.unpack_from(data, offset + length)
+        return (sequence, name, high, low, changed), offset + length + VALUES.size
+
+    def records(self) -> Iterator[Record]:
+        """All records, in sequence number order."""
+        offset, end = self._table, len(self._data)
+        while offset < end:
+            record, offset = self._record_at(offset)
+            yield record
+
+    def find(self, name: str) -> Optional[Record]:
+        """The record of a station, found through the hash table."""
+        bloom = self._bloom
+        for position in _bloom_positions(name, len(bloom) * 8):
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                return None
+        data, mask = self._data, self._mask
+        slot = hash(name) & mask
+        while True:
+            (offset,) = SLOT.unpack_from(data, slot * SLOT.size)
+            if not offset:
+                return None
+            record = self._record_at(offset)[0]
+            if record[1] == name:
+                return record
+            slot = (slot + 1) & mask
+
+    def close(self) -> None:
+        """Unmap and delete the file."""
+        self._release()
+
+
+def _tagged(run: SpillRun, age: int) -> Iterator[Tuple[int, int, Record]]:
+    # Newer runs sort first among equal sequence numbers.
+    for record in run.records():
+        yield record[0], -age, record
+
+
+def merge_runs(runs: Sequence[SpillRun], resident: Iterable[str]) -> Iterator[Record]:
+    """The live records of runs, oldest run first, in sequence number order.
+
+    For a station in several runs only the newest record is kept, and
+    stations in ``resident`` are skipped.
+    """
+    skip = resident if isinstance(resident, (set, dict)) else set(resident)
+    tagged = [_tagged(run, age) for age, run in enumerate(runs)]
+    previous = None
+    for sequence, _, record in heapq.merge(*tagged):
+        if sequence != previous and record[1] not in skip:
+            yield record
+        previous = sequence
+
+
+def _candidates(records: Iterable[Record], top_high: int, top_low: int) -> List[Record]:
+    """The records a top-K query picks from, in sequence number order.
+
+    Only the ``top_high`` highest highs and ``top_low`` lowest lows are
+    kept while the records go by, ties going to the earlier station.
+    """
+    # Min-heaps whose first entry is the one to drop next.
+    highs: List[Tuple[float, int, Record]] = []
+    lows: List[Tuple[float, int, Record]] = []
+    for record in records:
+        sequence, _, high, low, _ = record
+        for heap, key, limit in ((highs, high, top_high), (lows, -low, top_low)):
+            if len(heap) < limit:
+                heapq.heappush(heap, (key, -sequence, record))
+            elif limit and (key, -sequence) > heap[0][:2]:
+                heapq.heapreplace(heap, (key, -sequence, record))
+    chosen = {entry[2][0]: entry[2] for entry in highs + lows}
+    return [chosen[sequence] for sequence in sorted(chosen)]
+
+
+class _SpilledItems(ItemsView[str, Row]):
+    """Items of ``SpilledStations``, streamed in first-seen order."""
+
+    _mapping: 'SpilledStations'
+
+    def __iter__(self) -> Iterator[Tuple[str, Row]]:
+        for _, name, row in self._mapping.entries():
+            yield name, row
+
+
+class SpilledStations(Mapping[str, Row]):
+    """The ``stations`` object of a snapshot or delta with spilled stations.
+
+    The view is fixed when it is made: the resident rows are copied, and the
+    run files, which are never changed, are kept until the view is dropped.
+    Iterating it merges the two in first-seen order, so the whole snapshot
+    is never held in memory. Lookups go through the runs' hash tables, and
+    ``len`` iterates.
+    """
+
+    def __init__(
+        self,
+        resident: Dict[str, Tuple[int, Row]],
+        runs: Sequence[SpillRun],
+        skip: Set[str],
+        epoch: Optional[int],
+    ) -> None:
+        # (sequence number, row) of resident stations, in sequence number order.
+        self._resident = resident
+        self._runs = runs
+        # Stations resident when the view was made, whose records are stale.
+        self._skip = skip
+        # With an epoch, only spilled stations changed in it are included.
+        self._epoch = epoch
+
+    def entries(self) -> Iterator[Tuple[int, str, Row]]:
+        """(sequence number, name, row) of every station, in first-seen order."""
+        records: Iterable[Record] = merge_runs(self._runs, self._skip)
+        if self._epoch is not None:
+            epoch = self._epoch
+            records = (record for record in records if record[4] == epoch)
+        spilled = (
+            (sequence, name, {'high': high, 'low': low})
+            for sequence, name, high, low, _ in records
+        )
+        resident = ((sequence, name, row) for name, (sequence, row) in self._resident.items())
+        yield from heapq.merge(resident, spilled, key=lambda entry: entry[0])
+
+    def items(self) -> ItemsView[str, Row]:
+        return _SpilledItems(self)
+
+    def __getitem__(self, station: str) -> Row:
+        if station in self._skip:
+            return self._resident[station][1]
+        for run in reversed(self._runs):
+            record = run.find(station)
+            if record is not None:
+                if self._epoch is not None and record[4] != self._epoch:
+                    break
+                return {'high': record[2], 'low': record[3]}
+        raise KeyError(station)
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for _, name, _ in self.entries())
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.entries())
+
+
+class SpillingStationStore(StationStore):  # pylint: disable=too-many-instance-attributes
+    """A StationStore that keeps at most ``max_resident`` stations in memory.
+
+    When a batch of samples leaves more stations resident than that, the
+    least recently updated half are spilled to run files in ``directory``
+    (the system temporary directory by default). A spilled station is
+    reloaded by its next sample.
+
+    While anything is spilled, snapshots and deltas are ``SpilledStations``
+    views that read the spilled stations back as they are iterated; they
+    encode with ``streams.SnapshotEncoder`` but not with ``json.dumps``.
+    They are not reused by later snapshots. Stations stay in first-seen
+    order either way.
+    """
+
+    def __init__(self, max_resident: int, directory: Optional[str] = None) -> None:
+        super().__init__()
+        self.max_resident = max(max_resident, 1)
+        self.directory = directory
+        # Sequence numbers of resident stations, least recently updated first.
+        self._recent: Dict[str, int] = {}
+        # Oldest first.
+        self._runs: List[SpillRun] = []
+        self._spilled = 0
+        self._next_sequence = 0
+        # Snapshots and deltas taken; spilled records changed since the last carry it.
+        self._epoch = 0
+
+    def __len__(self) -> int:
+        return super().__len__() + self._spilled
+
+    def update(self, station: str, temperature: float) -> None:
+        """Fold a temperature in, reloading the station first if it was spilled."""
+        recent = self._recent
+        sequence = recent.pop(station, None)
+        if sequence is None:
+            for run in reversed(self._runs):
+                record = run.find(station)
+                if record is not None:
+                    sequence, _, high, low, changed = record
+                    self.restore(station, high, low, changed == self._epoch)
+                    self._spilled -= 1
+                    break
+            else:
+                sequence = self._next_sequence
+                self._next_sequence += 1
+        recent[station] = sequence
+        super().update(station, temperature)
+
+    def add_sample(self, station: str, timestamp: int, temperature: float) -> None:
+        super().add_sample(station, timestamp, temperature)
+        self._enforce_budget()
+
+    def add_samples(
+        self, stations: List[str], timestamps: List[int], temperatures: List[float]
+    ) -> None:
+        super().add_samples(stations, timestamps, temperatures)
+        self._enforce_budget()
+
+    def _enforce_budget(self) -> None:
+        resident = super().__len__()
+        if resident <= self.max_resident:
+            return
+        recent = self._recent
+        cold = list(islice(recent, resident - self.max_resident // 2))
+        sequences = {station: recent.pop(station) for station in cold}
+        epoch = self._epoch
+        evicted = sorted(
+            (sequences[name], name, high, low, epoch if dirty else CLEAN)
+            for name, high, low, dirty in self.evict(cold)
+        )
+        run = SpillRun.write(self.directory, evicted, len(evicted))
+        if run is None:
+            return
+        self._runs.append(run)
+        self._spilled += len(evicted)
+        runs = self._runs
+        while len(runs) > 1 and runs[-2].count <= 2 * runs[-1].count:
+            self._replace(len(runs) - 2)
+
+    def _replace(self, first: int) -> None:
+        """Merge the runs from first on into one.
+
+        The merged runs are not closed: snapshot views may still read them,
+        and their files are deleted once nothing refers to them.
+        """
+        merging = self._runs[first:]
+        records = merge_runs(merging, self._recent)
+        merged = SpillRun.write(self.directory, records, sum(run.count for run in merging))
+        self._runs[first:] = [] if merged is None else [merged]
+
+    def _view(self, resident: Mapping[str, Row], changed_only: bool) -> Mapping[str, Row]:
+        """The stations object of resident rows and, if any, the spilled stations."""
+        recent = self._recent
+        rows = sorted(
+            ((recent[name], name, row) for name, row in resident.items()),
+            key=lambda entry: entry[0],
+        )
+        epoch = self._epoch
+        self._epoch += 1
+        if not self._runs:
+            # Reloaded stations are resident out of first-seen order.
+            return {name: row for _, name, row in rows}
+        return SpilledStations(
+            {name: (sequence, row) for sequence, name, row in rows},
+            tuple(self._runs),
+            set(recent),
+            epoch if changed_only else None,
+        )
+
+    def snapshot(self) -> Mapping[str, Row]:
+        """Build the ``stations`` object of a snapshot output.
+
+        While anything is spilled, each snapshot is a new view and none is
+        kept, since a kept view would keep its runs' files.
+        """
+        if not self._runs:
+            return super().snapshot()
+        self._snapshot = None
+        return self._build_snapshot()
+
+    def _build_snapshot(self) -> Mapping[str, Row]:
+        return self._view(super()._build_snapshot(), False)
+
+    def delta(self) -> Mapping[str, Row]:
+        return self._view(super().delta(), True)
+
+    def query(
+        self,
+        top_high: Optional[int] = None,
+        top_low: Optional[int] = None,
+        stations: Optional[List[str]] = None,
+        prefix: Optional[str] = None,
+    ) -> StationSelection:
+        # The matching stations are streamed in first-seen order, keeping only
+        # the candidates of a top-K query, into a temporary store that answers
+        # the query; delta is left untouched.
+        recent = self._recent
+        resident = sorted(
+            (recent[name], name, high, low, CLEAN) for name, high, low in self.items()
+        )
+        records: Iterable[Record] = heapq.merge(resident, merge_runs(self._runs, recent))
+        if stations is not None:
+            wanted = set(stations)
+            records = (record for record in records if record[1] in wanted)
+        if prefix is not None:
+            records = (record for record in records if record[1].startswith(prefix))
+        if top_high is not None or top_low is not None:
+            records = _candidates(records, top_high or 0, top_low or 0)
+        names: List[str] = []
+        highs, lows = array('d'), array('d')
+        for _, name, high, low, _ in records:
+            names.append(name)
+            highs.append(high)
+            lows.append(low)
+        return StationStore.from_columns(names, highs, lows).query(top_high, top_low)
+
+    def clear(self) -> None:
+        super().clear()
+        self._recent = {}
+        # Dropped rather than closed, like merged runs.
+        self._runs = []
+        self._spilled = 0
+        self._next_sequence = 0
@@ -0,0 +1,141 @@
+import os
+import random
+import tracemalloc
+from typing import Any, List
+from . import spill, streams, weather
+from .state import StationStore
+
+
+def random_stream(seed: int, length: int) -> List[Any]:
+    rng = random.Random(seed)
+    events: List[Any] = []
+    for timestamp in range(1, length + 1):
+        if rng.random() < 0.02:
+            events.append({"type": "control", "command": rng.choice(
+                ["snapshot", "snapshot_delta", "snapshot_delta", "stats", "reset"]
+            )})
+        if rng.random() < 0.01:
+            events.append({"type": "control", "command": "snapshot", "topHigh": 3, "prefix": "S1"})
+        if rng.random() < 0.01:
+            events.append({"type": "control", "command": "snapshot", "topLow": 2,
+                           "stations": ["S1", "S90", "S400"]})
+        # A churning population: most samples go to recently seen stations.
+        station = rng.randrange(max(timestamp // 4 - 50, 0), timestamp // 4 + 1)
+        events.append({"type": "sample", "stationName": f"S{station}", "timestamp": timestamp,
+                       "temperature": round(rng.uniform(-20, 100), 1)})
+    return events
+
+
+def test_spill_run_round_trip(tmp_path):
+    records = [(i, f"S{i:03}", float(i), -float(i), 3 if i % 3 else spill.CLEAN)
+               for i in range(100)]
+    run = spill.SpillRun.write(str(tmp_path), records, len(records))
+    assert run is not None
+    assert list(run.records()) == records
+    assert run.count == 100
+    assert all(run.find(record[1]) == record for record in records)
+    assert run.find("S050a") is None
+    assert run.find("A") is None
+    run.close()
+    assert not os.listdir(tmp_path)
+    assert spill.SpillRun.write(str(tmp_path), [], 0) is None
+
+
+def test_newest_run_wins(tmp_path):
+    older = spill.SpillRun.write(str(tmp_path), [(0, "B", 1.0, 1.0, 0), (2, "A", 2.0, 2.0, 0)], 2)
+    newer = spill.SpillRun.write(str(tmp_path), [(1, "C", 3.0, 3.0, 1), (2, "A", 5.0, 0.0, 1)], 2)
+    assert older is not None and newer is not None
+    assert list(spill.merge_runs([older, newer], {"C"})) == [
+        (0, "B", 1.0, 1.0, 0), (2, "A", 5.0, 0.0, 1),
+    ]
+
+
+def test_outputs_match_an_unbounded_store(tmp_path):
+    events = random_stream(0, 5000)
+    aggregator = weather.Aggregator(spill.SpillingStationStore(40, str(tmp_path)))
+    outputs = list(aggregator.process(events, batch_size=32))
+    expected = list(weather.process_events(events))
+    # Encoded, so that the order of the stations is compared too.
+    encoder = streams.SnapshotEncoder()
+    assert [b"".join(encoder.encode(output)) for output in outputs] == \
+        [streams.encode_line(output) for output in expected]
+    assert len(aggregator.stations) > 40
+    assert os.listdir(tmp_path)
+
+
+def test_resident_stations_stay_bounded(tmp_path):
+    store = spill.SpillingStationStore(100, str(tmp_path))
+    for start in range(0, 2000, 50):
+        store.add_samples([f"S{i}" for i in range(start, start + 50)], [0] * 50,
+                          [float(i) for i in range(start, start + 50)])
+        assert StationStore.__len__(store) <= 100
+    assert len(store) == 2000
+    assert store.snapshot()["S7"] == {"high": 7.0, "low": 7.0}
+
+
+def test_reloaded_station_keeps_its_high_and_low(tmp_path):
+    store = spill.SpillingStationStore(2, str(tmp_path))
+    store.add_samples(["A", "A"], [1, 2], [10.0, 20.0])
+    store.add_samples(["B", "C", "D"], [3, 4, 5], [0.0, 0.0, 0.0])
+    assert "A" not in store
+    store.add_sample("A", 6, 15.0)
+    assert "A" in store
+    assert store.get("A") == (20.0, 10.0)
+    assert len(store) == 4
+
+
+def test_snapshot_keeps_first_seen_order_once_spilled(tmp_path):
+    store = spill.SpillingStationStore(2, str(tmp_path))
+    store.add_samples(["C", "A", "D", "B"], [1, 2, 3, 4], [1.0, 2.0, 3.0, 4.0])
+    snapshot = store.snapshot()
+    assert isinstance(snapshot, spill.SpilledStations)
+    assert list(snapshot) == ["C", "A", "D", "B"]
+    assert not store.delta()
+    store.add_samples(["A", "C", "E"], [5, 6, 7], [9.0, 0.0, 5.0])
+    delta = store.delta()
+    assert list(delta.items()) == [
+        ("C", {"high": 1.0, "low": 0.0}), ("A", {"high": 9.0, "low": 2.0}),
+        ("E", {"high": 5.0, "low": 5.0}),
+    ]
+    assert dict(delta) == dict(delta.items())
+    assert "D" not in delta and "B" not in delta
+    assert list(store.snapshot()) == ["C", "A", "D", "B", "E"]
+    # An earlier snapshot is not changed by later samples and spills.
+    assert dict(snapshot) == {
+        "C": {"high": 1.0, "low": 1.0}, "A": {"high": 2.0, "low": 2.0},
+        "D": {"high": 3.0, "low": 3.0}, "B": {"high": 4.0, "low": 4.0},
+    }
+    assert len(snapshot) == 4
+    assert "E" not in snapshot
+
+
+def test_repeated_snapshots_stay_within_the_budget(tmp_path):
+    store = spill.SpillingStationStore(100, str(tmp_path))
+    aggregator = weather.Aggregator(store)
+    events = [{"type": "sample", "stationName": f"S{i}", "timestamp": i, "temperature": float(i)}
+              for i in range(1, 10_001)]
+    snapshot = {"type": "control", "command": "snapshot"}
+    with open(os.devnull, 'wb') as sink, streams.OutputWriter(sink) as writer:
+        for output in aggregator.process(events + [snapshot] * 2):
+            writer.write(output)
+        tracemalloc.start()
+        try:
+            for output in aggregator.process([snapshot]):
+                writer.write(output)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    # Holding 10,000 rows or encoded stations would take megabytes.
+    assert peak < 500_000
+    assert StationStore.__len__(store) <= 100
+    assert store._snapshot is None  # pylint: disable=protected-access
+    assert not writer._encoder._fragments  # pylint: disable=protected-access
+
+
+def test_reset_removes_the_spill_file(tmp_path):
+    store = spill.SpillingStationStore(1, str(tmp_path))
+    store.add_samples(["A", "B", "C"], [1, 2, 3], [1.0, 2.0, 3.0])
+    assert os.listdir(tmp_path)
+    store.clear()
+    assert not os.listdir(tmp_path)
+    assert len(store) == 0
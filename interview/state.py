@@ -0,0 +1,308 @@
+import heapq
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, NoReturn, Optional, Tuple
+from .index import StationIndex
+
+Row = Dict[str, float]
+
+
+class ReadOnlyDict(Dict[str, Any]):
+    """A dict that refuses changes.
+
+    Rows and ``stations`` objects that a store hands out again in later
+    outputs are read-only, so that a caller changing one output cannot
+    change another. They still encode, pickle and compare like dicts.
+    """
+
+    def _refuse(self, *_args: Any, **_kwargs: Any) -> NoReturn:
+        raise TypeError(f"{type(self).__name__} is read-only")
+
+    __setitem__ = __delitem__ = clear = popitem = _refuse
+
+    # mypy cannot match a refusing ``|=`` with dict's overloaded ``|``.
+    def __ior__(self, _other: Any) -> NoReturn:  # type: ignore[misc]
+        self._refuse()
+
+    def setdefault(self, *_args: Any) -> NoReturn:
+        self._refuse()
+
+    def pop(self, *_args: Any) -> NoReturn:
+        self._refuse()
+
+    def update(self, *_args: Any, **_kwargs: Any) -> NoReturn:
+        self._refuse()
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return type(self), (dict(self),)
+
+
+class StationSelection(Dict[str, Row]):
+    """The ``stations`` object of a filtered or top-K snapshot.
+
+    It holds only some of the stations, which tells encoders not to take
+    it for the full set of a snapshot.
+    """
+
+
+# Placeholder row for dirty slots, whose row must be materialized again.
+_STALE: Row = {}
+
+
+class StationStore:  # pylint: disable=too-many-instance-attributes
+    """High/low temperatures per station, kept in contiguous columns.
+
+    Each station name is mapped to an integer slot the first time it is seen;
+    its high and low live at that index in two ``array('d')`` columns, so a
+    station costs two machine doubles plus its name instead of a dict.
+
+    Slots whose high or low changed since the last snapshot are tracked as
+    dirty. Snapshots materialize a fresh ``{'high', 'low'}`` row only for
+    dirty slots and share the rows of unchanged stations with earlier
+    snapshots, so each output is a point-in-time copy without rebuilding
+    every row. The rows are ``ReadOnlyDict`` instances, which keeps the
+    shared ones immutable.
+
+    Top-K and name-prefix queries are answered from a ``StationIndex``,
+    created by the first query and kept up to date from then on.
+
+    ``version`` is bumped by every change to the stations. A snapshot taken
+    at an unchanged version returns the same read-only ``stations`` object
+    as the one before it, so back-to-back snapshots cost nothing to build.
+    """
+
+    def __init__(self) -> None:
+        self._slots: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._highs = array('d')
+        self._lows = array('d')
+        self._rows: List[Row] = []
+        self._dirty: List[int] = []
+        self._index: Optional[StationIndex] = None
+        self.version = 0
+        # (version, stations) of the latest snapshot.
+        self._snapshot: Optional[Tuple[int, Mapping[str, Row]]] = None
+
+    @classmethod
+    def from_columns(
+        cls, names: List[str], highs: array, lows: array, dirty: Optional[Iterable[int]] = None
+    ) -> 'StationStore':
+        """Rebuild a store from the output of ``columns``.
+
+        Only the ``dirty`` slots, as returned by ``dirty_slots``, are reported
+        by the next ``delta``; without them every station starts dirty.
+        """
+        store = cls()
+        store._slots = dict(zip(names, range(len(names))))
+        store._names = names
+        store._highs = highs
+        store._lows = lows
+        if dirty is None:
+            store._rows = [_STALE] * len(names)
+            store._dirty = list(range(len(names)))
+        else:
+            store._dirty = list(dirty)
+            store._rows = [ReadOnlyDict(high=high, low=low) for high, low in zip(highs, lows)]
+            for slot in store._dirty:
+                store._rows[slot] = _STALE
+        return store
+
+    def columns(self) -> Tuple[List[str], array, array]:
+        """Copy the names, highs and lows in slot order."""
+        return self._names[:], self._highs[:], self._lows[:]
+
+    def dirty_slots(self) -> List[int]:
+        """Slots changed since the last snapshot, for ``from_columns``."""
+        return sorted(self._dirty)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, station: object) -> bool:
+        return station in self._slots
+
+    def update(self, station: str, temperature: float) -> None:
+        """Fold a temperature into the station's high and low."""
+        slot = self._slots.get(station)
+        if slot is None:
+            slot = self._slots[station] = len(self._names)
+            self._names.append(station)
+            self._highs.append(temperature)
+            self._lows.append(temperature)
+            self._rows.append(_STALE)
+            self._dirty.append(slot)
+            self.version += 1
+            return
+        if temperature > self._highs[slot]:
+            self._highs[slot] = temperature
+        elif temperature < self._lows[slot]:
+            self._lows[slot] = temperature
+        else:
+            return
+        self.version += 1
+        if self._rows[slot] is not _STALE:
+            self._rows[slot] = _STALE
+            self._dirty.append(slot)
+        if self._index is not None:
+            self._index.mark(slot)
+
+    def add_sample(self, station: str, timestamp: int, temperature: float) -> None:
+        """Fold a validated sample into the store; timestamps are for subclasses."""
+        del timestamp
+        self.update(station, temperature)
+
+    def add_samples(
+        self, stations: List[str], timestamps: List[int], temperatures: List[float]
+    ) -> None:
+        """Fold a run of validated samples into the store."""
+        del timestamps
+        self.update_many(stations, temperatures)
+
+    def update_many(self, stations: Iterable[str], temperatures: Iterable[float]) -> None:
+        """Fold a run of (station, temperature) pairs into the columns."""
+        update = self.update
+        for station, temperature in zip(stations, temperatures):
+            update(station, temperature)
+
+    def get(self, station: str) -> Tuple[float, float]:
+        """Return the (high, low) of a station."""
+        slot = self._slots[station]
+        return self._highs[slot], self._lows[slot]
+
+    def items(self) -> Iterator[Tuple[str, float, float]]:
+        """Iterate over (station, high, low) in first-seen order."""
+        return zip(self._names, self._highs, self._lows)
+
+    def restore(self, station: str, high: float, low: float, dirty: bool) -> None:
+        """Add a new station with a known high and low, as returned by ``evict``."""
+        slot = self._slots[station] = len(self._names)
+        self._names.append(station)
+        self._highs.append(high)
+        self._lows.append(low)
+        if dirty:
+            self._rows.append(_STALE)
+            self._dirty.append(slot)
+        else:
+            self._rows.append(ReadOnlyDict(high=high, low=low))
+        self.version += 1
+        if self._index is not None:
+            self._index.mark(slot)
+
+    def evict(self, stations: Iterable[str]) -> List[Tuple[str, float, float, bool]]:
+        """Remove stations and return their (name, high, low, dirty) in first-seen order.
+
+        The remaining stations keep their order and their rows.
+        """
+        slots = self._slots
+        gone = sorted(slots[station] for station in stations)
+        if not gone:
+            return []
+        names, highs, lows, rows = self._names, self._highs, self._lows, self._rows
+        dirty = set(self._dirty)
+        evicted = [(names[slot], highs[slot], lows[slot], slot in dirty) for slot in gone]
+        keep = sorted(set(range(len(names))).difference(gone))
+        moved = dict(zip(keep, range(len(keep))))
+        self._names = [names[slot] for slot in keep]
+        self._highs = array('d', [highs[slot] for slot in keep])
+        self._lows = array('d', [lows[slot] for slot in keep])
+        self._rows = [rows[slot] for slot in keep]
+        self._dirty = [moved[slot] for slot in self._dirty if slot in moved]
+        self._slots = dict(zip(self._names, range(len(keep))))
+        self._index = None
+        self.version += 1
+        return evicted
+
+    def clear(self) -> None:
+        """Drop all stations, replacing the columns rather than emptying them."""
+        self._slots = {}
+        self._names = []
+        self._highs = array('d')
+        self._lows = array('d')
+        self._rows = []
+        self._dirty = []
+        self._index = None
+        self.version += 1
+        self._snapshot = None
+
+    def _refresh(self) -> List[int]:
+        """Materialize rows for dirty slots and return those slots in slot order."""
+        dirty = sorted(self._dirty)
+        rows, highs, lows = self._rows, self._highs, self._lows
+        for slot in dirty:
+            rows[slot] = ReadOnlyDict(high=highs[slot], low=lows[slot])
+        self._dirty = []
+        return dirty
+
+    def snapshot(self) -> Mapping[str, Row]:
+        """Build the ``stations`` object of a snapshot output.
+
+        The object is reused by later snapshots until the next change, so
+        it is read-only, like its rows.
+        """
+        cached = self._snapshot
+        if cached is None or cached[0] != self.version:
+            cached = self._snapshot = self.version, self._build_snapshot()
+        return cached[1]
+
+    def _build_snapshot(self) -> Mapping[str, Row]:
+        self._refresh()
+        return ReadOnlyDict(zip(self._names, self._rows))
+
+    def delta(self) -> Mapping[str, Row]:
+        """Build a ``stations`` object of the stations changed since the last snapshot."""
+        names, rows = self._names, self._rows
+        return {names[slot]: rows[slot] for slot in self._refresh()}
+
+    def _synced_index(self) -> StationIndex:
+        """The query index, created on first use and caught up with all changes."""
+        if self._index is None:
+            self._index = StationIndex()
+        self._index.sync(self._names, self._highs, self._lows)
+        return self._index
+
+    def query(
+        self,
+        top_high: Optional[int] = None,
+        top_low: Optional[int] = None,
+        stations: Optional[List[str]] = None,
+        prefix: Optional[str] = None,
+    ) -> StationSelection:
+        """Build the ``stations`` object of a filtered or top-K snapshot.
+
+        ``stations`` and ``prefix`` restrict the stations considered. Of
+        those, ``top_high`` keeps the highest highs (highest first) and
+        ``top_low`` the lowest lows (lowest first), ties in first-seen order;
+        with both, the top highs come first and then the remaining top lows.
+        Without either the matches are in first-seen order. Queries do not
+        count as snapshots for ``delta``.
+        """
+        names, highs, lows = self._names, self._highs, self._lows
+        matches: Optional[List[int]] = None
+        if stations is not None:
+            slots = self._slots
+            matches = sorted({slots[name] for name in stations if name in slots})
+        if prefix is not None:
+            if matches is None:
+                matches = sorted(self._synced_index().with_prefix(prefix))
+            else:
+                matches = [slot for slot in matches if names[slot].startswith(prefix)]
+        if top_high is None and top_low is None:
+            chosen: Iterable[int] = range(len(names)) if matches is None else matches
+        else:
+            ranked: Dict[int, None] = {}
+            if top_high is not None:
+                ranked.update(dict.fromkeys(
+                    self._synced_index().top_highs(highs, top_high) if matches is None
+                    else heapq.nsmallest(top_high, matches, key=lambda slot: (-highs[slot], slot))
+                ))
+            if top_low is not None:
+                ranked.update(dict.fromkeys(
+                    self._synced_index().top_lows(lows, top_low) if matches is None
+                    else heapq.nsmallest(top_low, matches, key=lambda slot: (lows[slot], slot))
+                ))
+            chosen = ranked
+        rows = self._rows
+        return StationSelection(
+            (names[slot], rows[slot] if rows[slot] is not _STALE
+             else {'high': highs[slot], 'low': lows[slot]})
+            for slot in chosen
+        )
@@ -0,0 +1,167 @@
+import random
+import pytest
+from .state import StationStore
+
+def test_update_tracks_high_and_low():
+    store = StationStore()
+    for temperature in [10.0, 5.0, 25.0, 7.0]:
+        store.update("A", temperature)
+    assert store.get("A") == (25.0, 5.0)
+
+def test_stations_grow_in_first_seen_order():
+    store = StationStore()
+    names = [f"Station {i}" for i in range(1000)]
+    for i, name in enumerate(reversed(names)):
+        store.update(name, float(i))
+    assert len(store) == 1000
+    assert [name for name, _, _ in store.items()] == list(reversed(names))
+    assert "Station 0" in store
+    assert "Station 1000" not in store
+
+def test_snapshot_matches_nested_dict_layout():
+    store = StationStore()
+    store.update("A", 10.0)
+    store.update("B", 15.0)
+    store.update("A", 20.0)
+    assert store.snapshot() == {
+        "A": {"high": 20.0, "low": 10.0},
+        "B": {"high": 15.0, "low": 15.0},
+    }
+
+def test_snapshot_is_not_affected_by_later_updates():
+    store = StationStore()
+    store.update("A", 10.0)
+    snapshot = store.snapshot()
+    store.update("A", 30.0)
+    assert snapshot == {"A": {"high": 10.0, "low": 10.0}}
+
+def test_clear_drops_all_stations():
+    store = StationStore()
+    store.update("A", 10.0)
+    store.clear()
+    assert len(store) == 0
+    assert not store.snapshot()
+    store.update("B", 1.0)
+    assert store.snapshot() == {"B": {"high": 1.0, "low": 1.0}}
+
+def test_delta_contains_only_changed_stations():
+    store = StationStore()
+    store.update("A", 10.0)
+    store.update("B", 15.0)
+    assert store.delta() == {
+        "A": {"high": 10.0, "low": 10.0},
+        "B": {"high": 15.0, "low": 15.0},
+    }
+    store.update("B", 12.0)
+    store.update("A", 10.0)
+    assert store.delta() == {"B": {"high": 15.0, "low": 12.0}}
+    assert not store.delta()
+
+def test_full_snapshot_resets_delta():
+    store = StationStore()
+    store.update("A", 10.0)
+    store.snapshot()
+    assert not store.delta()
+
+def test_snapshots_share_unchanged_rows():
+    store = StationStore()
+    store.update("A", 10.0)
+    store.update("B", 15.0)
+    first = store.snapshot()
+    store.update("B", 20.0)
+    second = store.snapshot()
+    assert second["A"] is first["A"]
+    assert first["B"] == {"high": 15.0, "low": 15.0}
+    assert second["B"] == {"high": 20.0, "low": 15.0}
+
+def test_shared_snapshot_rows_are_read_only():
+    store = StationStore()
+    store.update("A", 10.0)
+    snapshot = store.snapshot()
+    with pytest.raises(TypeError):
+        snapshot.pop("A")
+    with pytest.raises(TypeError):
+        snapshot["A"]["low"] = 1.0
+    with pytest.raises(TypeError):
+        snapshot["A"].update(high=1.0)
+    assert store.snapshot() == {"A": {"high": 10.0, "low": 10.0}}
+
+def test_unchanged_snapshots_are_reused():
+    store = StationStore()
+    store.update("A", 10.0)
+    first = store.snapshot()
+    assert store.snapshot() is first
+    version = store.version
+    store.update("A", 5.0)
+    store.update("A", 7.0)  # within the high and low: no change
+    assert store.version == version + 1
+    second = store.snapshot()
+    assert second is not first
+    assert second == {"A": {"high": 10.0, "low": 5.0}}
+    assert not store.delta()
+    assert store.snapshot() is second
+    store.clear()
+    assert not store.snapshot()
+
+def brute_force_query(store, top_high=None, top_low=None, stations=None, prefix=None):
+    items = [(slot, name, high, low) for slot, (name, high, low) in enumerate(store.items())]
+    if stations is not None:
+        items = [item for item in items if item[1] in stations]
+    if prefix is not None:
+        items = [item for item in items if item[1].startswith(prefix)]
+    if top_high is not None or top_low is not None:
+        ranked = []
+        if top_high is not None:
+            ranked += sorted(items, key=lambda item: (-item[2], item[0]))[:top_high]
+        if top_low is not None:
+            ranked += [item for item in sorted(items, key=lambda item: (item[3], item[0]))[:top_low]
+                       if item not in ranked]
+        items = ranked
+    return {name: {"high": high, "low": low} for _, name, high, low in items}
+
+QUERIES = [
+    {"top_high": 5},
+    {"top_low": 5},
+    {"top_high": 3, "top_low": 3},
+    {"top_high": 0},
+    {"top_high": 1000},
+    {"prefix": "S1"},
+    {"prefix": ""},
+    {"prefix": "nope"},
+    {"stations": ["S3", "S1", "missing", "S3"]},
+    {"stations": ["S10", "S11", "S20"], "prefix": "S1", "top_low": 1},
+    {"prefix": "S2", "top_high": 2},
+]
+
+def test_query_matches_brute_force():
+    rng = random.Random(0)
+    store = StationStore()
+    for step in range(3000):
+        store.update(f"S{rng.randrange(40)}", float(rng.randrange(-50, 50)))
+        if step % 97 == 0:
+            for query in QUERIES:
+                result = store.query(**query)
+                expected = brute_force_query(store, **query)
+                assert result == expected
+                assert list(result) == list(expected)
+        if step % 1000 == 999:
+            store.clear()
+
+def test_query_does_not_consume_delta():
+    store = StationStore()
+    store.update("A", 10.0)
+    store.snapshot()
+    store.update("A", 20.0)
+    assert store.query(top_high=1) == {"A": {"high": 20.0, "low": 10.0}}
+    assert store.delta() == {"A": {"high": 20.0, "low": 10.0}}
+
+def test_index_heaps_stay_bounded():
+    store = StationStore()
+    store.update("A", 0.0)
+    store.update("B", 0.0)
+    store.query(top_high=1)
+    for temperature in range(1, 10_000):
+        store.update("A", float(temperature))
+        store.query(top_high=1)
+    assert store.query(top_high=1) == {"A": {"high": 9999.0, "low": 0.0}}
+    assert len(store._index.highs) < 100  # pylint: disable=protected-access
@@ -0,0 +1,383 @@
+import bisect
+import json
+import mmap
+import threading
+import time
+from typing import (
+    Any, BinaryIO, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+)
+from .state import StationSelection
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+# Stations per piece when a snapshot is written incrementally.
+SNAPSHOT_PIECE_STATIONS = 1024
+# Keys of the snapshot outputs encoded a piece at a time, in order.
+_SNAPSHOT_KEYS = ['type', 'asOf', 'stations']
+_STREAM_SNAPSHOT_KEYS = ['type', 'stream', 'asOf', 'stations']
+# Decodes one JSON document starting at an index, as json.loads would.
+_raw_decode = json.JSONDecoder().raw_decode
+
+
+def decode_lines(body: bytes) -> Iterator[Any]:
+    """Lazily decode a block of newline-separated JSON documents, one per line."""
+    try:
+        # Decode the documents back to back, checking that each one ends
+        # exactly at a newline: cheaper than json.loads per line, and a line
+        # holding more or less than one document falls back.
+        text = body.decode()
+        events: List[Any] = []
+        append, end, position = events.append, len(text), 0
+        while True:
+            event, position = _raw_decode(text, position)
+            append(event)
+            if position == end:
+                return iter(events)
+            if text[position] != '\n':
+                break
+            position += 1
+    except ValueError:
+        pass
+    # Blank, malformed or multi-document lines: decode one line at a time, so
+    # the events before a bad line are still delivered and the error is the
+    # one json.loads raises for that line.
+    return map(json.loads, body.split(b'\n'))
+
+
+def read_chunks(stream: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a binary stream in chunks, returning as soon as any data is available."""
+    read = getattr(stream, 'read1', stream.read)
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def skip_lines(chunks: Iterable[bytes], count: int) -> Iterator[bytes]:
+    """Drop the first count lines from a stream of chunks without decoding them."""
+    chunks = iter(chunks)
+    for chunk in chunks:
+        newlines = chunk.count(b'\n')
+        if newlines < count:
+            count -= newlines
+            continue
+        cut = -1
+        for _ in range(count):
+            cut = chunk.index(b'\n', cut + 1)
+        if cut + 1 < len(chunk):
+            yield chunk[cut + 1:]
+        break
+    yield from chunks
+
+
+def read_events(
+    stream: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE, skip: int = 0
+) -> Iterator[Any]:
+    """Lazily decode JSON lines from a binary stream, a chunk at a time.
+
+    The first ``skip`` lines are dropped undecoded, to resume after a checkpoint.
+    """
+    return decode_chunks(read_chunks(stream, chunk_size), skip)
+
+
+def decode_chunks(chunks: Iterable[bytes], skip: int = 0) -> Iterator[Any]:
+    """Lazily decode JSON lines from a stream of chunks, dropping the first skip lines."""
+    pending = b''
+    for chunk in skip_lines(chunks, skip) if skip else chunks:
+        cut = chunk.rfind(b'\n')
+        if cut < 0:
+            pending += chunk
+            continue
+        body = pending + chunk[:cut]
+        pending = chunk[cut + 1:]
+        yield from decode_lines(body)
+    if pending:
+        yield from decode_lines(pending)
+
+
+def encode_line(output: Any) -> bytes:
+    """Encode an output as one newline-terminated JSON line."""
+    return (json.dumps(output) + '\n').encode()
+
+
+class MappedFile:
+    """JSON lines read from a memory-mapped file, with byte offsets for resuming.
+
+    The lines between ``start_offset`` and ``end_offset`` (the end of the file
+    by default) are decoded a block of about ``chunk_size`` bytes at a time,
+    cut at a line boundary, so no per-line objects are created.
+    ``offset_after`` maps a count of events back to the byte offset just past
+    the last of them.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        start_offset: int = 0,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        end_offset: Optional[int] = None,
+    ) -> None:
+        with open(path, 'rb') as file:
+            size = file.seek(0, 2)
+            # mmap cannot map an empty file.
+            self._data: Union[mmap.mmap, bytes] = b''
+            if size:
+                self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        end_offset = size if end_offset is None else end_offset
+        for offset in (start_offset, end_offset):
+            if not 0 <= offset <= size or (0 < offset < size and self._data[offset - 1] != 10):
+                self.close()
+                raise ValueError(
+                    f"Please verify input. Offset {offset} is not at a line boundary of {path}."
+                )
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self._chunk_size = chunk_size
+        # Byte offset and number of events before each decoded block.
+        self._block_starts: List[int] = []
+        self._block_firsts: List[int] = []
+
+    def events(self) -> Iterator[Any]:
+        """Lazily decode the events from the start offset to the end offset."""
+        data, end = self._data, self.end_offset
+        pos = self.start_offset
+        count = 0
+        while pos < end:
+            cut = data.rfind(b'\n', pos, min(pos + self._chunk_size, end))
+            if cut < 0:
+                cut = data.find(b'\n', pos + self._chunk_size, end)
+            self._block_starts.append(pos)
+            self._block_firsts.append(count)
+            body = data[pos:end] if cut < 0 else data[pos:cut]
+            pos = end if cut < 0 else cut + 1
+            count += body.count(b'\n') + 1
+            yield from decode_lines(body)
+
+    def offset_after(self, count: int) -> int:
+        """Byte offset just past the first count events read."""
+        block = bisect.bisect_left(self._block_firsts, count) - 1
+        if block < 0:
+            return self.start_offset
+        data = self._data
+        pos = self._block_starts[block]
+        remaining = count - self._block_firsts[block]
+        for _ in range(remaining):
+            pos = data.find(b'\n', pos) + 1 or len(data)
+        return pos
+
+    def close(self) -> None:
+        """Unmap the file."""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def __enter__(self) -> 'MappedFile':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def _is_full_snapshot(kind: str, stations: Mapping[str, Any]) -> bool:
+    """Whether an output holds every station of its stream."""
+    return kind == 'snapshot' and not isinstance(stations, StationSelection)
+
+
+class SnapshotEncoder:
+    """Encodes outputs as JSON lines, producing snapshots a piece at a time.
+
+    The ``"name": {"high": .., "low": ..}`` fragment of each station is cached
+    along with the row it was encoded from. Stores hand out the same row
+    object until a station changes, so a snapshot re-encodes only the
+    stations that changed since the previous one. The bytes are the same as
+    ``encode_line`` would produce.
+
+    Fragments are kept per ``stream`` (outputs without one share a cache).
+    A full snapshot keeps only the fragments of its own stations, and a
+    reset drops its stream's fragments, so a cache holds no more than the
+    stations of its stream's latest snapshot and the deltas since. The
+    ``StationSelection`` of a filtered or top-K snapshot does not count as
+    a full snapshot: it uses the fragments but prunes nothing, and its
+    pieces are not kept.
+
+    The pieces of the latest snapshot are kept as well. A store returns the
+    same ``stations`` object for snapshots with no change in between, and a
+    snapshot with that object and the same ``asOf`` is answered from them.
+
+    ``stations`` may also be a mapping other than a dict, such as the view
+    of a store that spilled stations to disk. Those are encoded as they are
+    iterated and nothing of them is cached; a full snapshot of one drops what
+    is cached of its stream.
+    """
+
+    def __init__(self) -> None:
+        self._fragments: Dict[Optional[str], Dict[str, Tuple[Any, bytes]]] = {}
+        # (stream, stations, asOf, pieces) of the latest snapshot.
+        self._snapshot: Optional[Tuple[Optional[str], Any, Any, List[bytes]]] = None
+
+    def encode(self, output: Any) -> Iterator[bytes]:
+        """Yield the pieces of one newline-terminated JSON line."""
+        kind = output.get('type') if isinstance(output, dict) else None
+        stream = output.get('stream') if kind is not None else None
+        if kind == 'reset':
+            self._forget(stream)
+        if (kind not in ('snapshot', 'snapshot_delta')
+                or list(output) not in (_SNAPSHOT_KEYS, _STREAM_SNAPSHOT_KEYS)
+                or not isinstance(output['stations'], Mapping)
+                or not isinstance(stream, (str, type(None)))):
+            yield encode_line(output)
+            return
+        cached = self._snapshot
+        if (kind == 'snapshot' and cached is not None and cached[0] == stream
+                and cached[1] is output['stations'] and cached[2] == output['asOf']):
+            yield from cached[3]
+            return
+        pieces = self._pieces(kind, stream, output)
+        if (not isinstance(output['stations'], dict)
+                or not _is_full_snapshot(kind, output['stations'])):
+            yield from pieces
+            return
+        kept: List[bytes] = []
+        for piece in pieces:
+            kept.append(piece)
+            yield piece
+        self._snapshot = stream, output['stations'], output['asOf'], kept
+
+    def _forget(self, stream: Optional[str]) -> None:
+        """Drop what is cached of a stream."""
+        self._fragments.pop(stream, None)
+        if self._snapshot is not None and self._snapshot[0] == stream:
+            self._snapshot = None
+
+    def _pieces(
+        self, kind: str, stream: Optional[str], output: Dict[str, Any]
+    ) -> Iterator[bytes]:
+        dumps = json.dumps
+        head = f'{{"type": "{kind}", '
+        if stream is not None:
+            head += f'"stream": {dumps(stream)}, '
+        yield f'{head}"asOf": {dumps(output["asOf"])}, "stations": {{'.encode()
+        stations = output['stations']
+        fragments: Optional[Dict[str, Tuple[Any, bytes]]] = None
+        if isinstance(stations, dict):
+            fragments = self._fragments.setdefault(stream, {})
+        elif _is_full_snapshot(kind, stations):
+            self._forget(stream)
+        separator = b''
+        piece: List[bytes] = []
+        for name, row in stations.items():
+            if fragments is None:
+                piece.append(f'{dumps(name)}: {dumps(row)}'.encode())
+            else:
+                cached = fragments.get(name)
+                if cached is None or cached[0] is not row:
+                    cached = fragments[name] = (row, f'{dumps(name)}: {dumps(row)}'.encode())
+                piece.append(cached[1])
+            if len(piece) >= SNAPSHOT_PIECE_STATIONS:
+                yield separator + b', '.join(piece)
+                separator = b', '
+                piece = []
+        if (fragments is not None and _is_full_snapshot(kind, stations)
+                and len(fragments) > len(stations)):
+            # Stations gone since earlier outputs: keep only this snapshot's.
+            self._fragments[stream] = {name: fragments[name] for name in stations}
+        if piece:
+            yield separator + b', '.join(piece)
+        yield b'}}\n'
+
+
+class OutputWriter:
+    """Buffered JSON lines writer with a time-based flush rule.
+
+    With ``flush_interval_ms`` of 0 every output is flushed as soon as it is
+    written. Otherwise outputs are accumulated and flushed once at least that
+    many milliseconds have passed since the previous flush, and on ``close``.
+    A background thread does that flush when no further output comes, so
+    the replies to a slow or idle input are not held back until it ends.
+    """
+
+    def __init__(self, stream: BinaryIO, flush_interval_ms: float = 0) -> None:
+        self._stream = stream
+        self._interval = flush_interval_ms / 1000
+        self._pending: List[bytes] = []
+        self._last_flush = time.monotonic()
+        self._encoder = SnapshotEncoder()
+        # Guards the stream and the pending lines against the flusher thread.
+        self._ready = threading.Condition()
+        self._flusher: Optional[threading.Thread] = None
+        if self._interval:
+            self._flusher = threading.Thread(target=self._flush_when_due, daemon=True)
+            self._flusher.start()
+
+    def write(self, output: Any) -> None:
+        """Encode an output as one JSON line and flush if the interval has elapsed.
+
+        Without a flush interval, snapshots are written to the stream a piece
+        at a time instead of being assembled into one string first.
+        """
+        pieces = self._encoder.encode(output)
+        with self._ready:
+            if not self._interval:
+                for piece in pieces:
+                    self._stream.write(piece)
+                self._flush()
+                return
+            idle = not self._pending
+            self._pending.extend(pieces)
+            self._flush_if_due(idle)
+
+    def write_line(self, line: bytes) -> None:
+        """Queue an already encoded, newline-terminated line."""
+        with self._ready:
+            idle = not self._pending
+            self._pending.append(line)
+            if not self._interval:
+                self._flush()
+                return
+            self._flush_if_due(idle)
+
+    def flush(self) -> None:
+        """Write out all pending lines."""
+        with self._ready:
+            self._flush()
+
+    def close(self) -> None:
+        """Flush any remaining output and stop the flusher thread."""
+        flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            with self._ready:
+                self._ready.notify()
+            flusher.join()
+        self.flush()
+
+    def _flush_if_due(self, idle: bool) -> None:
+        """Flush if the interval has elapsed, else wake an idle flusher thread."""
+        if time.monotonic() - self._last_flush >= self._interval:
+            self._flush()
+        elif idle:
+            self._ready.notify()
+
+    def _flush(self) -> None:
+        if self._pending:
+            self._stream.write(b''.join(self._pending))
+            self._pending.clear()
+        self._stream.flush()
+        self._last_flush = time.monotonic()
+
+    def _flush_when_due(self) -> None:
+        """Flush pending lines once the interval has elapsed, until closed."""
+        with self._ready:
+            while self._flusher is not None:
+                if not self._pending:
+                    self._ready.wait()
+                    continue
+                remaining = self._last_flush + self._interval - time.monotonic()
+                if remaining > 0:
+                    self._ready.wait(remaining)
+                else:
+                    self._flush()
+
+    def __enter__(self) -> 'OutputWriter':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
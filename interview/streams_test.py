@@ -0,0 +1,208 @@
+import io
+import itertools
+import json
+import time
+import pytest
+from . import streams
+from .state import StationSelection
+
+EVENTS = [
+    {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+    {"type": "sample", "stationName": "B\nC", "timestamp": 2, "temperature": 20.0},
+    {"type": "control", "command": "snapshot"},
+]
+
+def encode(events):
+    return ''.join(json.dumps(event) + '\n' for event in events).encode()
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, streams.DEFAULT_CHUNK_SIZE])
+def test_read_events_across_chunk_boundaries(chunk_size):
+    stream = io.BytesIO(encode(EVENTS))
+    assert list(streams.read_events(stream, chunk_size)) == EVENTS
+
+def test_read_events_without_trailing_newline():
+    stream = io.BytesIO(encode(EVENTS).rstrip(b'\n'))
+    assert list(streams.read_events(stream)) == EVENTS
+
+@pytest.mark.parametrize("bad_line, error", [
+    (b'{"type": ', "Expecting value"),
+    (b'', "Expecting value"),
+    (b'  \r', "Expecting value"),
+    (b'{"type": "control"}, {"type": "control"}', "Extra data"),
+])
+def test_read_events_delivers_events_before_bad_line(bad_line, error):
+    data = encode(EVENTS[:2]) + bad_line + b'\n' + encode(EVENTS[2:])
+    delivered = []
+    with pytest.raises(json.JSONDecodeError, match=error):
+        for event in streams.read_events(io.BytesIO(data)):
+            delivered.append(event)
+    assert delivered == EVENTS[:2]
+
+@pytest.mark.parametrize("body", [
+    b'{"a":1\n"b":2}, {"c":3}',
+    b'{}],[{}\n[[{}\n{}]]',
+])
+def test_decode_lines_decodes_each_line_on_its_own(body):
+    lines = body.split(b'\n')
+    with pytest.raises(json.JSONDecodeError):
+        list(map(json.loads, lines))
+    with pytest.raises(json.JSONDecodeError):
+        list(streams.decode_lines(body))
+
+def test_decode_lines_allows_whitespace_around_documents():
+    assert list(streams.decode_lines(b' {"a": 1}\n{"b": 2}\r')) == [{"a": 1}, {"b": 2}]
+
+def test_read_events_rejects_a_blank_last_line():
+    with pytest.raises(json.JSONDecodeError):
+        list(streams.read_events(io.BytesIO(encode(EVENTS) + b'  ')))
+
+def test_read_events_unicode():
+    event = {"type": "sample", "stationName": "🚁 Station", "timestamp": 1, "temperature": 1}
+    data = json.dumps(event, ensure_ascii=False).encode() + b'\n'
+    assert list(streams.read_events(io.BytesIO(data), 3)) == [event]
+
+def test_writer_flushes_every_output_by_default():
+    stream = io.BytesIO()
+    writer = streams.OutputWriter(stream)
+    writer.write({"type": "reset", "asOf": 1})
+    assert stream.getvalue() == b'{"type": "reset", "asOf": 1}\n'
+
+def test_writer_holds_output_until_interval_elapses():
+    stream = io.BytesIO()
+    with streams.OutputWriter(stream, flush_interval_ms=60_000) as writer:
+        writer.write({"type": "reset", "asOf": 1})
+        writer.write({"type": "reset", "asOf": 2})
+        assert stream.getvalue() == b''
+    assert stream.getvalue() == b'{"type": "reset", "asOf": 1}\n{"type": "reset", "asOf": 2}\n'
+
+def test_writer_flushes_while_the_source_is_idle():
+    stream = io.BytesIO()
+    with streams.OutputWriter(stream, flush_interval_ms=50) as writer:
+        writer.write({"type": "reset", "asOf": 1})
+        deadline = time.monotonic() + 5
+        while not stream.getvalue() and time.monotonic() < deadline:
+            time.sleep(0.01)  # a slow source: no further output comes
+        assert stream.getvalue() == b'{"type": "reset", "asOf": 1}\n'
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 64])
+@pytest.mark.parametrize("skip", [0, 1, 2, 3, 4])
+def test_read_events_skips_lines(chunk_size, skip):
+    stream = io.BytesIO(encode(EVENTS))
+    assert list(streams.read_events(stream, chunk_size, skip)) == EVENTS[skip:]
+
+def replay(path, start_offset, stop, chunk_size):
+    """Read stop events from start_offset and return them with the offset reached."""
+    with streams.MappedFile(str(path), start_offset, chunk_size) as source:
+        events = list(itertools.islice(source.events(), stop))
+        return events, source.offset_after(len(events))
+
+@pytest.mark.parametrize("chunk_size", [1, 20, streams.DEFAULT_CHUNK_SIZE])
+def test_mapped_file_resumes_from_reported_offset(tmp_path, chunk_size):
+    path = tmp_path / "events.jsonl"
+    path.write_bytes(encode(EVENTS[:2]).replace(b'\n', b'\r\n') + encode(EVENTS[2:]))
+    for stop in range(len(EVENTS) + 1):
+        first, offset = replay(path, 0, stop, chunk_size)
+        second, end = replay(path, offset, None, chunk_size)
+        assert first + second == EVENTS
+        assert end == len(path.read_bytes())
+
+def test_mapped_file_without_trailing_newline(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_bytes(encode(EVENTS).rstrip(b'\n'))
+    assert replay(path, 0, None, 7) == (EVENTS, len(path.read_bytes()))
+
+def test_mapped_file_empty(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_bytes(b'')
+    assert replay(path, 0, None, 7) == ([], 0)
+
+@pytest.mark.parametrize("offset", [1, -1, 10_000])
+def test_mapped_file_rejects_offsets_inside_lines(tmp_path, offset):
+    path = tmp_path / "events.jsonl"
+    path.write_bytes(encode(EVENTS))
+    with pytest.raises(ValueError, match="is not at a line boundary"):
+        streams.MappedFile(str(path), offset)
+
+def test_snapshot_encoder_matches_json_dumps():
+    encoder = streams.SnapshotEncoder()
+    stations = {f"S{i} \"🚁\"": {"high": i + 0.5, "low": -i} for i in range(2500)}
+    outputs = [
+        {"type": "snapshot", "asOf": 3, "stations": stations},
+        {"type": "snapshot_delta", "asOf": 3, "stations": {}},
+        {"type": "snapshot", "asOf": 3, "stations": stations},
+        {"type": "reset", "asOf": 3},
+        {"type": "stats", "asOf": 3, "stations": 2500},
+    ]
+    for output in outputs:
+        assert b"".join(encoder.encode(output)) == streams.encode_line(output)
+
+def test_snapshot_encoder_reencodes_only_changed_rows():
+    encoder = streams.SnapshotEncoder()
+    unchanged = {"high": 1.0, "low": 1.0}
+    changed = {"high": 2.0, "low": 2.0}
+    first = {"type": "snapshot", "asOf": 1, "stations": {"A": unchanged, "B": changed}}
+    list(encoder.encode(first))
+    # A row equal to the old one but not the same object is a change.
+    changed = {"high": 2.0, "low": 1.0}
+    output = {"type": "snapshot", "asOf": 2, "stations": {"A": unchanged, "B": changed}}
+    assert b"".join(encoder.encode(output)) == streams.encode_line(output)
+    unchanged["high"] = 5.0  # rows are never mutated; a mutation shows the cache is used
+    assert b'"A": {"high": 1.0' in b"".join(encoder.encode(output))
+
+def test_snapshot_encoder_keeps_fragments_of_the_latest_snapshot_only():
+    encoder = streams.SnapshotEncoder()
+    row = {"high": 1.0, "low": 1.0}
+    for start in range(0, 5000, 1000):
+        stations = {f"S{i}": row for i in range(start, start + 1000)}
+        list(encoder.encode({"type": "snapshot", "asOf": start, "stations": stations}))
+        list(encoder.encode({"type": "snapshot_delta", "asOf": start, "stations": {"X": row}}))
+    fragments = encoder._fragments[None]  # pylint: disable=protected-access
+    assert len(fragments) == 1001
+    assert "S0" not in fragments
+
+def test_snapshot_encoder_keeps_fragments_across_query_snapshots():
+    encoder = streams.SnapshotEncoder()
+    rows = {f"S{i}": {"high": float(i), "low": float(i)} for i in range(100)}
+    list(encoder.encode({"type": "snapshot", "asOf": 1, "stations": rows}))
+    top = StationSelection({"S99": rows["S99"]})
+    output = {"type": "snapshot", "asOf": 1, "stations": top}
+    assert b"".join(encoder.encode(output)) == streams.encode_line(output)
+    assert len(encoder._fragments[None]) == 100  # pylint: disable=protected-access
+
+def test_snapshot_encoder_caches_fragments_per_stream():
+    encoder = streams.SnapshotEncoder()
+    north, south = {"high": 1.0, "low": 1.0}, {"high": 2.0, "low": 2.0}
+    outputs = [
+        {"type": "snapshot", "stream": "north", "asOf": 1, "stations": {"A": north}},
+        {"type": "snapshot", "stream": "south", "asOf": 2, "stations": {"A": south}},
+        {"type": "snapshot_delta", "stream": "north", "asOf": 1, "stations": {"A": north}},
+        {"type": "reset", "stream": "south", "asOf": 2},
+        {"type": "snapshot", "asOf": 3, "stations": {"A": south}},
+    ]
+    for output in outputs:
+        assert b"".join(encoder.encode(output)) == streams.encode_line(output)
+    north["high"] = 5.0  # rows are never mutated; a mutation shows the cache is used
+    line = b"".join(encoder.encode(outputs[2]))
+    assert line == b'{"type": "snapshot_delta", "stream": "north", "asOf": 1, ' \
+                   b'"stations": {"A": {"high": 1.0, "low": 1.0}}}\n'
+
+def test_snapshot_encoder_reuses_an_unchanged_snapshot():
+    encoder = streams.SnapshotEncoder()
+    stations = {"A": {"high": 1.0, "low": 1.0}}
+    output = {"type": "snapshot", "asOf": 1, "stations": stations}
+    line = b"".join(encoder.encode(output))
+    stations["B"] = {"high": 2.0, "low": 2.0}  # never done; shows the line is reused
+    assert b"".join(encoder.encode({**output})) == line
+    later = {"type": "snapshot", "asOf": 2, "stations": stations}
+    assert b"".join(encoder.encode(later)) == streams.encode_line(later)
+    list(encoder.encode({"type": "reset", "asOf": 2}))
+    assert b"".join(encoder.encode(later)) == streams.encode_line(later)
+
+@pytest.mark.parametrize("flush_interval_ms", [0, 60_000])
+def test_writer_streams_snapshots(flush_interval_ms):
+    stream = io.BytesIO()
+    output = {"type": "snapshot", "asOf": 1, "stations": {"A": {"high": 1.0, "low": 0.5}}}
+    with streams.OutputWriter(stream, flush_interval_ms) as writer:
+        writer.write(output)
+        writer.write(output)
+    assert stream.getvalue() == streams.encode_line(output) * 2
@@ -0,0 +1,181 @@
+"""Independent aggregation of many streams (tenants) in one process.
+
+A message with a ``stream`` key belongs to that stream, and one without it
+to the default stream. Each stream has its own stations and ``asOf``.
+Control messages apply only to their own stream, and their outputs carry
+the same ``stream`` key.
+
+Streams that have had no message for a while are compacted: their station
+names are zlib-compressed JSON, their highs and lows stay in packed columns,
+and the dict, rows and indexes of a live StationStore are dropped. A
+compacted stream is rebuilt on its next message, with the same pending
+snapshot_delta as before.
+"""
+import collections
+import json
+import zlib
+from array import array
+from typing import Any, Dict, Generator, Iterable, List, NamedTuple, Optional
+from . import weather
+from .state import StationStore
+
+STREAM_KEY = 'stream'
+DEFAULT_MAX_STREAMS = 10_000
+DEFAULT_IDLE_EVENTS = 1_000_000
+
+
+class CompactStream(NamedTuple):
+    """The state of an idle stream, packed."""
+    names: bytes
+    highs: array
+    lows: array
+    dirty: array
+    latest_timestamp: Optional[int]
+    position: int
+
+
+def compact(aggregator: weather.Aggregator) -> CompactStream:
+    """Pack an aggregator's state."""
+    names, highs, lows = aggregator.stations.columns()
+    return CompactStream(
+        zlib.compress(json.dumps(names).encode()), highs, lows,
+        array('q', aggregator.stations.dirty_slots()),
+        aggregator.latest_timestamp, aggregator.position,
+    )
+
+
+def expand(stream: CompactStream) -> weather.Aggregator:
+    """Rebuild the aggregator packed by compact."""
+    names = json.loads(zlib.decompress(stream.names))
+    stations = StationStore.from_columns(names, stream.highs, stream.lows, stream.dirty)
+    return weather.Aggregator(stations, stream.latest_timestamp, stream.position)
+
+
+def _stream_of(event: Any) -> Optional[str]:
+    if not isinstance(event, dict):
+        return None
+    stream = event.get(STREAM_KEY)
+    if stream is not None and not isinstance(stream, str):
+        raise ValueError("Please verify input. stream must be a string.")
+    return stream
+
+
+class StreamAggregators:
+    """One aggregator per stream; streams idle for ``idle_events`` events are compacted.
+
+    At most ``max_streams`` streams, including the default one, may be seen;
+    a message for one more raises an error. ``position`` counts all events
+    applied, as for Aggregator. ``metrics``, if given, is shared by the live
+    aggregators of all streams.
+    """
+
+    def __init__(
+        self,
+        max_streams: int = DEFAULT_MAX_STREAMS,
+        idle_events: int = DEFAULT_IDLE_EVENTS,
+        metrics: Optional[weather.Metrics] = None,
+    ) -> None:
+        self.max_streams = max_streams
+        self.idle_events = idle_events
+        self.metrics = metrics
+        self.position = 0
+        # Live aggregators, least recently used first, and when each was last used.
+        self._active: 'collections.OrderedDict[Optional[str], weather.Aggregator]' = (
+            collections.OrderedDict()
+        )
+        self._last_used: Dict[Optional[str], int] = {}
+        self._idle: Dict[Optional[str], CompactStream] = {}
+
+    def __len__(self) -> int:
+        return len(self._active) + len(self._idle)
+
+    def is_compacted(self, stream: Optional[str]) -> bool:
+        """Whether a stream is currently held in compact form."""
+        return stream in self._idle
+
+    def aggregator(self, stream: Optional[str]) -> weather.Aggregator:
+        """The live aggregator of a stream, expanding or creating it if need be."""
+        self._last_used[stream] = self.position
+        aggregator = self._active.get(stream)
+        if aggregator is not None:
+            self._active.move_to_end(stream)
+            return aggregator
+        idle = self._idle.pop(stream, None)
+        if idle is not None:
+            aggregator = expand(idle)
+        elif len(self) >= self.max_streams:
+            del self._last_used[stream]
+            raise ValueError(
+                f"Please verify input. Too many streams: at most {self.max_streams} are allowed."
+            )
+        else:
+            aggregator = weather.Aggregator()
+        aggregator.metrics = self.metrics
+        self._active[stream] = aggregator
+        return aggregator
+
+    def compact_idle(self) -> None:
+        """Compact the streams unused for at least idle_events events."""
+        active, last_used = self._active, self._last_used
+        while active:
+            stream = next(iter(active))
+            if self.position - last_used[stream] < self.idle_events:
+                return
+            self._idle[stream] = compact(active.pop(stream))
+            del last_used[stream]
+
+    def _apply(
+        self, stream: Optional[str], events: List[Any], batch_size: int
+    ) -> Generator[dict[str, Any], None, None]:
+        aggregator = self.aggregator(stream)
+        before = aggregator.position
+        try:
+            for output in aggregator.process(events, batch_size):
+                yield output if stream is None else {
+                    'type': output['type'], STREAM_KEY: stream, **output
+                }
+        finally:
+            self.position += aggregator.position - before
+
+    def _flush(
+        self, pending: Dict[Optional[str], List[Any]], batch_size: int
+    ) -> Generator[dict[str, Any], None, None]:
+        for stream, run in pending.items():
+            yield from self._apply(stream, run, batch_size)
+        pending.clear()
+        self.compact_idle()
+
+    def process(
+        self, events: Iterable[Any], batch_size: int = weather.DEFAULT_BATCH_SIZE
+    ) -> Generator[dict[str, Any], None, None]:
+        """Apply events to their streams and yield outputs.
+
+        Samples are held per stream until batch_size of them are pending in
+        all, or until a control message of their own stream, so streams that
+        interleave finely are still applied in batches. An error is raised
+        once the events of its stream before it are applied; buffered samples
+        of other streams may not have been.
+        """
+        pending: Dict[Optional[str], List[Any]] = {}
+        count = 0
+        for event in events:
+            try:
+                stream = _stream_of(event)
+            except ValueError:
+                yield from self._flush(pending, batch_size)
+                raise
+            if isinstance(event, dict) and event.get('type') == 'sample':
+                run = pending.get(stream)
+                if run is None:
+                    run = pending[stream] = []
+                run.append(event)
+                count += 1
+                if count >= batch_size:
+                    yield from self._flush(pending, batch_size)
+                    count = 0
+                continue
+            run = pending.pop(stream, [])
+            count -= len(run)
+            run.append(event)
+            yield from self._apply(stream, run, batch_size)
+        yield from self._flush(pending, batch_size)
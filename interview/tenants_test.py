@@ -0,0 +1,123 @@
+import random
+from typing import Any, Dict, List
+import pytest
+from . import tenants, weather
+
+
+def test_streams_are_independent():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0,
+         "stream": "north"},
+        {"type": "sample", "stationName": "A", "timestamp": 5, "temperature": 30.0,
+         "stream": "south"},
+        {"type": "sample", "stationName": "B", "timestamp": 7, "temperature": 0.0},
+        {"type": "control", "command": "snapshot", "stream": "north"},
+        {"type": "control", "command": "reset", "stream": "south"},
+        {"type": "control", "command": "snapshot", "stream": "south"},
+        {"type": "control", "command": "snapshot"},
+        {"type": "control", "command": "snapshot_delta", "stream": "north"},
+    ]
+    assert list(tenants.StreamAggregators().process(events)) == [
+        {"type": "snapshot", "stream": "north", "asOf": 1,
+         "stations": {"A": {"high": 10.0, "low": 10.0}}},
+        {"type": "reset", "stream": "south", "asOf": 5},
+        {"type": "snapshot", "asOf": 7, "stations": {"B": {"high": 0.0, "low": 0.0}}},
+        {"type": "snapshot_delta", "stream": "north", "asOf": 1, "stations": {}},
+    ]
+
+
+def test_compaction_is_transparent():
+    rng = random.Random(3)
+    names = [f"stream {i}" for i in range(6)]
+    events: List[Any] = []
+    clocks = dict.fromkeys(names, 0)
+    for _ in range(3000):
+        stream = rng.choice(names)
+        if rng.random() < 0.05:
+            command = rng.choice(["snapshot", "snapshot_delta", "reset", "stats"])
+            events.append({"type": "control", "command": command, "stream": stream})
+            continue
+        clocks[stream] += rng.randint(1, 10)
+        events.append({"type": "sample", "stationName": f"S{rng.randrange(20)}",
+                       "timestamp": clocks[stream], "temperature": round(rng.uniform(-20, 100), 1),
+                       "stream": stream})
+    expected: Dict[str, List[Any]] = {}
+    for stream in names:
+        own = [event for event in events if event["stream"] == stream]
+        expected[stream] = [{"type": output["type"], "stream": stream, **output}
+                            for output in weather.process_events(own)]
+    aggregators = tenants.StreamAggregators(idle_events=20)
+    outputs = []
+    compacted = 0
+    for output in aggregators.process(events, batch_size=16):
+        outputs.append(output)
+        compacted += sum(aggregators.is_compacted(stream) for stream in names)
+    assert compacted
+    for stream in names:
+        assert [output for output in outputs if output["stream"] == stream] == expected[stream]
+    assert aggregators.position == len(events)
+
+
+def test_compact_round_trip_keeps_pending_delta():
+    aggregator = weather.Aggregator()
+    for event in [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "sample", "stationName": "B", "timestamp": 2, "temperature": 20.0},
+        {"type": "control", "command": "snapshot"},
+        {"type": "sample", "stationName": "B", "timestamp": 3, "temperature": 25.0},
+    ]:
+        aggregator.handle(event)
+    restored = tenants.expand(tenants.compact(aggregator))
+    assert restored.latest_timestamp == 3
+    assert restored.position == 4
+    assert restored.handle({"type": "control", "command": "snapshot_delta"}) == {
+        "type": "snapshot_delta", "asOf": 3, "stations": {"B": {"high": 25.0, "low": 20.0}},
+    }
+
+
+def test_stream_cap():
+    aggregators = tenants.StreamAggregators(max_streams=2)
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0, "stream": "a"},
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0, "stream": "b"},
+        {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": 2.0, "stream": "a"},
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0, "stream": "c"},
+    ]
+    with pytest.raises(ValueError, match="Please verify input. Too many streams: at most 2"):
+        list(aggregators.process(events))
+    assert aggregators.position == 3
+    assert len(aggregators) == 2
+
+
+def test_idle_streams_are_compacted():
+    aggregators = tenants.StreamAggregators(idle_events=3)
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0, "stream": "a"},
+        {"type": "control", "command": "snapshot_delta", "stream": "a"},
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0, "stream": "b"},
+        {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": 2.0, "stream": "b"},
+        {"type": "sample", "stationName": "A", "timestamp": 3, "temperature": 3.0, "stream": "b"},
+        {"type": "control", "command": "snapshot", "stream": "b"},
+    ]
+    list(aggregators.process(events, batch_size=2))
+    assert aggregators.is_compacted("a")
+    assert not aggregators.is_compacted("b")
+    assert list(aggregators.process([
+        {"type": "sample", "stationName": "B", "timestamp": 2, "temperature": 5.0, "stream": "a"},
+        {"type": "control", "command": "snapshot_delta", "stream": "a"},
+    ])) == [
+        {"type": "snapshot_delta", "stream": "a", "asOf": 2,
+         "stations": {"B": {"high": 5.0, "low": 5.0}}},
+    ]
+    assert not aggregators.is_compacted("a")
+
+
+def test_invalid_stream_key():
+    aggregators = tenants.StreamAggregators()
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0, "stream": "a"},
+        {"type": "control", "command": "snapshot", "stream": 5},
+    ]
+    with pytest.raises(ValueError, match="Please verify input. stream must be a string."):
+        list(aggregators.process(events))
+    assert aggregators.position == 1
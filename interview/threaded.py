@@ -0,0 +1,124 @@
+"""Aggregator state shared between threads.
+
+Stations are spread over stripes by the hash of their name. Each stripe is a
+StationStore with its own lock, so threads ingesting different stations do
+not contend. Without a GIL (free-threaded CPython) they run in parallel.
+
+Snapshots are copy on write. A reader takes every stripe lock only long
+enough to capture references to the current stores. It then builds its
+output from them with no lock held. The next writer to touch a captured
+stripe first copies that stripe's columns, so captured stores never change.
+A snapshot therefore waits for at most one stripe update at a time,
+whatever its size.
+"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from . import weather
+from .state import StationStore
+
+DEFAULT_STRIPES = 16
+
+# (stations, timestamps, temperatures) of one stripe's part of a batch
+Columns = Tuple[List[str], List[int], List[float]]
+
+
+class _Stripe:
+    """One partition of the stations, guarded by its lock."""
+
+    __slots__ = ('lock', 'store', 'latest_timestamp', 'captured')
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.store = StationStore()
+        self.latest_timestamp: Optional[int] = None
+        # Whether a reader holds self.store, which must then be copied before a write.
+        self.captured = False
+
+    def add_samples(self, columns: Columns) -> None:
+        """Fold samples into the store; the lock must be held."""
+        if self.captured:
+            self.store = StationStore.from_columns(*self.store.columns())
+            self.captured = False
+        stations, timestamps, temperatures = columns
+        self.store.add_samples(stations, timestamps, temperatures)
+        newest = max(timestamps)
+        if self.latest_timestamp is None or newest > self.latest_timestamp:
+            self.latest_timestamp = newest
+
+
+class ConcurrentAggregator:
+    """High/low aggregation that may be called from many threads at once.
+
+    ``ingest`` applies each batch atomically: a snapshot includes either all
+    or none of its samples. Outputs have the same shape as those of
+    ``process_events``, but stations are listed stripe by stripe rather than
+    in first-seen order.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES) -> None:
+        self._stripes = [_Stripe() for _ in range(stripes)]
+
+    def ingest(self, samples: List[dict[str, Any]]) -> None:
+        """Validate and apply a batch of sample events; an invalid one rejects the batch."""
+        count = len(self._stripes)
+        batches: Dict[int, Columns] = {}
+        for event in samples:
+            station, timestamp, temperature = weather.validate_sample_event(event)
+            columns = batches.get(hash(station) % count)
+            if columns is None:
+                columns = batches[hash(station) % count] = ([], [], [])
+            columns[0].append(station)
+            columns[1].append(timestamp)
+            columns[2].append(temperature)
+        # Locks are always taken in stripe order, so batches cannot deadlock.
+        touched = sorted(batches)
+        for index in touched:
+            self._stripes[index].lock.acquire()
+        try:
+            for index in touched:
+                self._stripes[index].add_samples(batches[index])
+        finally:
+            for index in touched:
+                self._stripes[index].lock.release()
+
+    def _capture(self) -> List[Tuple[StationStore, Optional[int]]]:
+        """Take a consistent cut of every stripe's store and latest timestamp."""
+        for stripe in self._stripes:
+            stripe.lock.acquire()
+        try:
+            cut = []
+            for stripe in self._stripes:
+                stripe.captured = True
+                cut.append((stripe.store, stripe.latest_timestamp))
+            return cut
+        finally:
+            for stripe in self._stripes:
+                stripe.lock.release()
+
+    def snapshot(self) -> Optional[dict[str, Any]]:
+        """A snapshot output of a consistent point in time, or None without sample data."""
+        cut = self._capture()
+        stamps = [latest for _, latest in cut if latest is not None]
+        if not stamps:
+            return None
+        stations = {}
+        for store, _ in cut:
+            for name, high, low in store.items():
+                stations[name] = {'high': high, 'low': low}
+        return {'type': 'snapshot', 'asOf': max(stamps), 'stations': stations}
+
+    def reset(self) -> Optional[dict[str, Any]]:
+        """Drop all stations and return the reset output, or None without sample data."""
+        for stripe in self._stripes:
+            stripe.lock.acquire()
+        try:
+            stamps = [stripe.latest_timestamp for stripe in self._stripes
+                      if stripe.latest_timestamp is not None]
+            for stripe in self._stripes:
+                stripe.store = StationStore()
+                stripe.latest_timestamp = None
+                stripe.captured = False
+        finally:
+            for stripe in self._stripes:
+                stripe.lock.release()
+        return weather.generate_reset_output(max(stamps)) if stamps else None
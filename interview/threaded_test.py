@@ -0,0 +1,109 @@
+import sys
+import threading
+import pytest
+from . import benchmark, threaded, weather
+
+
+def test_matches_process_events():
+    config = benchmark.StreamConfig(stations=50, length=2000, snapshot_every=500)
+    aggregator = threaded.ConcurrentAggregator(stripes=4)
+    outputs = []
+    batch = []
+    for event in benchmark.generate_stream(config):
+        if event["type"] == "sample":
+            batch.append(event)
+            continue
+        aggregator.ingest(batch)
+        batch = []
+        outputs.append(aggregator.snapshot())
+    assert outputs == list(weather.process_events(benchmark.generate_stream(config)))
+
+
+def test_no_sample_data():
+    aggregator = threaded.ConcurrentAggregator()
+    assert aggregator.snapshot() is None
+    assert aggregator.reset() is None
+    aggregator.ingest([{"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0}])
+    assert aggregator.reset() == {"type": "reset", "asOf": 1}
+    assert aggregator.snapshot() is None
+    aggregator.ingest([{"type": "sample", "stationName": "B", "timestamp": 2, "temperature": 5.0}])
+    assert aggregator.snapshot() == {
+        "type": "snapshot", "asOf": 2, "stations": {"B": {"high": 5.0, "low": 5.0}},
+    }
+
+
+def test_invalid_sample_rejects_the_batch():
+    aggregator = threaded.ConcurrentAggregator()
+    with pytest.raises(ValueError, match="Please verify input. temperature must be a number."):
+        aggregator.ingest([
+            {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+            {"type": "sample", "stationName": "B", "timestamp": 2, "temperature": "warm"},
+        ])
+    assert aggregator.snapshot() is None
+
+
+def test_snapshots_are_unaffected_by_later_writes():
+    aggregator = threaded.ConcurrentAggregator(stripes=2)
+    aggregator.ingest([
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "sample", "stationName": "B", "timestamp": 2, "temperature": 20.0},
+    ])
+    before = aggregator.snapshot()
+    aggregator.ingest([
+        {"type": "sample", "stationName": "A", "timestamp": 3, "temperature": 30.0},
+        {"type": "sample", "stationName": "C", "timestamp": 4, "temperature": 0.0},
+    ])
+    assert before == {
+        "type": "snapshot", "asOf": 2,
+        "stations": {"A": {"high": 10.0, "low": 10.0}, "B": {"high": 20.0, "low": 20.0}},
+    }
+    assert aggregator.snapshot()["stations"]["A"] == {"high": 30.0, "low": 10.0}
+
+
+def test_concurrent_batches_are_atomic_for_readers():
+    aggregator = threaded.ConcurrentAggregator(stripes=8)
+    writers, batches, pairs = 4, 500, 32
+    done = threading.Event()
+    torn = []
+
+    def write(writer: int) -> None:
+        for i in range(batches):
+            # Every station of a writer gets the same temperature in each batch,
+            # so a reader that sees part of a batch finds differing highs.
+            aggregator.ingest([
+                {"type": "sample", "stationName": f"{writer}-{pair}",
+                 "timestamp": writer * batches + i, "temperature": float(i)}
+                for pair in range(pairs)
+            ])
+
+    def read() -> None:
+        while not done.is_set():
+            output = aggregator.snapshot()
+            if output is None:
+                continue
+            for writer in range(writers):
+                highs = {row["high"] for name, row in output["stations"].items()
+                         if name.startswith(f"{writer}-")}
+                if len(highs) > 1:
+                    torn.append(highs)
+
+    # Switch threads often, so that a non-atomic batch would be caught half done.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        reader = threading.Thread(target=read)
+        reader.start()
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        done.set()
+        reader.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert not torn
+    final = aggregator.snapshot()
+    assert final["asOf"] == writers * batches - 1
+    assert len(final["stations"]) == writers * pairs
+    assert all(row == {"high": batches - 1.0, "low": 0.0} for row in final["stations"].values())
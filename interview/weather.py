@@ -1,18 +1,31 @@
-from typing import Any, Iterable, Generator, Dict, Optional, Tuple
+import asyncio
+import json
+import time
+from typing import (
+    Any, AsyncGenerator, AsyncIterable, Callable, Dict, Iterable, Generator, List, Optional,
+    TextIO, Tuple,
+)
+from .state import StationStore
+from .quantiles import QuantileStationStore
+from .window import WindowedStationStore
+
+DEFAULT_BATCH_SIZE = 4096
+DEFAULT_QUEUE_SIZE = 4 * DEFAULT_BATCH_SIZE
+
+# (output to emit, if any; latest timestamp after the event, None after a reset)
+Result = Tuple[Optional[dict[str, Any]], Optional[int]]
 
 
 def validate_sample_event(event: dict[str, Any]) -> Tuple[str, int, float]:
     """Validate and extract sample event fields."""
-    required_fields = ['stationName', 'timestamp', 'temperature']
-    for key in required_fields:
-        if key not in event:
-            raise ValueError(
-                "Please verify input. Sample must contain stationName, timestamp, and temperature."
-            )
-
-    station = event['stationName']
-    temp = event['temperature']
-    ts = event['timestamp']
+    try:
+        station = event['stationName']
+        ts = event['timestamp']
+        temp = event['temperature']
+    except KeyError:
+        raise ValueError(
+            "Please verify input. Sample must contain stationName, timestamp, and temperature."
+        ) from None
 
     if not isinstance(station, str):
         raise ValueError("Please verify input. stationName must be a string.")
@@ -33,29 +46,54 @@ def validate_control_event(event: dict[str, Any]) -> str:
     return event['command']
 
 
-def update_station_data(
-    stations_data: Dict[str, Dict[str, float]], station: str, temperature: float
-) -> None:
-    """Update high/low temperatures for a station."""
-    if station not in stations_data:
-        stations_data[station] = {'high': temperature, 'low': temperature}
-    else:
-        stations_data[station]['high'] = max(
-            stations_data[station]['high'], temperature
-        )
-        stations_data[station]['low'] = min(
-            stations_data[station]['low'], temperature
-        )
+def validate_snapshot_query(
+    event: dict[str, Any]
+) -> Tuple[Optional[int], Optional[int], Optional[List[str]], Optional[str]]:
+    """Validate and extract the optional topHigh, topLow, stations and prefix fields."""
+    top_high, top_low = event.get('topHigh'), event.get('topLow')
+    stations, prefix = event.get('stations'), event.get('prefix')
+    for field, count in (('topHigh', top_high), ('topLow', top_low)):
+        if count is not None and (not isinstance(count, int) or isinstance(count, bool)
+                                  or count < 0):
+            raise ValueError(f"Please verify input. {field} must be a non-negative integer.")
+    if stations is not None and (not isinstance(stations, list)
+                                 or not all(isinstance(name, str) for name in stations)):
+        raise ValueError("Please verify input. stations must be a list of station names.")
+    if prefix is not None and not isinstance(prefix, str):
+        raise ValueError("Please verify input. prefix must be a string.")
+    return top_high, top_low, stations, prefix
 
 
 def generate_snapshot_output(
-    stations_data: Dict[str, Dict[str, float]], latest_timestamp: int
+    stations_data: StationStore, latest_timestamp: int
 ) -> dict[str, Any]:
     """Generate snapshot output."""
     return {
         'type': 'snapshot',
         'asOf': latest_timestamp,
-        'stations': stations_data.copy()
+        'stations': stations_data.snapshot()
+    }
+
+
+def generate_query_output(
+    stations_data: StationStore, latest_timestamp: int, event: dict[str, Any]
+) -> dict[str, Any]:
+    """Generate snapshot output narrowed by the query fields of a snapshot message."""
+    return {
+        'type': 'snapshot',
+        'asOf': latest_timestamp,
+        'stations': stations_data.query(*validate_snapshot_query(event))
+    }
+
+
+def generate_delta_output(
+    stations_data: StationStore, latest_timestamp: int
+) -> dict[str, Any]:
+    """Generate snapshot delta output."""
+    return {
+        'type': 'snapshot_delta',
+        'asOf': latest_timestamp,
+        'stations': stations_data.delta()
     }
 
 
@@ -67,67 +105,468 @@ def generate_reset_output(latest_timestamp: int) -> dict[str, Any]:
     }
 
 
+def generate_window_output(
+    stations_data: WindowedStationStore, latest_timestamp: int
+) -> dict[str, Any]:
+    """Generate window snapshot output."""
+    return {
+        'type': 'window_snapshot',
+        'asOf': latest_timestamp,
+        'windowMs': stations_data.window_ms,
+        'stations': stations_data.window_snapshot(latest_timestamp)
+    }
+
+
+def generate_percentiles_output(
+    stations_data: QuantileStationStore, latest_timestamp: int
+) -> dict[str, Any]:
+    """Generate percentiles output."""
+    return {
+        'type': 'percentiles',
+        'asOf': latest_timestamp,
+        'stations': stations_data.percentiles()
+    }
+
+
+def generate_stats_output(
+    stations_data: StationStore, latest_timestamp: Optional[int]
+) -> dict[str, Any]:
+    """Generate stats output."""
+    return {
+        'type': 'stats',
+        'asOf': latest_timestamp,
+        'stations': len(stations_data)
+    }
+
+
 def handle_sample_event(
     event: dict[str, Any],
-    stations_data: Dict[str, Dict[str, float]],
+    stations_data: StationStore,
     latest_timestamp: Optional[int]
-) -> int:
-    """Handle sample event and return updated latest timestamp."""
+) -> Tuple[None, int]:
+    """Handle sample event and return (None, new_latest_timestamp)."""
     station, ts, temp = validate_sample_event(event)
     if latest_timestamp is None or ts > latest_timestamp:
         latest_timestamp = ts
-    update_station_data(stations_data, station, temp)
-    return latest_timestamp
+    stations_data.add_sample(station, ts, temp)
+    return None, latest_timestamp
+
+
+def snapshot_command(stations_data: StationStore, latest_timestamp: int) -> Result:
+    """Emit all stations."""
+    return generate_snapshot_output(stations_data, latest_timestamp), latest_timestamp
+
+
+def snapshot_delta_command(stations_data: StationStore, latest_timestamp: int) -> Result:
+    """Emit the stations changed since the previous snapshot."""
+    return generate_delta_output(stations_data, latest_timestamp), latest_timestamp
+
+
+def reset_command(stations_data: StationStore, latest_timestamp: int) -> Result:
+    """Drop all stations."""
+    stations_data.clear()
+    return generate_reset_output(latest_timestamp), None
+
+
+def window_snapshot_command(stations_data: StationStore, latest_timestamp: int) -> Result:
+    """Emit high/low per station over the configured time window."""
+    if not isinstance(stations_data, WindowedStationStore):
+        raise ValueError(
+            "Please verify input. window_snapshot requires a configured window."
+        )
+    return generate_window_output(stations_data, latest_timestamp), latest_timestamp
+
+
+def percentiles_command(stations_data: StationStore, latest_timestamp: int) -> Result:
+    """Emit estimated temperature percentiles per station."""
+    if not isinstance(stations_data, QuantileStationStore):
+        raise ValueError(
+            "Please verify input. percentiles requires configured percentile sketches."
+        )
+    return generate_percentiles_output(stations_data, latest_timestamp), latest_timestamp
+
+
+def stats_command(stations_data: StationStore, latest_timestamp: Optional[int]) -> Result:
+    """Emit runtime statistics, with an ``asOf`` of None before any sample data."""
+    return generate_stats_output(stations_data, latest_timestamp), latest_timestamp
+
+
+# Optional fields that narrow a snapshot control message down to some stations.
+SNAPSHOT_QUERY_FIELDS = frozenset(('topHigh', 'topLow', 'stations', 'prefix'))
+
+# Control commands by name. Each runs only when there is sample data, except
+# stats, which is always answered, and returns (output, new_latest_timestamp).
+CONTROL_COMMANDS: Dict[str, Callable[[StationStore, int], Result]] = {
+    'snapshot': snapshot_command,
+    'snapshot_delta': snapshot_delta_command,
+    'reset': reset_command,
+    'stats': stats_command,
+    'window_snapshot': window_snapshot_command,
+    'percentiles': percentiles_command,
+}
 
 
 def handle_control_event(
     event: dict[str, Any],
-    stations_data: Dict[str, Dict[str, float]],
+    stations_data: StationStore,
     latest_timestamp: Optional[int]
-) -> Tuple[Optional[dict[str, Any]], Optional[int]]:
+) -> Result:
     """Handle control event and return (output, new_latest_timestamp)."""
-    command = validate_control_event(event)
-    if command == 'snapshot':
-        if latest_timestamp is not None:
-            return generate_snapshot_output(stations_data, latest_timestamp), latest_timestamp
-        return None, latest_timestamp
-    if command == 'reset':
-        if latest_timestamp is not None:
-            return generate_reset_output(latest_timestamp), None
+    try:
+        command = CONTROL_COMMANDS[event['command']]
+    except (KeyError, TypeError):
+        command_name = validate_control_event(event)
+        raise ValueError(
+            f"Please verify input. Unknown control command: {command_name}"
+        ) from None
+    if latest_timestamp is None:
+        if command is stats_command:
+            return stats_command(stations_data, None)
         return None, None
-    raise ValueError(f"Please verify input. Unknown control command: {command}")
+    if command is snapshot_command and not SNAPSHOT_QUERY_FIELDS.isdisjoint(event):
+        return generate_query_output(stations_data, latest_timestamp, event), latest_timestamp
+    return command(stations_data, latest_timestamp)
+
+
+# Event handlers by message type, each returning (output, new_latest_timestamp).
+EVENT_HANDLERS: Dict[str, Callable[[dict[str, Any], StationStore, Optional[int]], Result]] = {
+    'sample': handle_sample_event,
+    'control': handle_control_event,
+}
+
+
+def handle_event(
+    event: Any,
+    stations_data: StationStore,
+    latest_timestamp: Optional[int]
+) -> Result:
+    """Handle any event and return (output, new_latest_timestamp)."""
+    try:
+        handler = EVENT_HANDLERS[event['type']]
+    except (KeyError, TypeError):
+        if not isinstance(event, dict) or 'type' not in event:
+            raise ValueError(
+                "Please verify input. Event must be a dictionary with 'type' field."
+            ) from None
+        raise ValueError(
+            f"Please verify input. Unknown message type: {event['type']}"
+        ) from None
+
+    try:
+        return handler(event, stations_data, latest_timestamp)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Please verify input. Unexpected error: {str(e)}") from e
+
+
+def _to_floats(temperatures: List[Any]) -> bool:
+    """Convert int temperatures to floats in place, as validate_sample_event does.
+
+    Returns False if a temperature is not a number or is an int too large for
+    a float, leaving the list as it was.
+    """
+    kinds = set(map(type, temperatures))
+    if not kinds <= {float, int}:
+        return False
+    if int in kinds:
+        try:
+            temperatures[:] = [float(temperature) for temperature in temperatures]
+        except OverflowError:
+            return False
+    return True
+
+
+def ingest_samples(
+    events: List[dict[str, Any]],
+    stations_data: StationStore,
+    latest_timestamp: Optional[int]
+) -> Optional[int]:
+    """Apply a run of sample events column-wise and return the updated latest timestamp."""
+    try:
+        names = [event['stationName'] for event in events]
+        stamps = [event['timestamp'] for event in events]
+        temps = [event['temperature'] for event in events]
+    except KeyError:
+        for event in events:
+            _, latest_timestamp = handle_event(event, stations_data, latest_timestamp)
+        return latest_timestamp
+    return ingest_sample_columns(names, stamps, temps, stations_data, latest_timestamp)
+
+
+def ingest_sample_columns(
+    names: List[Any],
+    stamps: List[Any],
+    temps: List[Any],
+    stations_data: StationStore,
+    latest_timestamp: Optional[int]
+) -> Optional[int]:
+    """Apply a run of samples given as station, timestamp and temperature columns.
+
+    Returns the updated latest timestamp. An invalid sample raises as
+    ``handle_event`` would, after the samples before it are applied.
+    """
+    # Exact JSON types only; anything else (including bool timestamps) takes
+    # the scalar path, which validates and reports errors sample by sample.
+    if (not names or not set(map(type, names)) <= {str}
+            or not set(map(type, stamps)) <= {int}
+            or not _to_floats(temps)):
+        for station, stamp, temp in zip(names, stamps, temps):
+            sample = {'type': 'sample', 'stationName': station, 'timestamp': stamp,
+                      'temperature': temp}
+            _, latest_timestamp = handle_event(sample, stations_data, latest_timestamp)
+        return latest_timestamp
+    newest = max(stamps)
+    if latest_timestamp is None or newest > latest_timestamp:
+        latest_timestamp = newest
+    stations_data.add_samples(names, stamps, temps)
+    return latest_timestamp
+
+
+class Histogram:
+    """Durations in nanoseconds, counted in power-of-two buckets."""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, duration_ns: int) -> None:
+        """Add one duration."""
+        self.buckets[min(duration_ns.bit_length(), 63)] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        self.max_ns = max(self.max_ns, duration_ns)
+
+    def percentile(self, fraction: float) -> int:
+        """Upper bound of the bucket holding the given fraction of durations."""
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << bucket) - 1, self.max_ns)
+        return self.max_ns
+
+    def summary(self) -> dict[str, float]:
+        """Count and microsecond percentiles."""
+        return {
+            'count': self.count,
+            'meanUs': self.total_ns / self.count / 1000 if self.count else 0.0,
+            'p50Us': self.percentile(0.5) / 1000,
+            'p99Us': self.percentile(0.99) / 1000,
+            'maxUs': self.max_ns / 1000,
+        }
+
+
+class Metrics:
+    """Event counts and handling-time histograms for one stream.
+
+    Only an ``Aggregator`` given a Metrics object and callers that time their
+    own work (such as output serialization) record into it, so streams
+    processed without one pay nothing for it. Samples are timed a batch at a
+    time and control messages one at a time.
+    """
+
+    def __init__(self, dump_to: Optional[TextIO] = None, dump_interval_s: float = 0) -> None:
+        self.events: Dict[str, int] = {}
+        self.commands: Dict[str, int] = {}
+        self.timings: Dict[str, Histogram] = {}
+        self.started_ns = time.perf_counter_ns()
+        self._dump_to = dump_to
+        self._dump_interval_ns = int(dump_interval_s * 1e9)
+        # Checked by the event loop; never reached when dumping is off.
+        self.next_dump_ns = (
+            self.started_ns + self._dump_interval_ns
+            if dump_to is not None and dump_interval_s > 0 else float('inf')
+        )
+
+    def record(self, name: str, duration_ns: int) -> None:
+        """Add a duration to the named histogram."""
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram()
+        histogram.record(duration_ns)
+
+    def observe(self, event: dict[str, Any], duration_ns: int) -> None:
+        """Count a handled event and record its duration under its type or command."""
+        name = event['type']
+        self.events[name] = self.events.get(name, 0) + 1
+        if name == 'control':
+            name = event['command']
+            self.commands[name] = self.commands.get(name, 0) + 1
+        self.record(name, duration_ns)
+
+    def count_samples(self, count: int) -> None:
+        """Count handled samples."""
+        self.events['sample'] = self.events.get('sample', 0) + count
+
+    def observe_samples(self, count: int, duration_ns: int) -> None:
+        """Count a batch of handled samples and record its duration."""
+        self.count_samples(count)
+        self.record('sample', duration_ns)
+
+    def tick(self, now_ns: int, stations: int) -> None:
+        """Dump a report if one is due."""
+        if now_ns >= self.next_dump_ns:
+            self.dump(now_ns, stations)
+
+    def report(self) -> dict[str, Any]:
+        """Counters and timing summaries, for stats outputs and dumps."""
+        return {
+            'uptimeSec': (time.perf_counter_ns() - self.started_ns) / 1e9,
+            'events': dict(self.events),
+            'commands': dict(self.commands),
+            'timings': {name: histogram.summary() for name, histogram in self.timings.items()},
+        }
+
+    def dump(self, now_ns: int, stations: int) -> None:
+        """Write a report line to the dump stream and schedule the next one."""
+        self.next_dump_ns = now_ns + self._dump_interval_ns
+        print(json.dumps({'type': 'stats', 'stations': stations, **self.report()}),
+              file=self._dump_to, flush=True)
+
+
+class Aggregator:
+    """The state of one stream, kept outside any single process_events call.
+
+    ``position`` counts the events applied so far, so that a saved aggregator
+    can be matched up with the input it has already consumed. With
+    ``metrics`` set, every batch of samples and every other event is timed
+    into it, and ``stats`` outputs are extended with its report.
+    """
+
+    def __init__(
+        self,
+        stations: Optional[StationStore] = None,
+        latest_timestamp: Optional[int] = None,
+        position: int = 0,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.stations = StationStore() if stations is None else stations
+        self.latest_timestamp = latest_timestamp
+        self.position = position
+        self.metrics = metrics
+
+    def handle(self, event: Any) -> Optional[dict[str, Any]]:
+        """Apply one event and return its output, if any."""
+        if self.metrics is not None:
+            return self._handle_measured(event, self.metrics)
+        output, self.latest_timestamp = handle_event(event, self.stations, self.latest_timestamp)
+        self.position += 1
+        return output
+
+    def _handle_measured(self, event: Any, metrics: Metrics) -> Optional[dict[str, Any]]:
+        start = time.perf_counter_ns()
+        output, self.latest_timestamp = handle_event(event, self.stations, self.latest_timestamp)
+        self.position += 1
+        end = time.perf_counter_ns()
+        metrics.observe(event, end - start)
+        metrics.tick(end, len(self.stations))
+        if output is not None and output['type'] == 'stats':
+            output.update(metrics.report())
+        return output
+
+    def ingest(self, samples: List[dict[str, Any]]) -> None:
+        """Apply a run of sample events."""
+        metrics = self.metrics
+        if metrics is None:
+            self.latest_timestamp = ingest_samples(samples, self.stations, self.latest_timestamp)
+            self.position += len(samples)
+            return
+        start = time.perf_counter_ns()
+        self.latest_timestamp = ingest_samples(samples, self.stations, self.latest_timestamp)
+        self.position += len(samples)
+        end = time.perf_counter_ns()
+        metrics.observe_samples(len(samples), end - start)
+        metrics.tick(end, len(self.stations))
+
+    def process(
+        self, events: Iterable[dict[str, Any]], batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> Generator[dict[str, Any], None, None]:
+        """Apply events, batching runs of samples, and yield outputs.
+
+        Every event taken from ``events`` has been applied once the generator
+        is exhausted.
+        """
+        run: List[dict[str, Any]] = []
+        for event in events:
+            if isinstance(event, dict) and event.get('type') == 'sample':
+                run.append(event)
+                if len(run) >= batch_size:
+                    self.ingest(run)
+                    run = []
+                continue
+            if run:
+                self.ingest(run)
+                run = []
+            output = self.handle(event)
+            if output is not None:
+                yield output
+        if run:
+            self.ingest(run)
 
 
 def process_events(events: Iterable[dict[str, Any]]) -> Generator[dict[str, Any], None, None]:
-    stations_data: Dict[str, Dict[str, float]] = {}
+    stations_data = StationStore()
     latest_timestamp: Optional[int] = None
 
     for event in events:
+        output, latest_timestamp = handle_event(event, stations_data, latest_timestamp)
+        if output is not None:
+            yield output
+
+
+def process_events_batched(
+    events: Iterable[dict[str, Any]], batch_size: int = DEFAULT_BATCH_SIZE
+) -> Generator[dict[str, Any], None, None]:
+    """Like process_events, but applies runs of up to batch_size samples column-wise."""
+    yield from Aggregator().process(events, batch_size)
+
+
+async def process_events_async(
+    events: AsyncIterable[dict[str, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> AsyncGenerator[dict[str, Any], None]:
+    """Like process_events_batched, for an async iterable of events.
+
+    A producer task moves events into a queue of at most ``queue_size``, so a
+    fast source is held back while the aggregator catches up. Each time the
+    queue is awaited, everything already in it (up to ``batch_size`` events)
+    is applied in one synchronous step, so the scheduling cost is paid per
+    batch rather than per event. Errors from the source are raised after the
+    outputs of the events that preceded them.
+    """
+    queue: asyncio.Queue[Any] = asyncio.Queue(queue_size)
+    end = object()
+    error: Optional[BaseException] = None
+
+    async def produce() -> None:
+        nonlocal error
         try:
-            if not isinstance(event, dict) or 'type' not in event:
-                raise ValueError(
-                    "Please verify input. Event must be a dictionary with 'type' field."
-                )
-
-            event_type = event.get('type')
-            if event_type not in ['sample', 'control']:
-                raise ValueError(f"Please verify input. Unknown message type: {event_type}")
-
-            if event_type == 'sample':
-                latest_timestamp = handle_sample_event(event, stations_data, latest_timestamp)
-            elif event_type == 'control':
-                output, new_timestamp = handle_control_event(event, stations_data, latest_timestamp)
-                if output is not None:
-                    yield output
-                if new_timestamp is None:  # Reset occurred
-                    stations_data.clear()
-                    latest_timestamp = None
-                else:
-                    latest_timestamp = new_timestamp
-
-        except ValueError as e:
-            raise ValueError(str(e)) from e
-        except Exception as e:
-            raise ValueError(f"Please verify input. Unexpected error: {str(e)}") from e
-
-    yield from ()
+            async for event in events:
+                await queue.put(event)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            error = e
+        await queue.put(end)
+
+    producer = asyncio.create_task(produce())
+    aggregator = Aggregator()
+    try:
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            finished = batch[-1] is end
+            if finished:
+                batch.pop()
+            for output in aggregator.process(batch, batch_size):
+                yield output
+            if finished:
+                break
+        if error is not None:
+            raise error
+    finally:
+        producer.cancel()
@@ -1,3 +1,6 @@
+import asyncio
+import io
+import json
 import pytest
 from . import weather
 
@@ -79,6 +82,59 @@ def test_reset_clears_data():
     assert len(result) == 1  # only reset output, no snapshot after reset
     assert result[0]["type"] == "reset"
 
+def test_snapshot_delta_output():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "sample", "stationName": "B", "timestamp": 2, "temperature": 15.0},
+        {"type": "control", "command": "snapshot"},
+        {"type": "sample", "stationName": "A", "timestamp": 3, "temperature": 10.0},
+        {"type": "sample", "stationName": "B", "timestamp": 4, "temperature": 16.0},
+        {"type": "sample", "stationName": "C", "timestamp": 5, "temperature": 1.0},
+        {"type": "control", "command": "snapshot_delta"},
+        {"type": "control", "command": "snapshot_delta"},
+    ]
+    result = list(weather.process_events(events))
+    assert result[1:] == [
+        {
+            "type": "snapshot_delta",
+            "asOf": 5,
+            "stations": {
+                "B": {"high": 16.0, "low": 15.0},
+                "C": {"high": 1.0, "low": 1.0},
+            },
+        },
+        {"type": "snapshot_delta", "asOf": 5, "stations": {}},
+    ]
+
+def test_snapshot_delta_without_data():
+    events = [{"type": "control", "command": "snapshot_delta"}]
+    result = list(weather.process_events(events))
+    assert not result
+
+def test_snapshots_are_point_in_time():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "control", "command": "snapshot"},
+        {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": 20.0},
+        {"type": "control", "command": "snapshot"},
+    ]
+    first, second = list(weather.process_events(events))
+    assert first["stations"]["A"] == {"high": 10.0, "low": 10.0}
+    assert second["stations"]["A"] == {"high": 20.0, "low": 10.0}
+
+def test_snapshot_outputs_are_read_only():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "control", "command": "snapshot"},
+        {"type": "control", "command": "snapshot"},
+    ]
+    first, second = list(weather.process_events(events))
+    with pytest.raises(TypeError):
+        first["stations"].pop("A")
+    with pytest.raises(TypeError):
+        first["stations"]["A"]["high"] = 99.0
+    assert second["stations"] == {"A": {"high": 10.0, "low": 10.0}}
+
 def test_unknown_control_command():
     events = [{"type": "control", "command": "unknown"}]
     with pytest.raises(ValueError, match="Please verify input. Unknown control command: unknown"):
@@ -443,3 +499,211 @@ def test_duplicate_timestamps():
     assert result[0]["stations"]["A"]["low"] == 10.0
     assert result[0]["stations"]["B"]["high"] == 30.0
     assert result[0]["stations"]["B"]["low"] == 30.0
+
+@pytest.mark.parametrize("batch_size", [1, 2, 3, 4096])
+def test_batched_matches_process_events(batch_size):
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10},
+        {"type": "sample", "stationName": "B", "timestamp": 2, "temperature": 15.5},
+        {"type": "sample", "stationName": "A", "timestamp": True, "temperature": -3.0},
+        {"type": "control", "command": "snapshot"},
+        {"type": "sample", "stationName": "B", "timestamp": 4, "temperature": 99.0},
+        {"type": "sample", "stationName": "C", "timestamp": 3, "temperature": 0},
+        {"type": "control", "command": "snapshot_delta"},
+        {"type": "control", "command": "reset"},
+        {"type": "control", "command": "snapshot"},
+        {"type": "sample", "stationName": "C", "timestamp": 5, "temperature": 1.0},
+        {"type": "control", "command": "snapshot"},
+    ]
+    expected = list(weather.process_events(events))
+    assert list(weather.process_events_batched(events, batch_size)) == expected
+
+def test_batched_reports_first_invalid_sample():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": "hot"},
+        {"type": "sample", "stationName": "A", "timestamp": 3},
+    ]
+    with pytest.raises(ValueError, match="Please verify input. temperature must be a number."):
+        list(weather.process_events_batched(events))
+
+def test_batched_reports_temperature_too_large_for_a_float():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10},
+        {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": 10**400},
+        {"type": "control", "command": "snapshot"},
+    ]
+    message = "Please verify input. Unexpected error: int too large to convert to float"
+    for process in (weather.process_events, weather.process_events_batched):
+        with pytest.raises(ValueError, match=message):
+            list(process(events))
+    aggregator = weather.Aggregator()
+    with pytest.raises(ValueError, match=message):
+        list(aggregator.process(events))
+    assert aggregator.stations.snapshot() == {"A": {"high": 10.0, "low": 10.0}}
+
+def test_batched_validates_trailing_run():
+    events = [{"type": "sample", "stationName": "A", "timestamp": 1}]
+    with pytest.raises(ValueError, match="Please verify input. Sample must contain"):
+        list(weather.process_events_batched(events))
+
+def test_unhashable_type_and_command():
+    with pytest.raises(ValueError, match=r"Unknown message type: \['sample'\]"):
+        list(weather.process_events([{"type": ["sample"]}]))
+    with pytest.raises(ValueError, match=r"Please verify input. Unknown control command: \{\}"):
+        list(weather.process_events([{"type": "control", "command": {}}]))
+
+def test_stats_output():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "sample", "stationName": "B", "timestamp": 2, "temperature": 20.0},
+        {"type": "control", "command": "stats"},
+    ]
+    result = list(weather.process_events(events))
+    assert result == [{"type": "stats", "asOf": 2, "stations": 2}]
+
+def test_stats_without_data_is_answered():
+    events = [
+        {"type": "control", "command": "stats"},
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "control", "command": "reset"},
+        {"type": "control", "command": "stats"},
+        {"type": "control", "command": "snapshot"},
+    ]
+    expected = [
+        {"type": "stats", "asOf": None, "stations": 0},
+        {"type": "reset", "asOf": 1},
+        {"type": "stats", "asOf": None, "stations": 0},
+    ]
+    assert list(weather.process_events(events)) == expected
+    assert list(weather.process_events_batched(events)) == expected
+
+def test_aggregator_stats_include_metrics():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0},
+        {"type": "sample", "stationName": "A", "timestamp": 2, "temperature": 20.0},
+        {"type": "control", "command": "snapshot"},
+        {"type": "control", "command": "stats"},
+    ]
+    metrics = weather.Metrics()
+    result = list(weather.Aggregator(metrics=metrics).process(events))
+    assert result[0] == list(weather.process_events(events))[0]
+    stats = result[1]
+    assert stats["stations"] == 1
+    assert stats["events"] == {"sample": 2, "control": 2}
+    assert stats["commands"] == {"snapshot": 1, "stats": 1}
+    assert stats["timings"]["sample"]["count"] == 1  # one batch
+    assert stats["timings"]["snapshot"]["count"] == 1
+
+def test_aggregator_dumps_metrics_periodically():
+    dump = io.StringIO()
+    metrics = weather.Metrics(dump, dump_interval_s=1e-9)
+    events = [{"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 10.0}]
+    assert not list(weather.Aggregator(metrics=metrics).process(events))
+    report = json.loads(dump.getvalue().splitlines()[-1])
+    assert report["stations"] == 1
+    assert report["events"] == {"sample": 1}
+
+def test_histogram_percentiles():
+    histogram = weather.Histogram()
+    for duration in [100, 200, 300, 5000]:
+        histogram.record(duration)
+    assert histogram.percentile(0.5) == 255
+    assert histogram.percentile(1.0) == 5000
+    assert histogram.summary()["count"] == 4
+
+def test_snapshot_queries():
+    events = [
+        {"type": "sample", "stationName": "Beach A", "timestamp": 1, "temperature": 30.0},
+        {"type": "sample", "stationName": "Beach B", "timestamp": 2, "temperature": 10.0},
+        {"type": "sample", "stationName": "Park C", "timestamp": 3, "temperature": 20.0},
+        {"type": "control", "command": "snapshot", "topHigh": 2},
+        {"type": "control", "command": "snapshot", "topLow": 1, "prefix": "Beach"},
+        {"type": "control", "command": "snapshot", "stations": ["Park C", "Nowhere"]},
+    ]
+    outputs = list(weather.process_events(events))
+    assert [list(output["stations"]) for output in outputs] == [
+        ["Beach A", "Park C"], ["Beach B"], ["Park C"],
+    ]
+    assert all(output["type"] == "snapshot" and output["asOf"] == 3 for output in outputs)
+
+@pytest.mark.parametrize("field, value", [
+    ("topHigh", -1), ("topLow", "3"), ("topHigh", True), ("stations", "A"),
+    ("stations", [1]), ("prefix", 5),
+])
+def test_snapshot_query_validation(field, value):
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0},
+        {"type": "control", "command": "snapshot", field: value},
+    ]
+    with pytest.raises(ValueError, match=f"Please verify input. {field} must be"):
+        list(weather.process_events(events))
+
+async def from_list(events, consumed=None):
+    for event in events:
+        if consumed is not None:
+            consumed.append(event)
+        yield event
+
+async def collect(outputs):
+    return [output async for output in outputs]
+
+@pytest.mark.parametrize("batch_size, queue_size", [(1, 1), (3, 2), (4096, 16384)])
+def test_async_matches_process_events(batch_size, queue_size):
+    events = [
+        {"type": "sample", "stationName": f"S{i % 7}", "timestamp": i, "temperature": i % 13}
+        for i in range(500)
+    ]
+    for i in range(0, 500, 37):
+        events.insert(i, {"type": "control", "command": "snapshot"})
+    outputs = weather.process_events_async(from_list(events), batch_size, queue_size)
+    assert asyncio.run(collect(outputs)) == list(weather.process_events(events))
+
+def test_async_queue_holds_back_producer():
+    events = [{"type": "control", "command": "snapshot"}] * 100
+    events[0] = {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0}
+    consumed = []
+
+    async def run():
+        outputs = weather.process_events_async(from_list(events, consumed), 2, queue_size=5)
+        lag = []
+        count = 0
+        async for _ in outputs:
+            count += 1
+            lag.append(len(consumed) - count)
+        return max(lag)
+
+    # Queue, one batch in hand and the event waiting on a full queue.
+    assert asyncio.run(run()) <= 5 + 2 + 1
+
+def test_async_reports_errors_after_earlier_outputs():
+    events = [
+        {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0},
+        {"type": "control", "command": "snapshot"},
+        {"type": "bogus"},
+    ]
+    outputs = []
+
+    async def run():
+        async for output in weather.process_events_async(from_list(events), 1, 1):
+            outputs.append(output)
+
+    with pytest.raises(ValueError, match="Unknown message type: bogus"):
+        asyncio.run(run())
+    assert [output["type"] for output in outputs] == ["snapshot"]
+
+def test_async_reraises_source_errors():
+    async def failing():
+        yield {"type": "sample", "stationName": "A", "timestamp": 1, "temperature": 1.0}
+        yield {"type": "control", "command": "snapshot"}
+        raise OSError("connection lost")
+
+    outputs = []
+
+    async def run():
+        async for output in weather.process_events_async(failing()):
+            outputs.append(output)
+
+    with pytest.raises(OSError, match="connection lost"):
+        asyncio.run(run())
+    assert len(outputs) == 1
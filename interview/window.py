@@ -0,0 +1,100 @@
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+from .state import Row, StationStore
+
+# (timestamp, temperature) entries, oldest first
+Entries = Deque[Tuple[int, float]]
+
+
+class StationWindow:
+    """High/low of one station over a sliding time window.
+
+    Two monotonic deques hold the only samples that can still become the
+    window maximum (decreasing temperatures) or minimum (increasing
+    temperatures), so each sample is pushed and popped at most once.
+    """
+
+    __slots__ = ('highs', 'lows')
+
+    def __init__(self) -> None:
+        self.highs: Entries = deque()
+        self.lows: Entries = deque()
+
+    def add(self, timestamp: int, temperature: float) -> None:
+        """Add a sample; timestamps must not decrease."""
+        highs, lows = self.highs, self.lows
+        while highs and highs[-1][1] <= temperature:
+            highs.pop()
+        highs.append((timestamp, temperature))
+        while lows and lows[-1][1] >= temperature:
+            lows.pop()
+        lows.append((timestamp, temperature))
+
+    def expire(self, cutoff: int) -> bool:
+        """Drop samples at or before cutoff and return whether any remain."""
+        highs, lows = self.highs, self.lows
+        while highs and highs[0][0] <= cutoff:
+            highs.popleft()
+        while lows and lows[0][0] <= cutoff:
+            lows.popleft()
+        return bool(highs)
+
+    def row(self) -> Row:
+        """The window high and low."""
+        return {'high': self.highs[0][1], 'low': self.lows[0][1]}
+
+
+class WindowedStationStore(StationStore):
+    """A StationStore that also keeps high/low over the last ``window_ms`` milliseconds.
+
+    The window ends at the latest sample timestamp and excludes samples at or
+    before ``asOf - window_ms``. Memory is bounded by the samples inside the
+    window, not by the length of the stream.
+    """
+
+    def __init__(self, window_ms: int) -> None:
+        super().__init__()
+        self.window_ms = window_ms
+        self._windows: Dict[str, StationWindow] = {}
+        self._window_latest = 0
+
+    def add_sample(self, station: str, timestamp: int, temperature: float) -> None:
+        """Fold a sample into the all-time and windowed aggregates."""
+        self.update(station, temperature)
+        self._add_to_window(station, timestamp, temperature)
+
+    def add_samples(
+        self, stations: List[str], timestamps: List[int], temperatures: List[float]
+    ) -> None:
+        self.update_many(stations, temperatures)
+        add = self._add_to_window
+        for station, timestamp, temperature in zip(stations, timestamps, temperatures):
+            add(station, timestamp, temperature)
+
+    def _add_to_window(self, station: str, timestamp: int, temperature: float) -> None:
+        window = self._windows.get(station)
+        if window is None:
+            window = self._windows[station] = StationWindow()
+        elif timestamp < self._window_latest:
+            # Keep each deque ordered when a sample arrives out of order; it
+            # then expires with the newest sample seen so far.
+            timestamp = self._window_latest
+        self._window_latest = max(self._window_latest, timestamp)
+        window.add(timestamp, float(temperature))
+        window.expire(timestamp - self.window_ms)
+
+    def clear(self) -> None:
+        super().clear()
+        self._windows = {}
+        self._window_latest = 0
+
+    def window_snapshot(self, latest_timestamp: int) -> Dict[str, Row]:
+        """High/low per station over the window ending at latest_timestamp."""
+        cutoff = latest_timestamp - self.window_ms
+        stations = {}
+        for name, window in list(self._windows.items()):
+            if window.expire(cutoff):
+                stations[name] = window.row()
+            else:
+                del self._windows[name]
+        return stations
@@ -0,0 +1,71 @@
+import random
+import pytest
+from . import weather
+from .window import StationWindow, WindowedStationStore
+
+def test_station_window_matches_brute_force():
+    rng = random.Random(0)
+    window = StationWindow()
+    samples = []
+    for timestamp in range(0, 5000, 7):
+        temperature = rng.uniform(-10.0, 40.0)
+        samples.append((timestamp, temperature))
+        window.add(timestamp, temperature)
+        cutoff = timestamp - 100
+        assert window.expire(cutoff)
+        in_window = [t for ts, t in samples if ts > cutoff]
+        assert window.row() == {"high": max(in_window), "low": min(in_window)}
+
+def test_station_window_memory_is_bounded_by_window():
+    window = StationWindow()
+    for timestamp in range(100_000):
+        window.add(timestamp, float(timestamp % 1000))
+        window.expire(timestamp - 50)
+    assert len(window.highs) <= 50
+    assert len(window.lows) <= 50
+
+def test_window_snapshot_drops_idle_stations():
+    store = WindowedStationStore(window_ms=10)
+    store.add_sample("A", 1, 5.0)
+    store.add_sample("B", 5, 7.0)
+    store.add_sample("A", 12, 3.0)
+    assert store.window_snapshot(12) == {
+        "A": {"high": 3.0, "low": 3.0},
+        "B": {"high": 7.0, "low": 7.0},
+    }
+    assert store.window_snapshot(15) == {"A": {"high": 3.0, "low": 3.0}}
+    assert store.snapshot() == {
+        "A": {"high": 5.0, "low": 3.0},
+        "B": {"high": 7.0, "low": 7.0},
+    }
+
+def test_clear_drops_windows():
+    store = WindowedStationStore(window_ms=10)
+    store.add_sample("A", 1, 5.0)
+    store.clear()
+    assert not store.window_snapshot(1)
+
+EVENTS = [
+    {"type": "sample", "stationName": "A", "timestamp": 1000, "temperature": 10},
+    {"type": "sample", "stationName": "B", "timestamp": 1500, "temperature": 30.0},
+    {"type": "sample", "stationName": "A", "timestamp": 2000, "temperature": 20.0},
+    {"type": "sample", "stationName": "A", "timestamp": 2600, "temperature": 15.0},
+    {"type": "control", "command": "window_snapshot"},
+    {"type": "control", "command": "snapshot"},
+]
+
+@pytest.mark.parametrize("batch_size", [1, 4096])
+def test_window_snapshot_command(batch_size):
+    aggregator = weather.Aggregator(WindowedStationStore(window_ms=1000))
+    window, snapshot = list(aggregator.process(EVENTS, batch_size))
+    assert window == {
+        "type": "window_snapshot",
+        "asOf": 2600,
+        "windowMs": 1000,
+        "stations": {"A": {"high": 20.0, "low": 15.0}},
+    }
+    assert snapshot["stations"]["A"] == {"high": 20.0, "low": 10.0}
+
+def test_window_snapshot_requires_window():
+    with pytest.raises(ValueError, match="Please verify input. window_snapshot requires"):
+        list(weather.process_events(EVENTS))